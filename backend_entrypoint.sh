@@ -29,6 +29,17 @@ cmd_run() {
         ~/manage.py collectstatic --no-input
     fi
 
+    # a local Qdrant lives in one process: init_index builds the index and exits
+    # before a single server worker opens the same storage folder
+    if [ -n "${QDRANT_PATH:-}" ]; then
+        if [ "${QDRANT_PATH}" = ":memory:" ]; then
+            fail "QDRANT_PATH=:memory: is for tests and benchmarks, the index built by init_index would be lost"
+        fi
+        if [ "${NUMPROCS:-1}" != "1" ]; then
+            fail "a local Qdrant storage folder is locked by one process, set NUMPROCS=1 or use the Qdrant server"
+        fi
+    fi
+
     wait_for_db
 
     echo "waiting for migrations to complete..."
@@ -36,6 +47,12 @@ cmd_run() {
         sleep 10
     done
 
+    # metrics of all processes are aggregated from files in this folder,
+    # stale ones of a previous run are removed
+    export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+    rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+    mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
     echo "running init index..."
     ~/manage.py init_index
 
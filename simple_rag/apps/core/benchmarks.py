@@ -0,0 +1,211 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import shutil
+import platform
+import tempfile
+import subprocess
+from os import path as osp
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from django.conf import settings
+from llama_index.core.schema import Document
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from simple_rag.apps.core.cache import LRUCache
+from simple_rag.apps.core.manifest import FileManifest
+from simple_rag.apps.core.models import BenchmarkReport, BenchmarkResult
+from simple_rag.apps.core.pipeline import (CustomTextSplitter, process_review, process_text, process_texts,
+    sparse_doc_vectors, sparse_query_vectors, tf_doc_vectors, get_nlp, get_lemma_cache, get_vectorizer)
+from simple_rag.apps.core.utils import LazyResource, filter_documents, list_dataset_files
+
+T = TypeVar('T')
+
+def load_review_texts(base_path: str = settings.DATASETS_ROOT) -> List[str]:
+    """
+    Load the full review texts of all dataset files in a folder,
+    formatted the same way as ProcessTextTransformer does.
+    """
+    splitter = CustomTextSplitter()
+    texts = []
+    for file_path in list_dataset_files(base_path):
+        with open(file_path, encoding='utf-8') as f:
+            for part in splitter.split_text(f.read()):
+                review = process_review(part)
+                if review is not None and review['text']:
+                    texts.append(f"{review['name_ru']} {review['rubrics']} {review['text']}")
+    return texts
+
+def scale_dataset(base_path: str, scale: int, target_path: str) -> List[str]:
+    """
+    Write scale copies of each dataset file of base_path to target_path,
+    a synthetic corpus with scale times the reviews. Returns the written paths.
+    """
+    os.makedirs(target_path, exist_ok=True)
+    file_paths = []
+    for file_path in list_dataset_files(base_path):
+        name, ext = osp.splitext(osp.basename(file_path))
+        for i in range(scale):
+            target = osp.join(target_path, f'{name}_{i}{ext}')
+            shutil.copyfile(file_path, target)
+            file_paths.append(target)
+    return file_paths
+
+def measure(
+    name: str,
+    fn: Callable[[], Any],
+    items: int,
+    scale: int = 1,
+    repeat: int = 3,
+    setup: Optional[Callable[[], Any]] = None,
+) -> BenchmarkResult:
+    """
+    Time fn repeat times, setup runs untimed before each repetition.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        fn()
+        timings.append(perf_counter() - start)
+    return BenchmarkResult(
+        name=name,
+        scale=scale,
+        items=items,
+        repeat=repeat,
+        best_seconds=min(timings),
+        mean_seconds=sum(timings) / len(timings),
+    )
+
+@contextmanager
+def replaced(resource: LazyResource[T], value: T):
+    """
+    Use value as the resource within the block, then restore the previous one,
+    so benchmarks neither read nor overwrite the persisted caches.
+    """
+    previous = resource() if resource.loaded else None
+    was_loaded = resource.loaded
+    resource.set(value)
+    try:
+        yield
+    finally:
+        if was_loaded:
+            resource.set(previous)
+        else:
+            resource.reset()
+
+def run_benchmarks(
+    file_paths: List[str],
+    scale: int = 1,
+    repeat: int = 3,
+    nlp_limit: Optional[int] = 500,
+) -> List[BenchmarkResult]:
+    """
+    Benchmark the ingestion hot paths on the given dataset files:
+    splitting, review parsing, normalization, sparse vectors and change detection.
+    spaCy normalization runs on the first nlp_limit reviews only, it is orders
+    of magnitude slower than the other stages.
+    """
+    raw_texts = []
+    for file_path in file_paths:
+        with open(file_path, encoding='utf-8') as f:
+            raw_texts.append(f.read())
+
+    splitter = CustomTextSplitter()
+    parts = [part for text in raw_texts for part in splitter.split_text(text)]
+    reviews = [review for review in map(process_review, parts) if review is not None and review['text']]
+    texts = [f"{review['name_ru']} {review['rubrics']} {review['text']}" for review in reviews]
+    nlp_texts = texts[:nlp_limit]
+    get_nlp()
+
+    results = [
+        measure('split_text', lambda: [splitter.split_text(text) for text in raw_texts],
+            len(parts), scale, repeat),
+        measure('process_review', lambda: [process_review(part) for part in parts],
+            len(parts), scale, repeat),
+    ]
+
+    with replaced(get_lemma_cache, None):
+        results.append(measure('process_text', lambda: [process_text(text) for text in nlp_texts],
+            len(nlp_texts), scale, repeat))
+        results.append(measure('process_texts', lambda: list(process_texts(nlp_texts, n_process=1)),
+            len(nlp_texts), scale, repeat))
+
+    max_size = settings.RAG_SETTINGS['NLP']['LEMMA_CACHE']['MAX_SIZE']
+    if max_size:
+        with replaced(get_lemma_cache, LRUCache(max_size)):
+            # the first pass fills the cache, the timed ones only tokenize
+            for text in nlp_texts:
+                process_text(text)
+            results.append(measure('process_text_cached', lambda: [process_text(text) for text in nlp_texts],
+                len(nlp_texts), scale, repeat))
+
+    # raw texts are enough here, only the number of terms matters
+    with replaced(get_vectorizer, (TfidfVectorizer().fit(texts), 0)):
+        results.append(measure('sparse_doc_vectors', lambda: sparse_doc_vectors(texts),
+            len(texts), scale, repeat))
+        # queries are encoded one at a time when served
+        queries = nlp_texts
+        results.append(measure('sparse_query_vectors', lambda: [sparse_query_vectors([query]) for query in queries],
+            len(queries), scale, repeat))
+    results.append(measure('tf_doc_vectors', lambda: tf_doc_vectors(texts), len(texts), scale, repeat))
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        # the legacy check of unchanged files, which hashes every file
+        documents = [Document(text='', metadata={'file_path': file_path}) for file_path in file_paths]
+        cache_path = osp.join(tmp_path, 'documents_info.pkl')
+        filter_documents(documents, cache_path)
+        results.append(measure('filter_documents', lambda: filter_documents(documents, cache_path),
+            len(file_paths), scale, repeat))
+
+        manifest = FileManifest(osp.join(tmp_path, 'manifest.sqlite3'))
+        manifest.save(manifest.scan(file_paths))
+        results.append(measure('manifest_scan', lambda: manifest.scan(file_paths),
+            len(file_paths), scale, repeat))
+        manifest.close()
+
+    return results
+
+def git_commit() -> Optional[str]:
+    """
+    Return the commit of the working tree, if it is a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def create_report(dataset: str, results: List[BenchmarkResult]) -> BenchmarkReport:
+    """
+    Wrap benchmark results with the environment they were measured in.
+    """
+    return BenchmarkReport(
+        created=datetime.now(timezone.utc).isoformat(),
+        commit=git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpu_count=os.cpu_count() or 1,
+        nlp_profile=settings.RAG_SETTINGS['NLP']['PROFILE'],
+        dataset=dataset,
+        results=results,
+    )
+
+def compare_reports(baseline: BenchmarkReport, current: BenchmarkReport) -> Dict[Tuple[str, int], float]:
+    """
+    Return the ratio of the current to the baseline best time of each benchmark
+    and scale found in both reports, above 1 is slower.
+    """
+    baseline_times = {(result.name, result.scale): result.best_seconds for result in baseline.results}
+    return {
+        (result.name, result.scale): result.best_seconds / baseline_times[(result.name, result.scale)]
+        for result in current.results
+        if baseline_times.get((result.name, result.scale))
+    }
@@ -0,0 +1,199 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+import joblib
+from django.conf import settings
+from django.core.cache import cache as default_cache
+
+from simple_rag.apps.core.metrics import count_lookup
+from simple_rag.apps.core.models import CacheStats, QueryRequest
+
+INDEX_GENERATION_KEY = 'rag:index_generation'
+
+class LRUCache:
+    """
+    A bounded, thread-safe least recently used cache with hit and miss counters.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # whether entries were added since the last save or load
+        self.modified = False
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value for a key and mark it as recently used.
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Cache a value, evicting the least recently used entries above max_size.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.modified = True
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> CacheStats:
+        lookups = self.hits + self.misses
+        return CacheStats(
+            size=len(self._data),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
+
+    def save(self, path: str):
+        """
+        Persist the cached entries, least recently used first.
+        The file is replaced atomically so concurrent writers never leave it truncated.
+        """
+        with self._lock:
+            items = list(self._data.items())
+            self.modified = False
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        joblib.dump(items, tmp_path)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        """
+        Load entries persisted by save, if any.
+        """
+        if not os.path.exists(path):
+            return
+        for key, value in joblib.load(path):
+            self.set(key, value)
+        self.modified = False
+
+def get_index_generation() -> int:
+    """
+    Return the current index generation, bumped by init_index on every change of the index.
+    """
+    return default_cache.get(INDEX_GENERATION_KEY, 0)
+
+def results_tag(generation: int) -> str:
+    return f'rag:results:{generation}'
+
+def bump_index_generation() -> int:
+    """
+    Increment the index generation, invalidating all cached query results.
+    With diskcache, results of the previous generation and expired entries are
+    also removed, as nothing can read them anymore.
+    """
+    default_cache.add(INDEX_GENERATION_KEY, 0)
+    generation = default_cache.incr(INDEX_GENERATION_KEY)
+    if hasattr(default_cache, 'evict'):
+        default_cache.evict(results_tag(generation - 1))
+        default_cache.expire()
+    return generation
+
+class QueryResultCache:
+    """
+    A cache of query results in the Django cache, shared by all workers.
+    Raw query texts map to their normalized tokens, and normalized queries with
+    their parameters map to results of the current index generation, so a
+    repeated query needs neither spaCy nor the vector store.
+    """
+    def __init__(
+        self,
+        enabled: bool = settings.USE_CACHE,
+        timeout: Optional[int] = settings.RAG_SETTINGS['QUERY']['CACHE_TIMEOUT'],
+    ):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(prefix: str, **parts) -> str:
+        digest = hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode())
+        return f'rag:{prefix}:{digest.hexdigest()}'
+
+    def _get(self, name: str, key: str) -> Any:
+        value = default_cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        count_lookup(name, hit=value is not None)
+        return value
+
+    def _tokens_key(self, text: str) -> str:
+        # tokens depend on the normalization model and profile
+        return self._key(
+            'tokens',
+            text=text,
+            model=settings.RAG_SETTINGS['NLP']['MODEL'],
+            profile=settings.RAG_SETTINGS['NLP']['PROFILE'],
+        )
+
+    def get_tokens(self, text: str) -> Optional[List[str]]:
+        if not self.enabled:
+            return None
+        return self._get('query_tokens', self._tokens_key(text))
+
+    def set_tokens(self, text: str, tokens: List[str]):
+        if self.enabled:
+            default_cache.set(self._tokens_key(text), tokens, self.timeout)
+
+    def _results_key(self, query: str, generation: int, **params) -> str:
+        return self._key('results', query=query, generation=generation, **params)
+
+    def get_results(self, query: str, **params) -> Optional[List[QueryRequest]]:
+        """
+        Return cached results of a normalized query, e.g. for given top_k and mode params.
+        """
+        if not self.enabled:
+            return None
+        return self._get('query_results', self._results_key(query, get_index_generation(), **params))
+
+    def set_results(self, query: str, results: List[QueryRequest], **params):
+        if not self.enabled:
+            return
+        generation = get_index_generation()
+        key = self._results_key(query, generation, **params)
+        if hasattr(default_cache, 'evict'):
+            # diskcache tags results by generation, see bump_index_generation
+            default_cache.set(key, results, self.timeout, tag=results_tag(generation))
+        else:
+            default_cache.set(key, results, self.timeout)
+
+    def stats(self) -> CacheStats:
+        lookups = self.hits + self.misses
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+        )
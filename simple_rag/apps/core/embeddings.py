@@ -0,0 +1,148 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import re
+import atexit
+import hashlib
+import threading
+from contextlib import nullcontext
+from os import path as osp
+from typing import Any, List, Optional
+
+import numpy as np
+import spacy
+from spacy.language import Language
+from django.conf import settings
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import Field, PrivateAttr
+from threadpoolctl import threadpool_limits
+
+from simple_rag.apps.core.cache import LRUCache
+
+def embedding_cache_path(model: str) -> str:
+    # embeddings depend on the model, so does the persisted cache
+    slug = re.sub(r'[^\w.-]+', '_', model).strip('_')
+    return osp.join(settings.CACHE_ROOT, f'embedding_cache_{slug}.pkl')
+
+class SpacyEmbedding(BaseEmbedding):
+    """
+    Dense embeddings computed offline on CPU with a spaCy pipeline, either installed
+    or saved at a local path: the unit normalized mean of the static word vectors of
+    the tokens, or of their tok2vec tensors for pipelines without static vectors.
+    The pipeline and the persisted cache are loaded on first use. Embeddings are
+    cached by the hash of their text, so unchanged reviews are not encoded again.
+    """
+    n_process: int = Field(default=1, description='Number of processes of nlp.pipe.')
+    threads: Optional[int] = Field(default=None, description='Threads of the numerical libraries while encoding.')
+    exclude: List[str] = Field(default_factory=list, description='Pipeline components not loaded.')
+    cache_size: int = Field(default=0, description='Maximum number of cached embeddings, 0 disables the cache.')
+    persist_cache: bool = Field(default=False, description='Whether the cache is persisted to CACHE_ROOT.')
+
+    _nlp: Optional[Language] = PrivateAttr(default=None)
+    _cache: Optional[LRUCache] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return 'SpacyEmbedding'
+
+    def _load(self):
+        with self._lock:
+            if self._nlp is not None:
+                return
+            if self.cache_size:
+                self._cache = LRUCache(self.cache_size)
+                if self.persist_cache:
+                    self._cache.load(embedding_cache_path(self.model_name))
+                    atexit.register(self.save_cache)
+            self._nlp = spacy.load(self.model_name, exclude=self.exclude)
+
+    @property
+    def nlp(self) -> Language:
+        self._load()
+        return self._nlp
+
+    @property
+    def cache(self) -> Optional[LRUCache]:
+        self._load()
+        return self._cache
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Return the unit normalized embeddings of texts, without the cache.
+        The numerical libraries use at most threads threads meanwhile.
+        """
+        nlp = self.nlp
+        if nlp.vocab.vectors.shape[0]:
+            # static vectors only need the tokenizer
+            docs = (nlp.make_doc(text) for text in texts)
+        else:
+            docs = nlp.pipe(texts, batch_size=self.embed_batch_size, n_process=self.n_process)
+        # docs are processed lazily in here, limits apply to the whole process while set
+        with nullcontext() if self.threads is None else threadpool_limits(limits=self.threads):
+            vectors = np.array([doc.vector for doc in docs], dtype=np.float32)
+        if vectors.ndim != 2 or not vectors.shape[1]:
+            raise ValueError(f"spaCy pipeline '{self.model_name}' has neither word vectors nor tok2vec")
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        cache = self.cache
+        if cache is None:
+            return self.encode(texts).tolist()
+
+        keys = [hashlib.sha256(text.encode()).hexdigest() for text in texts]
+        embeddings = [cache.get(key) for key in keys]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if misses:
+            for i, embedding in zip(misses, self.encode([texts[i] for i in misses])):
+                cache.set(keys[i], embedding)
+                embeddings[i] = embedding
+        return [embedding.tolist() for embedding in embeddings]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embeddings([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def save_cache(self):
+        """
+        Persist the embedding cache to CACHE_ROOT.
+        """
+        if self._cache is not None and self._cache.modified:
+            self._cache.save(embedding_cache_path(self.model_name))
+
+def load_embed_model() -> Any:
+    """
+    Return the configured embedding model: RAG_SETTINGS['EMBED_MODEL'] if set, e.g. any
+    llama-index embedding, else a SpacyEmbedding of RAG_SETTINGS['EMBEDDING']['MODEL'].
+    Returns None if dense embeddings are disabled.
+    """
+    if settings.RAG_SETTINGS['EMBED_MODEL'] is not None:
+        return settings.RAG_SETTINGS['EMBED_MODEL']
+
+    embedding_settings = settings.RAG_SETTINGS['EMBEDDING']
+    if not embedding_settings['MODEL']:
+        return None
+
+    return SpacyEmbedding(
+        model_name=embedding_settings['MODEL'],
+        embed_batch_size=embedding_settings['BATCH_SIZE'],
+        n_process=embedding_settings['N_PROCESS'],
+        threads=embedding_settings['THREADS'],
+        exclude=embedding_settings['EXCLUDE'],
+        cache_size=embedding_settings['CACHE']['MAX_SIZE'],
+        persist_cache=embedding_settings['CACHE']['PERSIST'],
+    )
+
+def embedding_size() -> int:
+    """
+    Return the size of the dense vectors of the current embedding model.
+    """
+    return len(Settings.embed_model.get_query_embedding('size'))
@@ -0,0 +1,429 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import pickle
+import queue
+import threading
+import tempfile
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, islice
+from time import perf_counter
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from django.conf import settings
+from llama_index.core import Settings, VectorStoreIndex, StorageContext
+from llama_index.core.indices.utils import embed_nodes
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, Document, MetadataMode
+from llama_index.core.utils import get_tqdm_iterable
+from qdrant_client.http import models as rest
+
+from simple_rag.apps.core.metrics import INGEST_ITEMS, INGEST_STAGE_SECONDS
+from simple_rag.apps.core.models import StageStats
+from simple_rag.apps.core.pipeline import pipeline, fit_vectorizer, get_nlp, get_lemma_cache
+from simple_rag.apps.core.qdrant import (
+    CompactQdrantVectorStore, is_local_client, create_payload_indexes, get_file_point_ids, delete_points,
+)
+from simple_rag.apps.core.utils import iter_review_documents
+
+def timed(fn: Callable, *args) -> Tuple[Any, float]:
+    """
+    Call fn and return its result with the time it took.
+    """
+    start = perf_counter()
+    result = fn(*args)
+    return result, perf_counter() - start
+
+def transform_window(documents: List[Document]) -> List[BaseNode]:
+    """
+    Run the pipeline over a window of documents, in a normalization worker.
+    """
+    return run_transformations(documents, pipeline)
+
+# estimated bytes of the parts of a point in an upload request, as JSON, the larger encoding
+POINT_OVERHEAD_BYTES = 64
+SPARSE_VALUE_BYTES = 28
+DENSE_VALUE_BYTES = 20
+
+def estimate_point_size(point: Union[rest.PointStruct, rest.PointVectors]) -> int:
+    """
+    Estimate the size of a point in an upload request from its vectors and payload,
+    or of the vectors of a point in an update request.
+    """
+    size = POINT_OVERHEAD_BYTES
+    vectors = point.vector.values() if isinstance(point.vector, dict) else [point.vector]
+    for vector in vectors:
+        if isinstance(vector, rest.SparseVector):
+            size += len(vector.indices) * SPARSE_VALUE_BYTES
+        else:
+            size += len(vector) * DENSE_VALUE_BYTES
+    for key, value in (getattr(point, 'payload', None) or {}).items():
+        size += len(key) + len(value.encode() if isinstance(value, str) else str(value))
+    return size
+
+def batches_by_size(
+    points: Iterable[Union[rest.PointStruct, rest.PointVectors]],
+    max_bytes: int,
+) -> Iterator[Tuple[List[Union[rest.PointStruct, rest.PointVectors]], int]]:
+    """
+    Group points into batches of at most max_bytes estimated request size,
+    a larger point gets a batch of its own. Yields each batch with its size.
+    """
+    batch = []
+    batch_bytes = 0
+    for point in points:
+        size = estimate_point_size(point)
+        if batch and batch_bytes + size > max_bytes:
+            yield batch, batch_bytes
+            batch = []
+            batch_bytes = 0
+        batch.append(point)
+        batch_bytes += size
+    if batch:
+        yield batch, batch_bytes
+
+def read_spooled_nodes(spool: IO[bytes]) -> Iterator[BaseNode]:
+    """
+    Yield the nodes pickled one after the other to a spool file.
+    """
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+def windows(items: Iterable, window_size: int) -> Iterator[List]:
+    items = iter(items)
+    while window := list(islice(items, window_size)):
+        yield window
+
+def iter_queue(items: queue.Queue) -> Iterator:
+    """
+    Yield the items put to a queue until None.
+    """
+    while (item := items.get()) is not None:
+        yield item
+
+class IngestionPipeline:
+    """
+    Staged ingestion of documents into a vector store:
+    normalization in a process pool, vectorization and concurrent uploads in
+    thread pools. Stages exchange windows of window_size items and each keeps
+    at most queue_depth windows queued beyond those its workers are processing,
+    so a slow stage holds the others back instead of buffering the dataset.
+    Upload requests are batched by size, and points are waited for once at the end.
+    Per-stage counters are collected in stats.
+    """
+    def __init__(
+        self,
+        vector_store: CompactQdrantVectorStore,
+        window_size: int = settings.RAG_SETTINGS['INGEST']['WINDOW_SIZE'],
+        normalize_workers: int = settings.RAG_SETTINGS['INGEST']['NORMALIZE_WORKERS'],
+        vectorize_workers: int = settings.RAG_SETTINGS['INGEST']['VECTORIZE_WORKERS'],
+        upload_workers: int = settings.RAG_SETTINGS['INGEST']['UPLOAD_WORKERS'],
+        upload_batch_bytes: int = settings.RAG_SETTINGS['INGEST']['UPLOAD_BATCH_BYTES'],
+        queue_depth: int = settings.RAG_SETTINGS['INGEST']['QUEUE_DEPTH'],
+        show_progress: bool = True,
+    ):
+        self.vector_store = vector_store
+        self.window_size = window_size
+        self.normalize_workers = normalize_workers
+        self.vectorize_workers = vectorize_workers
+        self.upload_workers = upload_workers
+        self.upload_batch_bytes = upload_batch_bytes
+        self.queue_depth = queue_depth
+        self.show_progress = show_progress
+        self.stats: Dict[str, StageStats] = {}
+        self._sparse_vector_name = None
+        self._stats_lock = threading.Lock()
+        # a point or point vectors written without waiting, see _flush
+        self._unflushed_point: Optional[Union[rest.PointStruct, rest.PointVectors]] = None
+
+    def _stage(self, name: str, workers: int) -> StageStats:
+        return self.stats.setdefault(name, StageStats(workers=workers))
+
+    def _map(self, executor: Executor, fn: Callable, items: Iterable, name: str) -> Iterator:
+        """
+        Apply fn to each window in the executor and yield the results in order,
+        with at most workers + queue_depth windows in flight.
+        """
+        pending: deque[Future] = deque()
+        for item in items:
+            if len(pending) >= self.stats[name].workers + self.queue_depth:
+                yield self._result(pending.popleft(), name)
+            pending.append(executor.submit(timed, fn, item))
+        while pending:
+            yield self._result(pending.popleft(), name)
+
+    def _result(self, future: Future, name: str) -> Any:
+        result, seconds = future.result()
+        items = result if isinstance(result, int) else len(result)
+        self.stats[name].items += items
+        self.stats[name].busy_seconds += seconds
+        INGEST_ITEMS.labels(name).inc(items)
+        INGEST_STAGE_SECONDS.labels(name).observe(seconds)
+        return result
+
+    def _finish(self, start: float, *names: str):
+        # stages of a phase run concurrently, throughput is measured over the phase
+        for name in names:
+            if name in self.stats:
+                self.stats[name].wall_seconds += perf_counter() - start
+
+    def _normalize_executor(self) -> Executor:
+        if self.normalize_workers <= 1:
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix='rag-normalize')
+        # load models before forking, workers share them copy-on-write
+        get_nlp()
+        get_lemma_cache()
+        return ProcessPoolExecutor(max_workers=self.normalize_workers)
+
+    def normalize(self, documents: Iterable[Document]) -> Iterator[List[BaseNode]]:
+        """
+        Normalize documents in windows and yield the nodes of each window, in order.
+        """
+        self._stage('normalize', max(self.normalize_workers, 1))
+        documents = get_tqdm_iterable(documents, self.show_progress, 'Normalizing documents')
+        with self._normalize_executor() as executor:
+            yield from self._map(executor, transform_window, windows(documents, self.window_size), 'normalize')
+
+    def _embed(self, nodes: List[BaseNode]) -> List[BaseNode]:
+        embeddings = embed_nodes(nodes, Settings.embed_model)
+        for node in nodes:
+            node.embedding = embeddings[node.node_id]
+        return nodes
+
+    def _vectorize(self, nodes: List[BaseNode]) -> List[Any]:
+        # dense embeddings, then sparse vectors and payloads built by the vector store
+        points, _ = self.vector_store._build_points(self._embed(nodes), self._sparse_vector_name)
+        return points
+
+    def _vectorize_dense(self, nodes: List[BaseNode]) -> List[Any]:
+        # points without sparse vectors, see update_sparse_vectors
+        points, _ = self.vector_store._build_points(self._embed(nodes), self._sparse_vector_name, sparse=False)
+        return points
+
+    def _vectorize_sparse(self, nodes: List[BaseNode]) -> List[rest.PointVectors]:
+        indices, values = self.vector_store._sparse_doc_fn(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
+        )
+        return [
+            rest.PointVectors(
+                id=node.node_id,
+                vector={self._sparse_vector_name: rest.SparseVector(indices=node_indices, values=node_values)},
+            )
+            for node, node_indices, node_values in zip(nodes, indices, values)
+        ]
+
+    def _count_request(self, name: str, batch_bytes: int):
+        with self._stats_lock:
+            self.stats[name].requests += 1
+            self.stats[name].request_bytes += batch_bytes
+
+    def _upload(self, points: List[rest.PointStruct]) -> int:
+        # requests return once Qdrant has logged the points, _flush waits for them to be applied
+        for batch, batch_bytes in batches_by_size(points, self.upload_batch_bytes):
+            self.vector_store.client.upload_points(
+                collection_name=self.vector_store.collection_name,
+                points=batch,
+                batch_size=len(batch),
+                max_retries=self.vector_store.max_retries,
+                wait=False,
+            )
+            self._count_request('upload', batch_bytes)
+        self._unflushed_point = points[-1]
+        return len(points)
+
+    def _update(self, point_vectors: List[rest.PointVectors]) -> int:
+        for batch, batch_bytes in batches_by_size(point_vectors, self.upload_batch_bytes):
+            self.vector_store.client.update_vectors(
+                collection_name=self.vector_store.collection_name,
+                points=batch,
+                wait=False,
+            )
+            self._count_request('update', batch_bytes)
+        self._unflushed_point = point_vectors[-1]
+        return len(point_vectors)
+
+    def _flush(self):
+        """
+        Wait until the points written without waiting are applied. Updates of the
+        collection are applied in order, so writing one of them again and waiting
+        for it waits for all previous ones.
+        """
+        if isinstance(self._unflushed_point, rest.PointVectors):
+            self.vector_store.client.update_vectors(
+                collection_name=self.vector_store.collection_name,
+                points=[self._unflushed_point],
+                wait=True,
+            )
+        elif self._unflushed_point is not None:
+            self.vector_store.client.upsert(
+                collection_name=self.vector_store.collection_name,
+                points=[self._unflushed_point],
+                wait=True,
+            )
+        self._unflushed_point = None
+
+    def _write_workers(self) -> int:
+        # writes to a local collection must not overlap
+        return 1 if is_local_client() else self.upload_workers
+
+    def upload(self, nodes: Iterable[BaseNode], sparse: bool = True) -> int:
+        """
+        Vectorize and upload nodes against the current vocabulary, or without
+        sparse vectors unless sparse. Returns the number of uploaded nodes.
+        """
+        node_windows = windows(nodes, self.window_size)
+        start = perf_counter()
+        upload_workers = self._write_workers()
+        self._stage('vectorize', self.vectorize_workers)
+        self._stage('upload', upload_workers)
+
+        if not self.vector_store._collection_initialized:
+            first_window = next(node_windows, None)
+            if first_window is None:
+                return 0
+            # the collection is created with the size of the dense embeddings
+            self.vector_store._create_collection(
+                self.vector_store.collection_name, len(self._embed(first_window)[0].get_embedding()),
+            )
+            create_payload_indexes(self.vector_store.collection_name)
+            node_windows = chain([first_window], node_windows)
+        self._sparse_vector_name = self.vector_store.sparse_vector_name()
+
+        vectorize = self._vectorize if sparse else self._vectorize_dense
+        with ThreadPoolExecutor(self.vectorize_workers, thread_name_prefix='rag-vectorize') as vectorize_executor, \
+            ThreadPoolExecutor(upload_workers, thread_name_prefix='rag-upload') as upload_executor:
+            points = self._map(vectorize_executor, vectorize, node_windows, 'vectorize')
+            count = sum(self._map(upload_executor, self._upload, points, 'upload'))
+        self._flush()
+
+        self._finish(start, 'vectorize', 'upload')
+        return count
+
+    def update_sparse_vectors(self, nodes: Iterable[BaseNode]) -> int:
+        """
+        Set the sparse vectors of uploaded nodes against the current vocabulary.
+        Returns the number of updated nodes.
+        """
+        start = perf_counter()
+        update_workers = self._write_workers()
+        self._stage('sparse', self.vectorize_workers)
+        self._stage('update', update_workers)
+        self._sparse_vector_name = self.vector_store.sparse_vector_name()
+
+        with ThreadPoolExecutor(self.vectorize_workers, thread_name_prefix='rag-vectorize') as vectorize_executor, \
+            ThreadPoolExecutor(update_workers, thread_name_prefix='rag-upload') as update_executor:
+            point_vectors = self._map(
+                vectorize_executor, self._vectorize_sparse, windows(nodes, self.window_size), 'sparse',
+            )
+            count = sum(self._map(update_executor, self._update, point_vectors, 'update'))
+        self._flush()
+
+        self._finish(start, 'sparse', 'update')
+        return count
+
+    def insert_documents(self, documents: Iterable[Document]) -> int:
+        """
+        Normalize, vectorize and upload documents against the current vocabulary.
+        Returns the number of inserted nodes.
+        """
+        start = perf_counter()
+        nodes = (node for window in self.normalize(documents) for node in window)
+        count = self.upload(nodes)
+        self._finish(start, 'normalize')
+        return count
+
+    def update_files(self, file_paths: List[str]) -> Tuple[int, int]:
+        """
+        Reindex changed dataset files review by review: reviews whose id is not in the
+        vector store yet are inserted, then points of reviews that are gone are deleted,
+        so unchanged reviews are neither normalized nor uploaded again.
+        Returns the numbers of inserted and deleted points.
+        """
+        existing: Set[str] = set()
+        for file_path in file_paths:
+            existing |= get_file_point_ids(file_path, self.vector_store.collection_name)
+
+        seen: Set[str] = set()
+        def new_documents() -> Iterator[Document]:
+            for document in iter_review_documents(file_paths):
+                if document.id_ not in seen and document.id_ not in existing:
+                    yield document
+                seen.add(document.id_)
+
+        inserted = self.insert_documents(new_documents())
+        # delete only after inserting, so the files never drop out of the index
+        stale = existing - seen
+        delete_points(stale, self.vector_store.collection_name)
+        return inserted, len(stale)
+
+    def fits_vocabulary(self) -> bool:
+        """
+        Check if points carry TF-IDF weights of a fitted vocabulary, rather than
+        term frequencies weighted by the IDF modifier of the collection.
+        """
+        sparse_config = self.vector_store._sparse_config
+        return sparse_config is None or sparse_config.modifier != rest.Modifier.IDF
+
+    def create_index(self, documents: Iterable[Document]) -> VectorStoreIndex:
+        """
+        Create an index from a stream of documents, e.g. one document per review.
+        Sparse vectors are weighted by the vocabulary fitted over all documents, so
+        while it is fitted, normalized nodes are uploaded with their payload and dense
+        vectors, and spooled to a temporary file. Their sparse vectors are set in a
+        second pass over the spool, so memory use doesn't grow with the dataset.
+        In the 'idf' sparse mode there is no vocabulary to fit, documents are inserted directly.
+        """
+        if not self.fits_vocabulary():
+            self.insert_documents(documents)
+            return self._index()
+
+        with tempfile.TemporaryFile(dir=settings.CACHE_ROOT) as spool, \
+            ThreadPoolExecutor(1, thread_name_prefix='rag-ingest') as executor:
+            node_windows = queue.Queue(maxsize=self.queue_depth + 1)
+            uploaded = executor.submit(self.upload, chain.from_iterable(iter_queue(node_windows)), sparse=False)
+
+            def put(nodes: Optional[List[BaseNode]]) -> bool:
+                # a full queue is waited for only while the uploads run
+                while not uploaded.done():
+                    try:
+                        node_windows.put(nodes, timeout=1)
+                        return True
+                    except queue.Full:
+                        pass
+                return False
+
+            def spool_nodes() -> Iterator[str]:
+                try:
+                    for nodes in self.normalize(documents):
+                        # nodes are spooled before the upload thread embeds them
+                        for node in nodes:
+                            pickle.dump(node, spool, protocol=pickle.HIGHEST_PROTOCOL)
+                        if not put(nodes):
+                            uploaded.result()
+                        for node in nodes:
+                            yield node.get_content(metadata_mode=MetadataMode.EMBED)
+                finally:
+                    put(None)
+
+            # fit the vocabulary once over the whole corpus, using the same text
+            # the vector store passes to sparse_doc_vectors
+            start = perf_counter()
+            fit_vectorizer(spool_nodes())
+            self._finish(start, 'normalize')
+            uploaded.result()
+
+            if self.vector_store.enable_hybrid:
+                spool.seek(0)
+                nodes = get_tqdm_iterable(read_spooled_nodes(spool), self.show_progress, 'Updating sparse vectors')
+                self.update_sparse_vectors(nodes)
+
+        return self._index()
+
+    def _index(self) -> VectorStoreIndex:
+        storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
+        return VectorStoreIndex([], storage_context=storage_context)
@@ -0,0 +1,252 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import json
+import mmap
+import uuid
+from glob import glob
+from itertools import chain
+from os import path as osp
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from qdrant_client.http import models as rest
+
+from simple_rag.apps.core.metrics import query_stage
+from simple_rag.apps.core.pipeline import sparse_encoders
+from simple_rag.apps.core.qdrant import (FILTER_FIELDS, PAYLOAD_FIELDS, get_ingest_client, sparse_vector_name,
+    sparse_mode)
+from simple_rag.apps.core.utils import LazyResource
+
+inverted_index_root = osp.join(settings.CACHE_ROOT, 'inverted_index')
+
+def meta_path(path: str) -> str:
+    return osp.join(path, 'meta.json')
+
+def inverted_index_exists(path: str = inverted_index_root) -> bool:
+    return osp.exists(meta_path(path))
+
+def compute_idf(document_frequencies: np.ndarray, n_documents: int) -> np.ndarray:
+    """
+    Return the IDF Qdrant applies to sparse vectors of a collection with the IDF modifier.
+    """
+    return np.log((n_documents - document_frequencies + 0.5) / (document_frequencies + 0.5) + 1)
+
+def build_inverted_index(
+    collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
+    path: str = inverted_index_root,
+    batch_size: int = settings.RAG_SETTINGS['VECTOR_STORE']['SCROLL_BATCH_SIZE'],
+) -> int:
+    """
+    Build the inverted index of a collection from its sparse vectors and payloads,
+    with the documents of each keyword of FILTER_FIELDS. Files of a build are named by its id and meta.json is replaced last,
+    so readers keep using the previous build until the new one is complete.
+    Returns the number of indexed documents.
+    """
+    os.makedirs(path, exist_ok=True)
+    build_id = uuid.uuid4().hex
+    using = sparse_vector_name(collection_name)
+    mode = sparse_mode(collection_name)
+
+    terms, docs, weights, ids = [], [], [], []
+    offsets = [0]
+    keywords: Dict[str, Dict[str, List[int]]] = {field: {} for field in FILTER_FIELDS}
+    n_documents = 0
+    with open(osp.join(path, f'{build_id}.payloads.jsonl'), 'wb') as payloads:
+        offset = None
+        while True:
+            points, offset = get_ingest_client().scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=PAYLOAD_FIELDS,
+                with_vectors=[using],
+            )
+            # postings of a batch are kept as arrays, not as python objects
+            vectors: List[rest.SparseVector] = [point.vector[using] for point in points]
+            lengths = np.fromiter((len(vector.indices) for vector in vectors), dtype=np.int64, count=len(vectors))
+            n_postings = int(lengths.sum())
+            terms.append(np.fromiter(
+                chain.from_iterable(vector.indices for vector in vectors), dtype=np.uint32, count=n_postings,
+            ))
+            weights.append(np.fromiter(
+                chain.from_iterable(vector.values for vector in vectors), dtype=np.float32, count=n_postings,
+            ))
+            docs.append(np.repeat(np.arange(n_documents, n_documents + len(points), dtype=np.int32), lengths))
+            for doc, point in enumerate(points, start=n_documents):
+                for field in FILTER_FIELDS:
+                    values = point.payload.get(field)
+                    for value in values if isinstance(values, list) else [values]:
+                        if value is not None:
+                            keywords[field].setdefault(value, []).append(doc)
+                ids.append(uuid.UUID(str(point.id)).bytes)
+                line = json.dumps({field: point.payload.get(field) for field in PAYLOAD_FIELDS}, ensure_ascii=False)
+                offsets.append(offsets[-1] + payloads.write(line.encode() + b'\n'))
+            n_documents += len(points)
+            if offset is None:
+                break
+
+    terms = np.concatenate(terms)
+    # group postings by term, documents stay in order within a term
+    order = np.argsort(terms, kind='stable')
+    unique_terms, counts = np.unique(terms[order], return_counts=True)
+    weights = np.concatenate(weights)[order]
+    if mode == 'idf':
+        # points store term frequencies, IDF is applied once here
+        weights *= np.repeat(compute_idf(counts, n_documents), counts).astype(np.float32)
+
+    arrays = {
+        'terms': unique_terms,
+        'indptr': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        'docs': np.concatenate(docs)[order],
+        'weights': weights,
+        'ids': np.frombuffer(b''.join(ids), dtype=np.uint8).reshape(n_documents, 16),
+        'offsets': np.array(offsets, dtype=np.int64),
+    }
+    for field, field_keywords in keywords.items():
+        # documents having keyword i of a field are {field}.docs[indptr[i]:indptr[i + 1]]
+        field_docs = list(field_keywords.values())
+        arrays[f'{field}.indptr'] = np.cumsum([0] + [len(docs) for docs in field_docs], dtype=np.int64)
+        arrays[f'{field}.docs'] = np.fromiter(chain.from_iterable(field_docs), dtype=np.int32)
+    with open(osp.join(path, f'{build_id}.keywords.json'), 'w') as f:
+        json.dump({field: list(field_keywords) for field, field_keywords in keywords.items()}, f, ensure_ascii=False)
+    for name, array in arrays.items():
+        np.save(osp.join(path, f'{build_id}.{name}.npy'), array)
+
+    tmp_path = f'{meta_path(path)}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'build_id': build_id,
+            'collection_name': collection_name,
+            'sparse_mode': mode,
+            'n_documents': n_documents,
+        }, f)
+    os.replace(tmp_path, meta_path(path))
+
+    # readers of an older build keep their mapped files until they reload
+    for file_path in glob(osp.join(path, '*.*')):
+        if not osp.basename(file_path).startswith((build_id, 'meta.json')):
+            os.remove(file_path)
+
+    return n_documents
+
+class InvertedIndex:
+    """
+    Posting lists of the sparse vectors of a collection in memory-mapped arrays:
+    documents containing terms[i] are docs[indptr[i]:indptr[i + 1]], with their weights.
+    A query is scored with one vectorized update per query term, without a Qdrant
+    round trip, and results are scored points like those of search_sparse_batch.
+    Documents having a keyword of a filtered field are kept in the same layout.
+    """
+    def __init__(self, path: str = inverted_index_root):
+        self.path = path
+        self.mtime_ns = os.stat(meta_path(path)).st_mtime_ns
+        with open(meta_path(path)) as f:
+            meta = json.load(f)
+        self.build_id = meta['build_id']
+        self.sparse_mode = meta['sparse_mode']
+        self.n_documents = meta['n_documents']
+
+        def load(name: str) -> np.ndarray:
+            return np.load(osp.join(path, f'{self.build_id}.{name}.npy'), mmap_mode='r')
+
+        self.terms = load('terms')
+        self.indptr = load('indptr')
+        self.docs = load('docs')
+        self.weights = load('weights')
+        self.ids = load('ids')
+        self.offsets = load('offsets')
+        with open(osp.join(path, f'{self.build_id}.keywords.json')) as f:
+            self.keywords = {
+                field: {value: i for i, value in enumerate(values)} for field, values in json.load(f).items()
+            }
+        self.keyword_indptr = {field: load(f'{field}.indptr') for field in self.keywords}
+        self.keyword_docs = {field: load(f'{field}.docs') for field in self.keywords}
+        with open(osp.join(path, f'{self.build_id}.payloads.jsonl'), 'rb') as f:
+            # an empty file can't be mapped
+            self.payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b''
+
+    def score(self, indices: List[int], values: List[float]) -> np.ndarray:
+        """
+        Return the dot product of a sparse query vector with every document.
+        """
+        scores = np.zeros(self.n_documents, dtype=np.float32)
+        positions = np.searchsorted(self.terms, indices)
+        for position, term, value in zip(positions, indices, values):
+            if position < len(self.terms) and self.terms[position] == term:
+                start, end = self.indptr[position], self.indptr[position + 1]
+                # a document occurs once in the postings of a term
+                scores[self.docs[start:end]] += np.float32(value) * self.weights[start:end]
+        return scores
+
+    def filter_docs(self, filters: Dict[str, str]) -> np.ndarray:
+        """
+        Return the documents having the keyword of each field of filters, in order.
+        """
+        docs = None
+        for field, value in filters.items():
+            i = self.keywords.get(field, {}).get(value)
+            if i is None:
+                return np.empty(0, dtype=np.int32)
+            field_docs = self.keyword_docs[field][self.keyword_indptr[field][i]:self.keyword_indptr[field][i + 1]]
+            docs = field_docs if docs is None else np.intersect1d(docs, field_docs, assume_unique=True)
+        return docs
+
+    def top_k(self, scores: np.ndarray, limit: int) -> np.ndarray:
+        """
+        Return the documents with the highest positive scores, best first.
+        """
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+    def point(self, doc: int, score: float) -> rest.ScoredPoint:
+        payload = json.loads(self.payloads[self.offsets[doc]:self.offsets[doc + 1]])
+        return rest.ScoredPoint(
+            id=str(uuid.UUID(bytes=self.ids[doc].tobytes())),
+            version=0,
+            score=float(score),
+            payload=payload,
+        )
+
+    def search_batch(
+        self,
+        queries: List[str],
+        limit: int = settings.RAG_SETTINGS['QUERY']['SPARSE_TOP_K'],
+        filters: Optional[Dict[str, str]] = None,
+    ) -> List[List[rest.ScoredPoint]]:
+        """
+        Search many normalized queries, among documents matching filters if given,
+        and return the scored points of each query, in order.
+        """
+        _, sparse_query_fn = sparse_encoders[self.sparse_mode]
+        indices, values = sparse_query_fn(queries)
+        results = []
+        with query_stage('search'):
+            docs = self.filter_docs(filters) if filters else None
+            for query_indices, query_values in zip(indices, values):
+                scores = self.score(query_indices, query_values)
+                if docs is not None:
+                    # scores of other documents are dropped, top_k skips zero scores
+                    filtered_scores = np.zeros_like(scores)
+                    filtered_scores[docs] = scores[docs]
+                    scores = filtered_scores
+                results.append([self.point(doc, scores[doc]) for doc in self.top_k(scores, limit)])
+        return results
+
+# inverted index, loaded on first use
+get_inverted_index = LazyResource('inverted_index', InvertedIndex)
+
+def current_inverted_index() -> InvertedIndex:
+    """
+    Return the loaded inverted index, reloaded once init_index built a new one.
+    """
+    index = get_inverted_index()
+    if os.stat(meta_path(index.path)).st_mtime_ns != index.mtime_ns:
+        index = InvertedIndex(index.path)
+        get_inverted_index.set(index)
+    return index
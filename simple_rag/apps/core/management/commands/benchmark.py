@@ -0,0 +1,70 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import tempfile
+from os import path as osp
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simple_rag.apps.core.benchmarks import scale_dataset, run_benchmarks, create_report, compare_reports
+from simple_rag.apps.core.models import BenchmarkReport
+from simple_rag.apps.core.utils import list_dataset_files
+
+class Command(BaseCommand):
+    help = 'Benchmark the normalization, vectorization and change detection hot paths on the datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.DATASETS_ROOT, help='Datasets folder')
+        parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+            help='Corpus sizes to run, as copies of the datasets')
+        parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions, best is reported')
+        parser.add_argument('--nlp-limit', type=int, default=500, help='Maximum number of reviews normalized by spaCy')
+        parser.add_argument('--output', default=None, help="JSON report file, '-' for stdout")
+        parser.add_argument('--compare', default=None, help='JSON report of a baseline run')
+        parser.add_argument('--threshold', type=float, default=1.1,
+            help='Slowdown ratio against the baseline reported as a regression')
+
+    def handle(self, *args, **options):
+        if not list_dataset_files(options['path']):
+            self.stdout.write(self.style.ERROR('No documents found.'))
+            return
+
+        # a JSON report on stdout is not mixed with the timings
+        log = self.stderr if options['output'] == '-' else self.stdout
+        results = []
+        for scale in options['scales']:
+            with tempfile.TemporaryDirectory() as tmp_path:
+                file_paths = scale_dataset(options['path'], scale, tmp_path)
+                scale_results = run_benchmarks(file_paths, scale, options['repeat'], options['nlp_limit'])
+            log.write(self.style.NOTICE(f'Scale {scale}: {len(file_paths)} files'))
+            for result in scale_results:
+                log.write(
+                    f'{result.name:>22}: {result.best_seconds:.4f} s '
+                    f'({result.items_per_second:,.0f} items/s, {result.items} items)'
+                )
+            results.extend(scale_results)
+
+        report = create_report(osp.abspath(options['path']), results)
+        if options['output'] == '-':
+            self.stdout.write(report.model_dump_json(indent=2))
+        elif options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report.model_dump_json(indent=2))
+            log.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = BenchmarkReport.model_validate_json(f.read())
+            log.write(self.style.NOTICE(f'Compared to {baseline.commit or baseline.created}'))
+            regressions = 0
+            for (name, scale), ratio in compare_reports(baseline, report).items():
+                line = f'{name:>22} x{scale}: {ratio:.2f}'
+                if ratio > options['threshold']:
+                    regressions += 1
+                    log.write(self.style.ERROR(f'{line} regression'))
+                else:
+                    log.write(line)
+            if regressions:
+                log.write(self.style.ERROR(f'{regressions} regressions above {options["threshold"]:.2f}x'))
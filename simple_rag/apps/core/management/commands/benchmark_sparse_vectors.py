@@ -0,0 +1,59 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+from timeit import repeat
+from typing import List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from simple_rag.apps.core.pipeline import csr_to_sparse_vectors
+from simple_rag.apps.core.benchmarks import load_review_texts
+
+def legacy_csr_to_sparse_vectors(tfidf_matrix) -> Tuple[List[List[int]], List[List[float]]]:
+    """
+    Per-row conversion used before csr_to_sparse_vectors, kept as the benchmark baseline.
+    """
+    indices = []
+    values = []
+    for i in range(tfidf_matrix.shape[0]):
+        cuu_indices = tfidf_matrix[i,:].nonzero()[1]
+        values.append([tfidf_matrix[i, x] for x in cuu_indices])
+        indices.append(cuu_indices)
+    return indices, values
+
+class Command(BaseCommand):
+    help = 'Compare CSR to sparse vector conversion implementations on the datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.DATASETS_ROOT, help='Datasets folder')
+        parser.add_argument('--scale', type=int, default=1, help='Repeat the corpus N times')
+        parser.add_argument('--repeat', type=int, default=3, help='Timing repetitions, best is reported')
+
+    def handle(self, *args, **options):
+        texts = load_review_texts(options['path']) * options['scale']
+        if not texts:
+            self.stdout.write(self.style.ERROR('No documents found.'))
+            return
+
+        # raw texts are enough here, only the matrix layout matters
+        tfidf_matrix = TfidfVectorizer().fit_transform(texts)
+        self.stdout.write(self.style.NOTICE(
+            f'{tfidf_matrix.shape[0]} rows, {tfidf_matrix.shape[1]} terms, {tfidf_matrix.nnz} non-zeros'
+        ))
+
+        legacy_indices, legacy_values = legacy_csr_to_sparse_vectors(tfidf_matrix)
+        indices, values = csr_to_sparse_vectors(tfidf_matrix)
+        if [list(row) for row in legacy_indices] != indices or legacy_values != values:
+            self.stdout.write(self.style.ERROR('Implementations disagree.'))
+            return
+
+        results = {}
+        for name, fn in (('legacy', legacy_csr_to_sparse_vectors), ('vectorized', csr_to_sparse_vectors)):
+            best = min(repeat(lambda: fn(tfidf_matrix), number=1, repeat=options['repeat']))
+            results[name] = best
+            self.stdout.write(f'{name:>10}: {best:.4f} s ({tfidf_matrix.shape[0] / best:,.0f} rows/s)')
+
+        self.stdout.write(self.style.SUCCESS(f"Speedup: {results['legacy'] / results['vectorized']:.1f}x"))
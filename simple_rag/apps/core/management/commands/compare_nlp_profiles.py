@@ -0,0 +1,74 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import difflib
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simple_rag.apps.core.pipeline import load_nlp, normalize_doc
+from simple_rag.apps.core.benchmarks import load_review_texts
+
+class Command(BaseCommand):
+    help = 'Compare speed and output of the normalization profiles on the datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.DATASETS_ROOT, help='Datasets folder')
+        parser.add_argument('--profiles', nargs='+', default=list(settings.RAG_SETTINGS['NLP']['PROFILES']),
+            help='Profiles to compare, the first one is the baseline')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of reviews')
+        parser.add_argument('--batch-size', type=int, default=settings.RAG_SETTINGS['NLP']['BATCH_SIZE'])
+        parser.add_argument('--examples', type=int, default=5, help='Number of differing reviews to show')
+
+    def handle(self, *args, **options):
+        texts = load_review_texts(options['path'])[:options['limit']]
+        if not texts:
+            self.stdout.write(self.style.ERROR('No documents found.'))
+            return
+
+        baseline_name = options['profiles'][0]
+        baseline = None
+        for profile in options['profiles']:
+            start = perf_counter()
+            nlp = load_nlp(profile)
+            load_time = perf_counter() - start
+
+            start = perf_counter()
+            n_tokens = 0
+            results = []
+            for doc in nlp.pipe(texts, batch_size=options['batch_size']):
+                n_tokens += len(doc)
+                results.append(normalize_doc(doc))
+            elapsed = perf_counter() - start
+
+            self.stdout.write(self.style.NOTICE(f'Profile {profile}: components {nlp.pipe_names}'))
+            self.stdout.write(f'  load: {load_time:.2f} s')
+            self.stdout.write(f'  {n_tokens / elapsed:,.0f} tokens/s, {len(texts) / elapsed:,.1f} reviews/s')
+
+            if baseline is None:
+                baseline = results
+                continue
+
+            changed_reviews = 0
+            changed_tokens = 0
+            examples = []
+            for expected, actual in zip(baseline, results):
+                if expected == actual:
+                    continue
+                changed_reviews += 1
+                matcher = difflib.SequenceMatcher(a=expected, b=actual, autojunk=False)
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                    if tag != 'equal':
+                        changed_tokens += max(i2 - i1, j2 - j1)
+                        if len(examples) < options['examples']:
+                            examples.append((expected[i1:i2], actual[j1:j2]))
+            total_tokens = sum(len(tokens) for tokens in baseline)
+
+            self.stdout.write(
+                f'  diff against {baseline_name}: {changed_reviews}/{len(texts)} reviews, '
+                f'{changed_tokens}/{total_tokens} tokens changed'
+            )
+            for expected, actual in examples:
+                self.stdout.write(f'    {expected} -> {actual}')
@@ -2,15 +2,25 @@
 #
 # SPDX-License-Identifier: MIT
 
-from os import path as osp
+from time import perf_counter
+from typing import Optional
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
 
-from simple_rag.apps.core.qdrant import collection_exists, create_vector_store, create_index, get_index
-from simple_rag.apps.core.utils import list_documents, filter_documents
+from simple_rag.apps.core.qdrant import (
+    collection_exists, create_vector_store, delete_collection, delete_file_points, sparse_mode, dense_vector_size,
+    get_ingest_client, has_current_payload,
+)
+from simple_rag.apps.core.embeddings import embedding_size
+from simple_rag.apps.core.ingestion import IngestionPipeline
+from simple_rag.apps.core.inverted_index import build_inverted_index, inverted_index_exists
+from simple_rag.apps.core.pipeline import is_vectorizer_fitted
+from simple_rag.apps.core.utils import list_dataset_files, iter_review_documents
+from simple_rag.apps.core.manifest import FileManifest
+from simple_rag.apps.core.cache import bump_index_generation
 
 class Command(BaseCommand):
     help = 'Build index for all documents'
@@ -20,28 +30,95 @@ class Command(BaseCommand):
             return None
         try:
             self.stdout.write(self.style.NOTICE('Starting to build index for all documents...'))
-            documents = list_documents(settings.DATASETS_ROOT)
-            if not documents or len(documents) == 0:
+            if settings.QDRANT_GATEWAY['PATH'] == ':memory:':
+                self.stdout.write(self.style.WARNING(
+                    'QDRANT_PATH is :memory:, the index is lost when this process exits.'
+                ))
+            file_paths = list_dataset_files(settings.DATASETS_ROOT)
+            if not file_paths or len(file_paths) == 0:
                 self.stdout.write(self.style.ERROR('No documents found.'))
                 return
-            if (collection_exists()):
-                # filter out not changed documents
-                cache_path = osp.join(settings.CACHE_ROOT, 'doc_info.pkl')
-                documents = filter_documents(documents, cache_path)
-                if not documents or len(documents) == 0:
+            manifest = FileManifest()
+            mode = settings.RAG_SETTINGS['VECTOR_STORE']['SPARSE_MODE']
+            exists = collection_exists()
+            rebuild_reason = self.get_rebuild_reason(mode) if exists else None
+            if exists and rebuild_reason is None:
+                # filter out not changed files
+                changed_files = manifest.scan(file_paths)
+                deleted_files = manifest.deleted(file_paths)
+                if not changed_files and not deleted_files:
                     self.stdout.write(self.style.ERROR('No changed documents found.'))
+                    if not inverted_index_exists():
+                        self.update_inverted_index()
                     return
-                # refresh index
-                index = get_index()
-                refreshed_docs = index.refresh_ref_docs(documents)
-                if refreshed_docs[0] and refreshed_docs[-1]:
-                    self.stdout.write(self.style.SUCCESS('Index refreshed successfully.'))
-                else:
-                    self.stdout.write(self.style.ERROR('Failed to refresh index.'))
+                # refresh index, only new and edited reviews of changed files are indexed
+                ingestion = IngestionPipeline(create_vector_store(sparse_mode=mode, client=get_ingest_client()))
+                inserted, deleted = ingestion.update_files(list(changed_files))
+                for file_path in deleted_files:
+                    delete_file_points(file_path)
+                manifest.save(changed_files)
+                manifest.remove(deleted_files)
+                self.update_inverted_index()
+                bump_index_generation()
+                self.stdout.write(self.style.SUCCESS(
+                    f'Index refreshed successfully, {inserted} reviews inserted and {deleted} removed '
+                    f'from {len(changed_files)} changed files, {len(deleted_files)} files removed.'
+                ))
             else:
-                vector_store = create_vector_store()
-                create_index(documents, vector_store)
+                if exists:
+                    self.stdout.write(self.style.WARNING(f'{rebuild_reason}, rebuilding the index...'))
+                    delete_collection()
+                manifest.clear()
+                file_infos = manifest.scan(file_paths)
+                ingestion = IngestionPipeline(create_vector_store(sparse_mode=mode, client=get_ingest_client()))
+                ingestion.create_index(iter_review_documents(file_paths))
+                manifest.save(file_infos)
+                self.update_inverted_index()
+                bump_index_generation()
                 self.stdout.write(self.style.SUCCESS('Index created successfully.'))
+            self.write_stats(ingestion)
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'Error occurred: {e}'))
             raise e
+
+    def get_rebuild_reason(self, mode: str) -> Optional[str]:
+        """
+        Return why the existing index can't be refreshed, None if it can.
+        """
+        if sparse_mode() != mode:
+            return f'Index was built in {sparse_mode()} sparse mode, not {mode}'
+        if mode == 'tfidf' and not is_vectorizer_fitted():
+            # points were vectorized against a vocabulary we no longer have
+            return 'No fitted vocabulary found'
+        if dense_vector_size() != embedding_size():
+            return 'Dense vectors of the index have another size than the embedding model'
+        if not has_current_payload():
+            return 'Points of the index carry an older payload'
+        return None
+
+    def update_inverted_index(self):
+        """
+        Rebuild the inverted index of the collection, if queries are served from it.
+        """
+        if settings.RAG_SETTINGS['QUERY']['BACKEND'] != 'inverted_index':
+            return
+        start = perf_counter()
+        n_documents = build_inverted_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Inverted index built, {n_documents} documents in {perf_counter() - start:.1f} s.'
+        ))
+
+    def write_stats(self, ingestion: IngestionPipeline):
+        for name, stats in ingestion.stats.items():
+            line = (
+                f'{name:>10}: {stats.items} items in {stats.wall_seconds:.1f} s, '
+                f'{stats.throughput:,.0f} items/s, {stats.workers} workers {stats.utilization:.0%} busy'
+            )
+            if stats.requests:
+                line += f', {stats.requests} requests of {stats.request_bytes / stats.requests / 1024:,.0f} KiB'
+            self.stdout.write(line)
+        if 'upload' in ingestion.stats:
+            self.stdout.write(self.style.SUCCESS(
+                f"Uploaded {ingestion.stats['upload'].items} points at "
+                f"{ingestion.stats['upload'].throughput:,.0f} points/s."
+            ))
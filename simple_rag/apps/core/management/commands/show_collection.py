@@ -0,0 +1,56 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from simple_rag.apps.core.qdrant import (
+    collection_exists, collection_storage, get_client, is_local_client, sparse_mode, sparse_vector_name,
+)
+
+class Command(BaseCommand):
+    help = 'Show the effective configuration of a collection against the STORAGE settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', default=settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
+            help='Collection name')
+        parser.add_argument('--json', action='store_true', help='Print the collection info of Qdrant as JSON')
+
+    def handle(self, *args, **options):
+        collection_name = options['collection']
+        if not collection_exists(collection_name):
+            self.stdout.write(self.style.ERROR(f"Collection '{collection_name}' not found."))
+            return
+
+        info = get_client().get_collection(collection_name)
+        if options['json']:
+            self.stdout.write(info.model_dump_json(indent=2))
+            return
+
+        self.stdout.write(self.style.NOTICE(
+            f"Collection '{collection_name}': {info.status.value}, {info.points_count} points "
+            f'in {info.segments_count} segments'
+        ))
+        self.stdout.write(
+            f"Sparse vectors '{sparse_vector_name(collection_name)}' in {sparse_mode(collection_name)} mode"
+        )
+        for field_name, schema in sorted(info.payload_schema.items()):
+            self.stdout.write(f'Payload index {field_name}: {schema.data_type.value}, {schema.points} points')
+
+        configured = settings.RAG_SETTINGS['VECTOR_STORE']['STORAGE']
+        differences = []
+        self.stdout.write(f"{'setting':>22}  {'collection':>12}  {'configured':>12}")
+        for name, value in collection_storage(collection_name).items():
+            self.stdout.write(f'{name:>22}  {str(value):>12}  {str(configured[name]):>12}')
+            # None keeps the default of the server
+            if configured[name] is not None and configured[name] != value:
+                differences.append(name)
+
+        if is_local_client():
+            self.stdout.write(self.style.WARNING('A local Qdrant ignores most storage options.'))
+        elif differences:
+            self.stdout.write(self.style.WARNING(
+                f"{', '.join(differences)} differ from the settings. Storage options are applied "
+                f'when the collection is created, delete it and run init_index to apply them.'
+            ))
@@ -0,0 +1,20 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+from django.core.management.base import BaseCommand
+
+from simple_rag.apps.core.warmup import warm_up, get_readiness
+
+class Command(BaseCommand):
+    help = 'Load models and run a dummy normalization and query, reporting startup time per component'
+
+    def handle(self, *args, **options):
+        is_ready = warm_up()
+        readiness = get_readiness()
+        for component, seconds in readiness.startup_times.items():
+            self.stdout.write(f'{component:>24}: {seconds:.3f} s')
+        if is_ready:
+            self.stdout.write(self.style.SUCCESS('Ready.'))
+        else:
+            self.stdout.write(self.style.ERROR(f'Not ready: {readiness.error}'))
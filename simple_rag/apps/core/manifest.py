@@ -0,0 +1,123 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import hashlib
+import sqlite3
+from os import path as osp
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List
+
+from pydantic import BaseModel
+from django.conf import settings
+
+manifest_path = osp.join(settings.CACHE_ROOT, 'manifest.sqlite3')
+
+# hashlib releases the GIL on large buffers, so files hash in parallel threads
+HASH_BUFFER_SIZE = 1 << 20
+
+class FileInfo(BaseModel):
+    size: int
+    mtime_ns: int
+    hash: str
+
+def hash_file(file_path: str, buffer_size: int = HASH_BUFFER_SIZE) -> str:
+    """
+    Return the SHA256 hash of a file, read in buffer_size chunks into a reused buffer.
+    """
+    sha256_hash = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while n := f.readinto(buffer):
+            sha256_hash.update(view[:n])
+    return sha256_hash.hexdigest()
+
+class FileManifest:
+    """
+    The size, modification time and hash of each indexed dataset file, stored in SQLite
+    and updated one row per file.
+    A file whose size and modification time are unchanged is not hashed again,
+    so checking an unchanged corpus costs a stat per file.
+    """
+    def __init__(
+        self,
+        path: str = manifest_path,
+        hash_workers: int = settings.RAG_SETTINGS['INGEST']['HASH_WORKERS'],
+    ):
+        self.path = path
+        self.hash_workers = hash_workers
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)'
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def get(self) -> Dict[str, FileInfo]:
+        """
+        Return the recorded info of each file.
+        """
+        rows = self._connection.execute('SELECT path, size, mtime_ns, hash FROM files')
+        return {
+            path: FileInfo(size=size, mtime_ns=mtime_ns, hash=file_hash)
+            for path, size, mtime_ns, file_hash in rows
+        }
+
+    def scan(self, file_paths: List[str]) -> Dict[str, FileInfo]:
+        """
+        Return the current info of the files that are new or whose content changed.
+        Only files whose size or modification time differ from the manifest are hashed,
+        in parallel. A file touched without a content change has its row updated here,
+        changed files are recorded by save once they are indexed.
+        """
+        known = self.get()
+        stats = {file_path: os.stat(file_path) for file_path in file_paths}
+        to_hash = [
+            file_path
+            for file_path, stat in stats.items()
+            if file_path not in known
+            or (known[file_path].size, known[file_path].mtime_ns) != (stat.st_size, stat.st_mtime_ns)
+        ]
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+            hashes = dict(zip(to_hash, executor.map(hash_file, to_hash)))
+
+        changed = {}
+        touched = {}
+        for file_path, file_hash in hashes.items():
+            info = FileInfo(size=stats[file_path].st_size, mtime_ns=stats[file_path].st_mtime_ns, hash=file_hash)
+            if file_path in known and known[file_path].hash == file_hash:
+                touched[file_path] = info
+            else:
+                changed[file_path] = info
+        self.save(touched)
+
+        return changed
+
+    def deleted(self, file_paths: Iterable[str]) -> List[str]:
+        """
+        Return the recorded files that are not in file_paths anymore.
+        """
+        return sorted(set(self.get()) - set(file_paths))
+
+    def save(self, infos: Dict[str, FileInfo]):
+        """
+        Record the info of the given files.
+        """
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)',
+                [(file_path, info.size, info.mtime_ns, info.hash) for file_path, info in infos.items()],
+            )
+
+    def remove(self, file_paths: Iterable[str]):
+        with self._connection:
+            self._connection.executemany('DELETE FROM files WHERE path = ?', [(file_path,) for file_path in file_paths])
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute('DELETE FROM files')
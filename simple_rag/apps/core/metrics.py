@@ -0,0 +1,54 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest, multiprocess
+
+# stages of a query take from tens of microseconds to seconds
+QUERY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# ingestion stages process a window of reviews at a time
+INGEST_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+REQUESTS = Counter('rag_requests', 'HTTP requests by view, method and status', ['view', 'method', 'status'])
+REQUEST_ERRORS = Counter('rag_request_errors', 'HTTP requests answered with an error status', ['view'])
+REQUEST_SECONDS = Histogram(
+    'rag_request_duration_seconds', 'Time to answer an HTTP request', ['view'], buckets=QUERY_BUCKETS,
+)
+# normalize: spaCy, vectorize: sparse query vectors, search: Qdrant or the inverted index,
+# engine: the llama-index query engine, vectorize included, serialize: DRF serializers
+QUERY_STAGE_SECONDS = Histogram(
+    'rag_query_stage_seconds', 'Time spent in each stage of a query', ['stage'], buckets=QUERY_BUCKETS,
+)
+INGEST_STAGE_SECONDS = Histogram(
+    'rag_ingest_stage_seconds', 'Time to process one window in each ingestion stage', ['stage'],
+    buckets=INGEST_BUCKETS,
+)
+INGEST_ITEMS = Counter('rag_ingest_items', 'Items processed by each ingestion stage', ['stage'])
+CACHE_LOOKUPS = Counter('rag_cache_lookups', 'Cache lookups by cache and result', ['cache', 'result'])
+
+def query_stage(stage: str):
+    """
+    Time a query stage, as a context manager or a decorator.
+    """
+    return QUERY_STAGE_SECONDS.labels(stage).time()
+
+def count_lookup(cache: str, hit: bool, n: int = 1):
+    if n:
+        CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc(n)
+
+def render_metrics() -> bytes:
+    """
+    Return the metrics in the Prometheus text format.
+    With PROMETHEUS_MULTIPROC_DIR set, as for the uvicorn workers, every process
+    writes its metrics to files there and they are aggregated over all processes,
+    including the init_index run and processes that have exited.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,57 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpRequest, HttpResponse
+
+from simple_rag.apps.core.metrics import REQUESTS, REQUEST_ERRORS, REQUEST_SECONDS
+
+def view_name(request: HttpRequest) -> str:
+    # unmatched paths share one label, so scanners can't grow the metrics
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+def record_request(request: HttpRequest, status: int, seconds: float):
+    view = view_name(request)
+    REQUESTS.labels(view, request.method, str(status)).inc()
+    REQUEST_SECONDS.labels(view).observe(seconds)
+    if status >= 400:
+        REQUEST_ERRORS.labels(view).inc()
+
+class MetricsMiddleware:
+    """
+    Count requests and errors and time them, per view.
+    Supports sync and async views, so query_async stays on the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            record_request(request, status, perf_counter() - start)
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponse:
+        start = perf_counter()
+        status = 500
+        try:
+            response = await self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            record_request(request, status, perf_counter() - start)
@@ -2,7 +2,7 @@
 #
 # SPDX-License-Identifier: MIT
 
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from pydantic import BaseModel
 
@@ -12,6 +12,26 @@ class TextRequest(BaseModel):
     """
     text: str
 
+class TextsRequest(BaseModel):
+    """
+    Model class for batch requests.
+    """
+    texts: List[str]
+
+class QueryTextRequest(TextRequest):
+    """
+    Model class for query request, optionally restricted to a rubric or a place.
+    """
+    rubric: Optional[str] = None
+    name_ru: Optional[str] = None
+
+class QueryTextsRequest(TextsRequest):
+    """
+    Model class for batch query request, filters apply to every query.
+    """
+    rubric: Optional[str] = None
+    name_ru: Optional[str] = None
+
 class ProcessTextResponse(BaseModel):
     """
      Model class for process text response.
@@ -32,3 +52,81 @@ class RelevantTextResponse(BaseModel):
      Model class for query results response.
     """
     results: List[QueryRequest]
+
+class QueryBatchResponse(BaseModel):
+    """
+     Model class for batch query results response.
+    """
+    results: List[List[QueryRequest]]
+
+class CacheStats(BaseModel):
+    """
+    Model class for cache statistics.
+    """
+    size: Optional[int] = None
+    max_size: Optional[int] = None
+    hits: int
+    misses: int
+    hit_rate: float
+
+class StatsResponse(BaseModel):
+    """
+     Model class for stats response.
+    """
+    caches: Dict[str, CacheStats]
+
+class StageStats(BaseModel):
+    """
+    Model class for ingestion stage statistics.
+    """
+    workers: int
+    items: int = 0
+    busy_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    # requests sent to the vector store and their estimated size
+    requests: int = 0
+    request_bytes: int = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.wall_seconds if self.wall_seconds else 0.0
+
+    @property
+    def utilization(self) -> float:
+        return self.busy_seconds / (self.wall_seconds * self.workers) if self.wall_seconds else 0.0
+
+class ReadinessResponse(BaseModel):
+    """
+     Model class for readiness response.
+    """
+    ready: bool
+    startup_times: Dict[str, float]
+    error: Optional[str] = None
+
+class BenchmarkResult(BaseModel):
+    """
+    Model class for the timings of one benchmark on one dataset scale.
+    """
+    name: str
+    scale: int
+    items: int
+    repeat: int
+    best_seconds: float
+    mean_seconds: float
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.best_seconds if self.best_seconds else 0.0
+
+class BenchmarkReport(BaseModel):
+    """
+    Model class for the results of a benchmark suite run, with the environment it ran in.
+    """
+    created: str
+    commit: Optional[str] = None
+    python: str
+    platform: str
+    cpu_count: int
+    nlp_profile: str
+    dataset: str
+    results: List[BenchmarkResult]
@@ -0,0 +1,137 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import re
+import json
+import codecs
+from typing import IO, Any, Iterator
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON lazily, the parsed data is an iterator
+    over the values of the non-empty lines so the body is never loaded at once.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None) -> Iterator[Any]:
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        def values():
+            for line_number, line in enumerate(stream, start=1):
+                line = line.decode(encoding).strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as exc:
+                    raise ParseError(f'NDJSON parse error at line {line_number} - {exc}')
+
+        return values()
+
+
+WHITESPACE = re.compile(r'\s*')
+DELIMITERS = set(' \t\n\r,]}:')
+
+class JSONArrayReader:
+    """
+    Decodes the values of a JSON array, or of the "texts" array of an object,
+    from a stream one chunk at a time, so the body is never loaded at once.
+    """
+    def __init__(self, stream: IO[bytes], encoding: str, chunk_size: int):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.in_object = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def _peek(self) -> str:
+        # the next character that is not whitespace, '' at the end of the stream
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char: str, message: str):
+        if self._peek() != char:
+            raise ParseError(message)
+        self.pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = json.JSONDecoder().raw_decode(self.buffer, self.pos)
+                # a value not followed by a delimiter, e.g. a number, may go on in the next chunk
+                if self.eof or self.buffer[end:end + 1] in DELIMITERS:
+                    self.pos = end
+                    return value
+            except ValueError as exc:
+                if self.eof:
+                    raise ParseError(f'JSON parse error - {exc}')
+            self._fill()
+
+    def start(self):
+        """
+        Read up to the first value of the array.
+        """
+        if self._peek() == '{':
+            self.pos += 1
+            if self._value() != 'texts':
+                raise ParseError('expected a list of texts')
+            self._expect(':', 'expected a list of texts')
+            self.in_object = True
+        self._expect('[', 'expected a list of texts')
+
+    def values(self) -> Iterator[Any]:
+        if self._peek() == ']':
+            self.pos += 1
+        else:
+            while True:
+                yield self._value()
+                char = self._peek()
+                self.pos += 1
+                if char == ']':
+                    break
+                if char != ',':
+                    raise ParseError("JSON parse error - expected ',' or ']' after a value")
+        if self.in_object:
+            self._expect('}', 'JSON parse error - expected only "texts" in the object')
+        if self._peek():
+            raise ParseError('JSON parse error - extra data after the list')
+
+
+class JSONArrayParser(BaseParser):
+    """
+    Parses a JSON array, or a {"texts": [...]} object, lazily: the parsed data
+    is an iterator over the values of the array, decoded chunk by chunk.
+    """
+    media_type = 'application/json'
+    chunk_size = 64 * 1024
+
+    def parse(self, stream, media_type=None, parser_context=None) -> Iterator[Any]:
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        reader = JSONArrayReader(stream, encoding, self.chunk_size)
+        # a body that is not a list is rejected before the response starts
+        reader.start()
+        return reader.values()
@@ -4,45 +4,205 @@
 
 import re
 import os
+import uuid
+import atexit
+from collections import Counter
+from itertools import islice
 from os import path as osp
-from typing import List, Sequence, Tuple
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from django.conf import settings
 import spacy
+from spacy.language import Language
+from spacy.tokens import Doc
 from llama_index.core import Settings
 from llama_index.core.schema import TransformComponent, BaseNode
 from llama_index.core.node_parser import TextSplitter
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from scipy.sparse import csr_matrix
+import numpy as np
 import joblib
 from django.conf import settings
 
-# cache nlp object
-nlp = spacy.load('ru_core_news_sm')
+from simple_rag.apps.core.cache import LRUCache
+from simple_rag.apps.core.embeddings import load_embed_model
+from simple_rag.apps.core.metrics import query_stage, count_lookup
+from simple_rag.apps.core.utils import LazyResource, REVIEW_ID_NAMESPACE
+
+def load_nlp(profile: str = settings.RAG_SETTINGS['NLP']['PROFILE']) -> Language:
+    """
+    Load the spaCy model without the components excluded by a normalization profile.
+    """
+    profiles = settings.RAG_SETTINGS['NLP']['PROFILES']
+    if profile not in profiles:
+        raise ValueError(f"Unknown normalization profile '{profile}', expected one of {list(profiles)}")
+
+    return spacy.load(settings.RAG_SETTINGS['NLP']['MODEL'], exclude=profiles[profile]['EXCLUDE'])
+
+# nlp object, loaded on first use
+get_nlp = LazyResource('nlp', load_nlp)
+
+# lemmas depend on the model and the profile, so does the persisted cache,
+# bump the format when its keys change
+LEMMA_CACHE_FORMAT = 2
+lemma_cache_path = osp.join(
+    settings.CACHE_ROOT,
+    f"lemma_cache_v{LEMMA_CACHE_FORMAT}_{settings.RAG_SETTINGS['NLP']['MODEL']}_"
+    f"{settings.RAG_SETTINGS['NLP']['PROFILE']}.pkl",
+)
+
+def load_lemma_cache() -> Optional[LRUCache]:
+    """
+    Create the lemma cache, see lemma_key, filled from CACHE_ROOT when persisted.
+    Returns None if the cache is disabled.
+    """
+    cache_settings = settings.RAG_SETTINGS['NLP']['LEMMA_CACHE']
+    if not cache_settings['MAX_SIZE']:
+        return None
+
+    cache = LRUCache(cache_settings['MAX_SIZE'])
+    if cache_settings['PERSIST']:
+        cache.load(lemma_cache_path)
+        atexit.register(save_lemma_cache)
+    return cache
+
+def save_lemma_cache():
+    """
+    Persist the lemma cache to CACHE_ROOT.
+    """
+    lemma_cache = get_lemma_cache()
+    if lemma_cache is not None and lemma_cache.modified:
+        lemma_cache.save(lemma_cache_path)
+
+# lemmas object, loaded on first use
+get_lemma_cache = LazyResource('lemma_cache', load_lemma_cache)
+
+# bump when the layout of the persisted vectorizer changes
+VECTORIZER_CACHE_FORMAT = 1
 
 vectorizer_cache_path = osp.join(settings.CACHE_ROOT, 'vectorizer_cache.pkl')
-# Check if the vectorizer is already cached
-if os.path.exists(vectorizer_cache_path):
-    vectorizer = joblib.load(vectorizer_cache_path)
-else:
-    vectorizer = TfidfVectorizer()
 
-Settings.embed_model = settings.RAG_SETTINGS['EMBED_MODEL']
+def load_vectorizer() -> Tuple[TfidfVectorizer, int]:
+    """
+    Load the persisted corpus-wide vectorizer and its vocabulary version.
+    Returns a new unfitted vectorizer with version 0 if nothing usable is cached.
+    """
+    if os.path.exists(vectorizer_cache_path):
+        cached = joblib.load(vectorizer_cache_path)
+        if isinstance(cached, dict) and cached.get('format') == VECTORIZER_CACHE_FORMAT:
+            return cached['vectorizer'], cached['version']
+    return TfidfVectorizer(), 0
+
+# vectorizer object and its vocabulary version, loaded on first use
+get_vectorizer = LazyResource('vectorizer', load_vectorizer)
+
+Settings.embed_model = load_embed_model()
 Settings.llm = settings.RAG_SETTINGS['LLM']
 
-def process_text(text: str):
+def is_normalized_token(token) -> bool:
     """
-    Process text and return normalized tokens.
+    Check if a token is kept in the normalized output.
     """
-    doc = nlp(text)
+    return token.is_alpha and not token.is_stop and not token.is_punct
 
+def normalize_doc(doc: Doc) -> List[str]:
+    """
+    Return normalized tokens of a processed document.
+    """
     tokens = [
         token.lemma_.lower()
         for token in doc
-        if token.is_alpha and not token.is_stop and not token.is_punct
+        if is_normalized_token(token)
     ]
 
     return tokens
 
+LEMMATIZER = 'lemmatizer'
+
+def lemma_key(token) -> Tuple[str, str, str]:
+    """
+    Return the lemma cache key of a token: its surface form, part of speech and
+    morphological features, all the lemmatizer reads. An ambiguous form, e.g. 'мыла'
+    of 'мыло' or 'мыть', is cached separately for each analysis.
+    """
+    return token.text, token.pos_, str(token.morph)
+
+def uses_lemma_cache(nlp: Language) -> bool:
+    # the cache only saves the lemmatizer, the other components set the key
+    return get_lemma_cache() is not None and LEMMATIZER in nlp.pipe_names
+
+def cached_normalize_doc(doc: Doc) -> Optional[List[str]]:
+    """
+    Return normalized tokens of a document processed without the lemmatizer from the lemma cache.
+    Returns None if any of its tokens is not cached.
+    """
+    lemma_cache = get_lemma_cache()
+    tokens = []
+    for token in doc:
+        # '' marks a cached token that is dropped from the output
+        lemma = lemma_cache.get(lemma_key(token))
+        if lemma is None:
+            return None
+        if lemma:
+            tokens.append(lemma)
+    return tokens
+
+def remember_doc(nlp: Language, doc: Doc) -> List[str]:
+    """
+    Lemmatize a document processed without the lemmatizer, cache its lemmas
+    and return its normalized tokens.
+    """
+    doc = nlp.get_pipe(LEMMATIZER)(doc)
+    lemma_cache = get_lemma_cache()
+    for token in doc:
+        lemma_cache.set(lemma_key(token), token.lemma_.lower() if is_normalized_token(token) else '')
+    return normalize_doc(doc)
+
+def process_text(text: str):
+    """
+    Process text and return normalized tokens.
+    The lemmatizer is skipped if all tokens are in the lemma cache.
+    """
+    nlp = get_nlp()
+    if not uses_lemma_cache(nlp):
+        return normalize_doc(nlp(text))
+
+    doc = nlp(text, disable=[LEMMATIZER])
+    tokens = cached_normalize_doc(doc)
+    count_lookup('lemma', hit=tokens is not None)
+    if tokens is None:
+        tokens = remember_doc(nlp, doc)
+    return tokens
+
+def process_texts(
+    texts: Iterable[str],
+    batch_size: int = settings.RAG_SETTINGS['NLP']['BATCH_SIZE'],
+    n_process: int = settings.RAG_SETTINGS['NLP']['N_PROCESS'],
+) -> Iterator[List[str]]:
+    """
+    Process texts in batches and yield normalized tokens for each text, in order.
+    Args:
+        texts (Iterable[str]): The texts to be processed.
+        batch_size (int): Number of texts buffered per spaCy batch.
+        n_process (int): Number of worker processes, -1 to use all cores.
+    """
+    nlp = get_nlp()
+    if not uses_lemma_cache(nlp):
+        for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+            yield normalize_doc(doc)
+        return
+
+    # documents are looked up in batches, only the misses are lemmatized
+    docs = nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=[LEMMATIZER])
+    while window := list(islice(docs, batch_size)):
+        results = [cached_normalize_doc(doc) for doc in window]
+        misses = [i for i, tokens in enumerate(results) if tokens is None]
+        count_lookup('lemma', hit=True, n=len(window) - len(misses))
+        count_lookup('lemma', hit=False, n=len(misses))
+        for i in misses:
+            results[i] = remember_doc(nlp, window[i])
+        yield from results
+
 def process_review(text: str):
     """
     Processes a review text and extracts specific fields.
@@ -74,25 +234,36 @@ def process_review(text: str):
 class ProcessTextTransformer(TransformComponent):
     """
     A transformer component that processes text nodes and returns normalized tokens.
-    Methods
+    Texts are normalized in batches, see process_texts.
     """
-    def __init__(self):
-        super().__init__()
+    batch_size: int = settings.RAG_SETTINGS['NLP']['BATCH_SIZE']
+    n_process: int = settings.RAG_SETTINGS['NLP']['N_PROCESS']
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
     def __call__(self, nodes: Sequence[BaseNode], **kwargs) -> Sequence[BaseNode]:
         """
         Process text and return normalized text with metadata.
         """
-        processed_nodes = []
+        reviews = []
         for node in nodes:
             text = node.get_content()
             # get review parts
             review = process_review(text)
             if review is None or review['text'] == '':
                 continue
-            # process full review
-            review_text = f"{review['name_ru']} {review['rubrics']} {review['text']}"
-            tokens = process_text(review_text)
+            reviews.append((node, review))
+
+        # process full reviews
+        review_texts = (
+            f"{review['name_ru']} {review['rubrics']} {review['text']}"
+            for _, review in reviews
+        )
+        all_tokens = process_texts(review_texts, batch_size=self.batch_size, n_process=self.n_process)
+
+        processed_nodes = []
+        for (node, review), tokens in zip(reviews, all_tokens):
             # set content to processed tokens
             node.set_content(' '.join(tokens))
             # set metadata
@@ -109,35 +280,101 @@ class CustomTextSplitter(TextSplitter):
     a specific regular expression pattern `(?=name_ru=)`.
     """
     def split_text(self, text: str) -> List[str]:
-        return re.split(r'(?=name_ru=)', text)
+        return [split for split in re.split(r'(?=name_ru=)', text) if split.strip()]
+
+def review_node_id(i: int, document: BaseNode) -> str:
+    """
+    Return a deterministic id for the i-th node split from a document.
+    The single node of a review document takes the id of the document, see review_id.
+    """
+    if i == 0:
+        try:
+            return str(uuid.UUID(document.id_))
+        except ValueError:
+            pass
+    return str(uuid.uuid5(REVIEW_ID_NAMESPACE, f'{document.id_}:{i}'))
 
 # create the pipeline with transformations
 pipeline = [
-    CustomTextSplitter(),
+    CustomTextSplitter(id_func=review_node_id),
     ProcessTextTransformer(),
 ]
 
-def sparse_doc_vectors(
-    texts: List[str],
-) -> Tuple[List[List[int]], List[List[float]]]:
+def is_vectorizer_fitted() -> bool:
     """
-    Compute sparse document vectors using TF-IDF.
-    To be used by VectorStoreIndex.
+    Check if the vectorizer has a fitted vocabulary.
+    """
+    vectorizer, _ = get_vectorizer()
+    return hasattr(vectorizer, 'vocabulary_')
+
+def fit_vectorizer(texts: Iterable[str]) -> int:
     """
-    tfidf_matrix = vectorizer.fit_transform(texts)
+    Fit the vectorizer over the whole normalized corpus and persist it.
+    Document and query vectors are then computed against this single vocabulary.
+    Texts are consumed as a stream, only the document frequency of each term is
+    kept in memory, the result is the same as TfidfVectorizer.fit.
+    Returns the new vocabulary version.
+    """
+    _, vocabulary_version = get_vectorizer()
+
+    fitted_vectorizer = TfidfVectorizer()
+    analyze = fitted_vectorizer.build_analyzer()
+    document_frequencies = Counter()
+    n_documents = 0
+    for text in texts:
+        document_frequencies.update(set(analyze(text)))
+        n_documents += 1
+    if not document_frequencies:
+        raise ValueError('empty vocabulary; perhaps the documents only contain stop words')
+
+    terms = sorted(document_frequencies)
+    fitted_vectorizer.vocabulary_ = {term: i for i, term in enumerate(terms)}
+    df = np.fromiter((document_frequencies[term] for term in terms), dtype=np.float64, count=len(terms))
+    # smoothed idf, as computed by TfidfTransformer
+    fitted_vectorizer.idf_ = np.log((1 + n_documents) / (1 + df)) + 1
+    version = vocabulary_version + 1
 
     # cache the vectorizer
-    joblib.dump(vectorizer, vectorizer_cache_path)
+    joblib.dump({
+        'format': VECTORIZER_CACHE_FORMAT,
+        'version': version,
+        'vectorizer': fitted_vectorizer,
+    }, vectorizer_cache_path)
+
+    get_vectorizer.set((fitted_vectorizer, version))
+    return version
+
+def csr_to_sparse_vectors(
+    matrix: csr_matrix,
+) -> Tuple[List[List[int]], List[List[float]]]:
+    """
+    Convert the rows of a CSR matrix to sparse vector indices and values.
+    Slices indptr/indices/data directly, without per-element matrix indexing.
+    """
+    matrix = csr_matrix(matrix)
+    bounds = matrix.indptr.tolist()
+    all_indices = matrix.indices.tolist()
+    all_values = matrix.data.tolist()
 
     indices = []
     values = []
-    for i in range(len(texts)):
-        cuu_indices = tfidf_matrix[i,:].nonzero()[1]
-        values.append([tfidf_matrix[i, x] for x in cuu_indices])
-        indices.append(cuu_indices)
+    for start, end in zip(bounds, bounds[1:]):
+        indices.append(all_indices[start:end])
+        values.append(all_values[start:end])
 
     return indices, values
 
+def sparse_doc_vectors(
+    texts: List[str],
+) -> Tuple[List[List[int]], List[List[float]]]:
+    """
+    Compute sparse document vectors using TF-IDF.
+    To be used by VectorStoreIndex.
+    """
+    vectorizer, _ = get_vectorizer()
+    return csr_to_sparse_vectors(vectorizer.transform(texts))
+
+@query_stage('vectorize')
 def sparse_query_vectors(
     texts: List[str],
 ) -> Tuple[List[List[int]], List[List[float]]]:
@@ -145,12 +382,39 @@ def sparse_query_vectors(
     Compute sparse query vectors using TF-IDF.
     To be used by VectorStoreIndex.
     """
-    tfidf_matrix = vectorizer.transform(texts)
-    indices = []
-    values = []
-    for i in range(len(texts)):
-        cuu_indices = tfidf_matrix[i,:].nonzero()[1]
-        values.append([tfidf_matrix[i, x] for x in cuu_indices])
-        indices.append(cuu_indices)
-    return indices, values
+    vectorizer, _ = get_vectorizer()
+    return csr_to_sparse_vectors(vectorizer.transform(texts))
+
+
+# term frequency vectors of the 'idf' sparse mode, where Qdrant applies IDF at query time.
+# Terms are hashed to their index, so vectors don't depend on a fitted vocabulary.
+# Documents are l2 normalized like TF-IDF vectors, queries count each term.
+tf_doc_vectorizer = HashingVectorizer(n_features=2 ** 20, alternate_sign=False, norm='l2')
+tf_query_vectorizer = HashingVectorizer(n_features=2 ** 20, alternate_sign=False, norm=None)
+
+def tf_doc_vectors(
+    texts: List[str],
+) -> Tuple[List[List[int]], List[List[float]]]:
+    """
+    Compute sparse document vectors of term frequencies.
+    To be used by VectorStoreIndex in the 'idf' sparse mode.
+    """
+    return csr_to_sparse_vectors(tf_doc_vectorizer.transform(texts))
+
+@query_stage('vectorize')
+def tf_query_vectors(
+    texts: List[str],
+) -> Tuple[List[List[int]], List[List[float]]]:
+    """
+    Compute sparse query vectors of term frequencies.
+    To be used by VectorStoreIndex in the 'idf' sparse mode.
+    """
+    return csr_to_sparse_vectors(tf_query_vectorizer.transform(texts))
 
+# document and query encoders of each sparse mode:
+# 'tfidf' bakes the IDF of the fitted vocabulary into the points,
+# 'idf' stores term frequencies and lets Qdrant compute IDF over the collection
+sparse_encoders = {
+    'tfidf': (sparse_doc_vectors, sparse_query_vectors),
+    'idf': (tf_doc_vectors, tf_query_vectors),
+}
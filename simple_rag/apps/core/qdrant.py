@@ -2,54 +2,363 @@
 #
 # SPDX-License-Identifier: MIT
 
-from typing import List
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
+import httpx
 from django.conf import settings
-from qdrant_client import QdrantClient
-from llama_index.core.schema import Document
+from grpc import RpcError
+from pydantic import PrivateAttr
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http import models as rest
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.local.qdrant_local import QdrantLocal
 from llama_index.vector_stores.qdrant import QdrantVectorStore
+from llama_index.vector_stores.qdrant.base import (
+    DENSE_VECTOR_NAME, DOCUMENT_ID_KEY, SPARSE_VECTOR_NAME, SPARSE_VECTOR_NAME_OLD,
+)
 from llama_index.core.base.base_query_engine import BaseQueryEngine
-from llama_index.vector_stores.qdrant import QdrantVectorStore
-from llama_index.core import VectorStoreIndex, StorageContext
+from llama_index.core.schema import BaseNode, MetadataMode, TextNode
+from llama_index.core.utils import iter_batch
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode, VectorStoreQueryResult
+from llama_index.core import VectorStoreIndex
+
+from simple_rag.apps.core.metrics import query_stage
+from simple_rag.apps.core.pipeline import sparse_encoders, pipeline
+from simple_rag.apps.core.utils import LazyResource
+
+logger = logging.getLogger(__name__)
+
+def client_options(name: str) -> Dict[str, Any]:
+    """
+    Return the arguments of the 'query' or 'ingest' client of the Qdrant server,
+    tuned in QDRANT_GATEWAY['CLIENTS'].
+    """
+    gateway = settings.QDRANT_GATEWAY
+    options = gateway['CLIENTS'][name]
+    return {
+        'host': gateway['HOST'],
+        'port': gateway['PORT'],
+        'grpc_port': gateway['GRPC_PORT'],
+        'prefer_grpc': options['PREFER_GRPC'],
+        'timeout': options['TIMEOUT'],
+        'limits': httpx.Limits(
+            max_connections=options['POOL_SIZE'],
+            max_keepalive_connections=options['POOL_SIZE'],
+            keepalive_expiry=options['KEEPALIVE_EXPIRY'],
+        ),
+        'grpc_options': {
+            'grpc.keepalive_time_ms': options['GRPC_KEEPALIVE'] * 1000,
+            'grpc.keepalive_timeout_ms': options['TIMEOUT'] * 1000,
+        },
+    }
+
+def create_client(name: str = 'query') -> QdrantClient:
+    """
+    Create a client of the Qdrant server, or of a local Qdrant running in this process
+    if QDRANT_GATEWAY['PATH'] is set. A local storage folder is locked by the process
+    that opens it, so it is served by a single process.
+    """
+    path = settings.QDRANT_GATEWAY['PATH']
+    if path == ':memory:':
+        return QdrantClient(location=path)
+    if path:
+        try:
+            return QdrantClient(path=path)
+        except RuntimeError as e:
+            raise RuntimeError(
+                f"Local Qdrant storage '{path}' is open in another process. A local Qdrant can't be "
+                f'shared by several workers, serve it with NUMPROCS=1 after init_index has exited, '
+                f'or unset QDRANT_PATH to use the Qdrant server.'
+            ) from e
+    return QdrantClient(**client_options(name))
+
+def create_ingest_client() -> QdrantClient:
+    """
+    Create the client of the ingest path, with longer timeouts than queries need.
+    A local Qdrant has one client, shared by both paths.
+    """
+    if is_local_client():
+        return get_client()
+    return create_client('ingest')
+
+def create_aclient() -> AsyncQdrantClient:
+    """
+    Create an asynchronous client of the Qdrant server, for queries.
+    """
+    if settings.QDRANT_GATEWAY['PATH']:
+        # a second local client would open its own, separate storage
+        raise ValueError('No asynchronous client in local mode, use the client in a thread')
+    return AsyncQdrantClient(**client_options('query'))
+
+# payload fields of query results, see payload_to_query_request
+PAYLOAD_FIELDS = ['file_name', 'review_text', 'name_ru', 'rubrics']
+# points also store their file, see file_path_filter
+STORED_PAYLOAD_FIELDS = PAYLOAD_FIELDS + ['file_path']
+# keyword fields queries can be filtered on, see payload_filter
+FILTER_FIELDS = ['rubrics', 'name_ru']
+INDEXED_PAYLOAD_FIELDS = ['file_path'] + FILTER_FIELDS
+RUBRICS_SEPARATOR = ';'
+
+def compact_payload(metadata: Dict) -> Dict:
+    """
+    Return the payload of a node, rubrics are stored as a list so each one is indexed.
+    """
+    payload = {field: metadata[field] for field in STORED_PAYLOAD_FIELDS if field in metadata}
+    if isinstance(payload.get('rubrics'), str):
+        payload['rubrics'] = [rubric.strip() for rubric in payload['rubrics'].split(RUBRICS_SEPARATOR) if rubric.strip()]
+    return payload
+
+def payload_filter(filters: Optional[Dict[str, str]]) -> Optional[rest.Filter]:
+    """
+    Return a filter of the points whose payload has each keyword of filters,
+    by field, e.g. a point matches a rubric if it is one of its rubrics.
+    """
+    if not filters:
+        return None
+    return rest.Filter(must=[
+        rest.FieldCondition(key=field, match=rest.MatchValue(value=value))
+        for field, value in filters.items()
+    ])
+
+# clients, created on first use
+get_client = LazyResource('qdrant_client', create_client)
+get_ingest_client = LazyResource('qdrant_ingest_client', create_ingest_client)
+get_aclient = LazyResource('qdrant_async_client', create_aclient)
+
+# sparse vector name and sparse mode of each collection, they are fixed when the collection is created
+sparse_vector_names: Dict[str, str] = {}
+sparse_modes: Dict[str, str] = {}
+
+def reciprocal_rank_fusion(
+    dense_result: VectorStoreQueryResult,
+    sparse_result: VectorStoreQueryResult,
+    alpha: float = 0.5,
+    top_k: int = 2,
+    k: int = settings.RAG_SETTINGS['QUERY']['RRF_K'],
+) -> VectorStoreQueryResult:
+    """
+    Fuse dense and sparse results by reciprocal rank, a node scores
+    alpha / (k + dense rank) + (1 - alpha) / (k + sparse rank), ranks starting at 1.
+    Unlike relative score fusion it doesn't depend on the scales of the scores.
+    """
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, BaseNode] = {}
+    for result, weight in ((dense_result, alpha), (sparse_result, 1 - alpha)):
+        ranked = sorted(
+            zip(result.similarities or [], result.nodes or []), key=lambda item: item[0], reverse=True,
+        )
+        for rank, (_, node) in enumerate(ranked, start=1):
+            nodes.setdefault(node.node_id, node)
+            scores[node.node_id] = scores.get(node.node_id, 0.0) + weight / (k + rank)
+
+    top_ids = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return VectorStoreQueryResult(
+        nodes=[nodes[node_id] for node_id in top_ids],
+        similarities=[scores[node_id] for node_id in top_ids],
+        ids=top_ids,
+    )
+
+class CompactQdrantVectorStore(QdrantVectorStore):
+    """
+    Qdrant vector store whose points carry only STORED_PAYLOAD_FIELDS, rather than
+    the node serialized to JSON along with its metadata, so the review text is stored
+    once. Searches fetch only PAYLOAD_FIELDS and nodes of search results are rebuilt
+    from the payload, the review as text.
+    The collection is created with the storage options of storage, see STORAGE settings.
+    """
+    _storage: Dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, *args, storage: Optional[Dict[str, Any]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._storage = storage or {}
 
-from simple_rag.apps.core.pipeline import sparse_doc_vectors, sparse_query_vectors, pipeline
+    @classmethod
+    def class_name(cls) -> str:
+        return 'CompactQdrantVectorStore'
 
-client = QdrantClient(host=settings.QDRANT_GATEWAY['HOST'], port=settings.QDRANT_GATEWAY['PORT'])
+    def _create_collection(self, collection_name: str, vector_size: int):
+        """
+        Create the collection as QdrantVectorStore does, with the storage options merged in.
+        A collection created meanwhile, e.g. by another process, is kept as it is.
+        """
+        dense_config = self._dense_config or rest.VectorParams(size=vector_size, distance=rest.Distance.COSINE)
+        if self._storage.get('DENSE_ON_DISK') is not None:
+            dense_config = dense_config.model_copy(update={'on_disk': self._storage['DENSE_ON_DISK']})
+        sparse_config = self._sparse_config or rest.SparseVectorParams(index=rest.SparseIndexParams())
+        storage_options = dict(
+            on_disk_payload=self._storage.get('PAYLOAD_ON_DISK'),
+            hnsw_config=rest.HnswConfigDiff(on_disk=self._storage.get('HNSW_ON_DISK')),
+            optimizers_config=rest.OptimizersConfigDiff(
+                memmap_threshold=self._storage.get('MEMMAP_THRESHOLD'),
+                indexing_threshold=self._storage.get('INDEXING_THRESHOLD'),
+                default_segment_number=self._storage.get('SEGMENT_NUMBER'),
+            ),
+        )
+        try:
+            if self.enable_hybrid:
+                self._client.create_collection(
+                    collection_name=collection_name,
+                    vectors_config={DENSE_VECTOR_NAME: dense_config},
+                    sparse_vectors_config={SPARSE_VECTOR_NAME: sparse_config},
+                    quantization_config=self._quantization_config,
+                    **storage_options,
+                )
+            else:
+                self._client.create_collection(
+                    collection_name=collection_name,
+                    vectors_config=dense_config,
+                    quantization_config=self._quantization_config,
+                    **storage_options,
+                )
+            if self.index_doc_id:
+                self._client.create_payload_index(
+                    collection_name=collection_name,
+                    field_name=DOCUMENT_ID_KEY,
+                    field_schema=rest.PayloadSchemaType.KEYWORD,
+                )
+        except (RpcError, ValueError, UnexpectedResponse) as e:
+            if 'already exists' not in str(e):
+                raise
+            logger.warning('Collection %s already exists, skipping collection creation.', collection_name)
+        self._collection_initialized = True
+
+    def _build_points(
+        self, nodes: List[BaseNode], sparse_vector_name: str, sparse: bool = True,
+    ) -> Tuple[List[Any], List[str]]:
+        """
+        Build the points of nodes, without sparse vectors unless sparse, e.g. before
+        the vocabulary is fitted.
+        """
+        points = []
+        for node_batch in iter_batch(nodes, self.batch_size):
+            sparse_indices, sparse_values = [], []
+            if self.enable_hybrid and sparse and self._sparse_doc_fn is not None:
+                sparse_indices, sparse_values = self._sparse_doc_fn(
+                    [node.get_content(metadata_mode=MetadataMode.EMBED) for node in node_batch],
+                )
+            for i, node in enumerate(node_batch):
+                if self.enable_hybrid:
+                    vector = {DENSE_VECTOR_NAME: node.get_embedding()}
+                    if sparse_indices:
+                        vector[sparse_vector_name] = rest.SparseVector(
+                            indices=sparse_indices[i], values=sparse_values[i],
+                        )
+                else:
+                    vector = node.get_embedding()
+                points.append(rest.PointStruct(
+                    id=node.node_id,
+                    payload=compact_payload(node.metadata),
+                    vector=vector,
+                ))
+        return points, [point.id for point in points]
+
+    def parse_to_query_result(self, response: List[Any]) -> VectorStoreQueryResult:
+        nodes = [
+            TextNode(id_=str(point.id), text=point.payload.get('review_text', ''), metadata=point.payload)
+            for point in response
+        ]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=[point.score for point in response],
+            ids=[node.node_id for node in nodes],
+        )
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """
+        Search the collection as QdrantVectorStore does, with the Query API and fetching
+        only PAYLOAD_FIELDS of the points. qdrant_filters replace the filters of the query.
+        Dense, sparse and hybrid queries of named vectors are projected, other modes
+        and collections with an unnamed vector are left to QdrantVectorStore.
+        """
+        sparse = self._sparse_query_fn is not None and query.query_str is not None
+        modes = [VectorStoreQueryMode.DEFAULT]
+        if sparse:
+            modes += [VectorStoreQueryMode.SPARSE, VectorStoreQueryMode.HYBRID]
+        if not self.enable_hybrid or query.mode not in modes:
+            return super().query(query, **kwargs)
+
+        query_filter = kwargs.get('qdrant_filters')
+        if query_filter is None:
+            query_filter = self._build_query_filter(query)
+        requests = []
+        if query.mode != VectorStoreQueryMode.SPARSE:
+            requests.append(rest.QueryRequest(
+                query=query.query_embedding,
+                using=DENSE_VECTOR_NAME,
+                filter=query_filter,
+                limit=query.similarity_top_k,
+                with_payload=PAYLOAD_FIELDS,
+            ))
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            indices, values = self._sparse_query_fn([query.query_str])
+            requests.append(rest.QueryRequest(
+                query=rest.SparseVector(indices=indices[0], values=values[0]),
+                using=self.sparse_vector_name(),
+                filter=query_filter,
+                limit=query.sparse_top_k or query.similarity_top_k,
+                with_payload=PAYLOAD_FIELDS,
+            ))
+
+        responses = self._client.query_batch_points(collection_name=self.collection_name, requests=requests)
+        if len(responses) == 1:
+            return self.parse_to_query_result(responses[0].points)
+        # dense and sparse results of a hybrid query
+        return self._hybrid_fusion_fn(
+            self.parse_to_query_result(responses[0].points),
+            self.parse_to_query_result(responses[1].points),
+            alpha=query.alpha or 0.5,
+            top_k=query.hybrid_top_k or query.similarity_top_k,
+        )
 
 def create_vector_store(
     collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
     batch_size: int = settings.RAG_SETTINGS['VECTOR_STORE']['BATCH_SIZE'],
     enable_hybrid: bool = settings.RAG_SETTINGS['VECTOR_STORE']['ENABLE_HYBRID'],
+    sparse_mode: str = settings.RAG_SETTINGS['VECTOR_STORE']['SPARSE_MODE'],
+    fusion: str = settings.RAG_SETTINGS['QUERY']['FUSION'],
+    storage: Dict[str, Any] = settings.RAG_SETTINGS['VECTOR_STORE']['STORAGE'],
+    client: Optional[QdrantClient] = None,
 ):
     """
-    Create a vector store for the documents.
+    Create a vector store for the documents, using the query client unless
+    another client is given, e.g. the ingest client.
+    In the 'idf' sparse mode the collection is created with the IDF modifier
+    and points store term frequencies only, see sparse_encoders.
+    Hybrid queries fuse dense and sparse results by reciprocal rank if fusion is 'rrf'.
+    Points carry the compact payload of CompactQdrantVectorStore, a new collection
+    is created with the storage options of storage.
     """
-    vector_store = QdrantVectorStore(
+    if sparse_mode not in sparse_encoders:
+        raise ValueError(f"Unknown sparse mode '{sparse_mode}', expected one of {list(sparse_encoders)}")
+    sparse_doc_fn, sparse_query_fn = sparse_encoders[sparse_mode]
+
+    vector_store = CompactQdrantVectorStore(
         collection_name,
-        client=client,
+        client=client or get_client(),
         batch_size=batch_size,
         enable_hybrid=enable_hybrid,
-        sparse_doc_fn=sparse_doc_vectors,
-        sparse_query_fn=sparse_query_vectors,
+        sparse_doc_fn=sparse_doc_fn,
+        sparse_query_fn=sparse_query_fn,
+        sparse_config=rest.SparseVectorParams(
+            index=rest.SparseIndexParams(on_disk=storage.get('SPARSE_INDEX_ON_DISK')),
+            modifier=rest.Modifier.IDF if sparse_mode == 'idf' else None,
+        ),
+        # None keeps the relative score fusion of llama-index
+        hybrid_fusion_fn=reciprocal_rank_fusion if fusion == 'rrf' else None,
+        # points have no document id payload, see create_payload_indexes
+        index_doc_id=False,
+        storage=storage,
     )
 
     return vector_store
 
-def create_index(documents: List[Document], vector_store: QdrantVectorStore):
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    vector_store_index = VectorStoreIndex.from_documents(
-        documents,
-        show_progress=True,
-        transformations=pipeline,
-        storage_context=storage_context,
-    )
-
-    return vector_store_index
-
 def get_index(
     collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
     batch_size: int = settings.RAG_SETTINGS['VECTOR_STORE']['BATCH_SIZE'],
     enable_hybrid: bool = settings.RAG_SETTINGS['VECTOR_STORE']['ENABLE_HYBRID'],
+    sparse_mode: str = settings.RAG_SETTINGS['VECTOR_STORE']['SPARSE_MODE'],
 ) -> VectorStoreIndex:
     """
     Get the index from the vector store.
@@ -58,6 +367,7 @@ def get_index(
         collection_name=collection_name,
         batch_size=batch_size,
         enable_hybrid=enable_hybrid,
+        sparse_mode=sparse_mode,
     )
     index = VectorStoreIndex.from_vector_store(
         vector_store=vector_store,
@@ -65,25 +375,282 @@ def get_index(
     )
     return index
 
+# index of the query engines, created on first use
+get_query_index = LazyResource('query_index', get_index)
+
 def create_query_engine(
     similarity_top_k: int = settings.RAG_SETTINGS['QUERY']['SIMILARITY_TOP_K'],
     sparse_top_k: int = settings.RAG_SETTINGS['QUERY']['SPARSE_TOP_K'],
+    hybrid_candidates: int = settings.RAG_SETTINGS['QUERY']['HYBRID_CANDIDATES'],
+    filters: Optional[Dict[str, str]] = None,
 ) -> BaseQueryEngine:
     """
-    Create a query engine.
+    Create a query engine, searching only points matching filters if given.
+    A hybrid query engine fetches hybrid_candidates dense and sparse results
+    and fuses them into similarity_top_k results.
     """
     if not settings.ENABLE_ENGINE:
         return None
-    index: VectorStoreIndex = get_index()
+    index: VectorStoreIndex = get_query_index()
+    mode = settings.RAG_SETTINGS['QUERY']['MODE']
+    if mode == 'hybrid':
+        top_k = dict(
+            similarity_top_k=hybrid_candidates,
+            sparse_top_k=hybrid_candidates,
+            hybrid_top_k=similarity_top_k,
+        )
+    else:
+        top_k = dict(similarity_top_k=similarity_top_k, sparse_top_k=sparse_top_k)
     query_engine: BaseQueryEngine = index.as_query_engine(
-        similarity_top_k=similarity_top_k,
-        sparse_top_k=sparse_top_k,
-        vector_store_query_mode=settings.RAG_SETTINGS['QUERY']['MODE'],
+        vector_store_query_mode=mode,
+        vector_store_kwargs={'qdrant_filters': payload_filter(filters)},
+        **top_k,
     )
     return query_engine
 
+# query engine, created on first use
+get_query_engine = LazyResource('query_engine', create_query_engine)
+
+def is_local_client() -> bool:
+    """
+    Check if the client runs Qdrant in process, local collections are not thread-safe.
+    """
+    return isinstance(get_client()._client, QdrantLocal)
+
 def collection_exists(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> bool:
     """
     Check if a collection exists in the vector store.
     """
-    return client.collection_exists(collection_name=collection_name)
+    return get_client().collection_exists(collection_name=collection_name)
+
+def dense_vector_size(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> int:
+    """
+    Return the size of the dense vectors of a collection.
+    """
+    vectors = get_client().get_collection(collection_name).config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors[DENSE_VECTOR_NAME]
+    return vectors.size
+
+def delete_collection(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> bool:
+    """
+    Delete a collection from the vector store.
+    """
+    sparse_vector_names.pop(collection_name, None)
+    sparse_modes.pop(collection_name, None)
+    return get_ingest_client().delete_collection(collection_name=collection_name)
+
+def collection_storage(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> Dict[str, Any]:
+    """
+    Return the effective storage options of a collection, by STORAGE setting.
+    """
+    config = get_client().get_collection(collection_name).config
+    vectors = config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors[DENSE_VECTOR_NAME]
+    sparse_vectors = config.params.sparse_vectors or {}
+    sparse_params = sparse_vectors.get(sparse_vector_name(collection_name))
+    return {
+        'DENSE_ON_DISK': bool(vectors.on_disk),
+        'SPARSE_INDEX_ON_DISK': bool(sparse_params and sparse_params.index and sparse_params.index.on_disk),
+        'HNSW_ON_DISK': bool(config.hnsw_config.on_disk),
+        # Qdrant stores payloads on disk unless told otherwise
+        'PAYLOAD_ON_DISK': config.params.on_disk_payload is not False,
+        'MEMMAP_THRESHOLD': config.optimizer_config.memmap_threshold,
+        'INDEXING_THRESHOLD': config.optimizer_config.indexing_threshold,
+        'SEGMENT_NUMBER': config.optimizer_config.default_segment_number,
+    }
+
+def has_current_payload(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> bool:
+    """
+    Check if points of a collection carry the current compact payload. Points of
+    older collections store the serialized node, or their rubrics as one string.
+    """
+    points, _ = get_client().scroll(
+        collection_name=collection_name,
+        limit=1,
+        with_payload=['_node_content', 'rubrics'],
+        with_vectors=False,
+    )
+    return all(
+        '_node_content' not in point.payload and isinstance(point.payload.get('rubrics', []), list)
+        for point in points
+    )
+
+def file_path_filter(file_path: str) -> rest.Filter:
+    return payload_filter({'file_path': file_path})
+
+def create_payload_indexes(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']):
+    """
+    Index the keyword payload fields, so points of a file and filtered searches
+    are found without a full scan.
+    """
+    # payload indexes have no effect in a local collection
+    if is_local_client():
+        return
+    for field_name in INDEXED_PAYLOAD_FIELDS:
+        get_ingest_client().create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=rest.PayloadSchemaType.KEYWORD,
+        )
+
+def delete_file_points(
+    file_path: str,
+    collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
+):
+    """
+    Delete the points of all reviews read from a dataset file.
+    """
+    get_ingest_client().delete(
+        collection_name=collection_name,
+        points_selector=rest.FilterSelector(filter=file_path_filter(file_path)),
+    )
+
+def get_file_point_ids(
+    file_path: str,
+    collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
+    batch_size: int = settings.RAG_SETTINGS['VECTOR_STORE']['SCROLL_BATCH_SIZE'],
+) -> Set[str]:
+    """
+    Return the ids of the points of all reviews read from a dataset file.
+    """
+    point_ids = set()
+    offset = None
+    while True:
+        points, offset = get_ingest_client().scroll(
+            collection_name=collection_name,
+            scroll_filter=file_path_filter(file_path),
+            limit=batch_size,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False,
+        )
+        point_ids.update(str(point.id) for point in points)
+        if offset is None:
+            return point_ids
+
+def delete_points(
+    point_ids: Iterable[str],
+    collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
+    batch_size: int = settings.RAG_SETTINGS['VECTOR_STORE']['SCROLL_BATCH_SIZE'],
+):
+    """
+    Delete points by id, in batches of batch_size ids.
+    """
+    point_ids = list(point_ids)
+    for start in range(0, len(point_ids), batch_size):
+        get_ingest_client().delete(
+            collection_name=collection_name,
+            points_selector=rest.PointIdsList(points=point_ids[start:start + batch_size]),
+        )
+
+def remember_sparse_vectors(collection_name: str, sparse_vectors: Dict[str, rest.SparseVectorParams]):
+    """
+    Record the sparse vector name and mode of a collection from its sparse vectors config,
+    collections created by older llama-index versions use the old name.
+    """
+    name = SPARSE_VECTOR_NAME_OLD if SPARSE_VECTOR_NAME_OLD in sparse_vectors else SPARSE_VECTOR_NAME
+    params = sparse_vectors.get(name)
+    sparse_vector_names[collection_name] = name
+    sparse_modes[collection_name] = 'idf' if params is not None and params.modifier == rest.Modifier.IDF else 'tfidf'
+
+def sparse_vector_name(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> str:
+    """
+    Return the name of the sparse vectors of a collection.
+    """
+    if collection_name not in sparse_vector_names:
+        sparse_vectors = get_client().get_collection(collection_name).config.params.sparse_vectors or {}
+        remember_sparse_vectors(collection_name, sparse_vectors)
+    return sparse_vector_names[collection_name]
+
+async def asparse_vector_name(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> str:
+    """
+    Asynchronous version of sparse_vector_name.
+    """
+    if collection_name not in sparse_vector_names:
+        collection = await get_aclient().get_collection(collection_name)
+        remember_sparse_vectors(collection_name, collection.config.params.sparse_vectors or {})
+    return sparse_vector_names[collection_name]
+
+def sparse_mode(collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME']) -> str:
+    """
+    Return the sparse mode a collection was created with, 'idf' if Qdrant applies the IDF modifier.
+    """
+    sparse_vector_name(collection_name)
+    return sparse_modes[collection_name]
+
+def search_sparse_batch(
+    queries: List[str],
+    limit: int = settings.RAG_SETTINGS['QUERY']['SPARSE_TOP_K'],
+    batch_size: int = settings.RAG_SETTINGS['QUERY']['BATCH_SIZE'],
+    collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
+    filters: Optional[Dict[str, str]] = None,
+) -> List[List[rest.ScoredPoint]]:
+    """
+    Search the sparse vectors of many normalized queries, among points matching filters if given.
+    Query vectors are computed in one transform and sent in batch requests
+    of batch_size queries. Returns the scored points of each query, in order.
+    """
+    using = sparse_vector_name(collection_name)
+    query_filter = payload_filter(filters)
+    _, sparse_query_fn = sparse_encoders[sparse_modes[collection_name]]
+    indices, values = sparse_query_fn(queries)
+
+    results = [[] for _ in queries]
+    # queries without known terms can't match anything
+    searched = [i for i, query_indices in enumerate(indices) if query_indices]
+    for start in range(0, len(searched), batch_size):
+        batch = searched[start:start + batch_size]
+        with query_stage('search'):
+            responses = get_client().query_batch_points(
+                collection_name=collection_name,
+                requests=[
+                    rest.QueryRequest(
+                        query=rest.SparseVector(indices=indices[i], values=values[i]),
+                        using=using,
+                        filter=query_filter,
+                        limit=limit,
+                        with_payload=PAYLOAD_FIELDS,
+                    )
+                    for i in batch
+                ],
+            )
+        for i, response in zip(batch, responses):
+            results[i] = response.points
+
+    return results
+
+async def asearch_sparse(
+    query: str,
+    limit: int = settings.RAG_SETTINGS['QUERY']['SPARSE_TOP_K'],
+    collection_name: str = settings.RAG_SETTINGS['VECTOR_STORE']['COLLECTION_NAME'],
+    filters: Optional[Dict[str, str]] = None,
+) -> List[rest.ScoredPoint]:
+    """
+    Search the sparse vectors of a normalized query with the asynchronous client.
+    A local Qdrant is searched with the client in a thread, off the event loop.
+    """
+    if is_local_client():
+        points = await asyncio.to_thread(
+            search_sparse_batch, [query], limit, collection_name=collection_name, filters=filters,
+        )
+        return points[0]
+
+    using = await asparse_vector_name(collection_name)
+    _, sparse_query_fn = sparse_encoders[sparse_modes[collection_name]]
+    indices, values = sparse_query_fn([query])
+    # a query without known terms can't match anything
+    if not indices[0]:
+        return []
+
+    with query_stage('search'):
+        response = await get_aclient().query_points(
+            collection_name=collection_name,
+            query=rest.SparseVector(indices=indices[0], values=values[0]),
+            using=using,
+            query_filter=payload_filter(filters),
+            limit=limit,
+            with_payload=PAYLOAD_FIELDS,
+        )
+    return response.points
@@ -6,4 +6,21 @@ from rest_framework.renderers import JSONRenderer
 
 
 class SimpleRagAPIRenderer(JSONRenderer):
-    media_type = 'application/vnd.simple_rag+json'
\ No newline at end of file
+    media_type = 'application/vnd.simple_rag+json'
+
+class NDJSONRenderer(JSONRenderer):
+    """
+    Renders a list as newline delimited JSON, one value per line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not isinstance(data, list):
+            data = [data]
+        return b''.join(
+            super(NDJSONRenderer, self).render(item, accepted_media_type, renderer_context) + b'\n'
+            for item in data
+        )
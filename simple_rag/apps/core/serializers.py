@@ -4,7 +4,8 @@
 
 from rest_framework import serializers
 
-from simple_rag.apps.core.models import TextRequest, ProcessTextResponse, QueryRequest
+from simple_rag.apps.core.models import (TextRequest, TextsRequest, QueryTextRequest, QueryTextsRequest,
+    ProcessTextResponse, QueryRequest, QueryBatchResponse, CacheStats, StatsResponse, ReadinessResponse)
 
 class TextRequestSerializer(serializers.Serializer):
     text = serializers.CharField()
@@ -24,6 +25,48 @@ class TextRequestSerializer(serializers.Serializer):
 
         return data
 
+class TextsRequestSerializer(serializers.Serializer):
+    texts = serializers.ListField(child=serializers.CharField())
+
+    def validate(self, instance: TextsRequest):
+        if not instance.texts:
+            raise serializers.ValidationError('texts should not be empty')
+        if any(text is None or text == '' for text in instance.texts):
+            raise serializers.ValidationError('text should not be empty')
+        return instance
+
+    def to_internal_value(self, data):
+        return TextsRequest(texts=data['texts'])
+
+    def to_representation(self, instance: TextsRequest):
+        data = {
+            'texts': instance.texts
+        }
+
+        return data
+
+class QueryTextRequestSerializer(TextRequestSerializer):
+    rubric = serializers.CharField(required=False)
+    name_ru = serializers.CharField(required=False)
+
+    def to_internal_value(self, data):
+        return QueryTextRequest(text=data['text'], rubric=data.get('rubric'), name_ru=data.get('name_ru'))
+
+    def to_representation(self, instance: QueryTextRequest):
+        data = instance.model_dump(mode='json', exclude_none=True)
+        return data
+
+class QueryTextsRequestSerializer(TextsRequestSerializer):
+    rubric = serializers.CharField(required=False)
+    name_ru = serializers.CharField(required=False)
+
+    def to_internal_value(self, data):
+        return QueryTextsRequest(texts=data['texts'], rubric=data.get('rubric'), name_ru=data.get('name_ru'))
+
+    def to_representation(self, instance: QueryTextsRequest):
+        data = instance.model_dump(mode='json', exclude_none=True)
+        return data
+
 class ProcessTextResponseSerializer(serializers.Serializer):
     tokens = serializers.ListField(child=serializers.CharField())
 
@@ -50,3 +93,37 @@ class QueryRequestSerializer(serializers.Serializer):
     def to_representation(self, instance: QueryRequest):
         data = instance.model_dump(mode='json')
         return data
+
+class QueryBatchResponseSerializer(serializers.Serializer):
+    results = serializers.ListField(child=QueryRequestSerializer(many=True))
+
+    def to_representation(self, instance: QueryBatchResponse):
+        data = instance.model_dump(mode='json')
+        return data
+
+class CacheStatsSerializer(serializers.Serializer):
+    size = serializers.IntegerField(allow_null=True)
+    max_size = serializers.IntegerField(allow_null=True)
+    hits = serializers.IntegerField()
+    misses = serializers.IntegerField()
+    hit_rate = serializers.FloatField()
+
+    def to_representation(self, instance: CacheStats):
+        data = instance.model_dump(mode='json')
+        return data
+
+class StatsResponseSerializer(serializers.Serializer):
+    caches = serializers.DictField(child=CacheStatsSerializer())
+
+    def to_representation(self, instance: StatsResponse):
+        data = instance.model_dump(mode='json')
+        return data
+
+class ReadinessResponseSerializer(serializers.Serializer):
+    ready = serializers.BooleanField()
+    startup_times = serializers.DictField(child=serializers.FloatField())
+    error = serializers.CharField(allow_null=True)
+
+    def to_representation(self, instance: ReadinessResponse):
+        data = instance.model_dump(mode='json')
+        return data
@@ -0,0 +1,41 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+from typing import Callable, List
+
+import pytest
+from qdrant_client import QdrantClient
+from llama_index.core.schema import Document
+
+from simple_rag.apps.core import qdrant
+
+REVIEWS = [
+    ('Магазин', 'Продукты', 'Хороший магазин, свежие продукты'),
+    ('Кафе', 'Общепит', 'Вкусный кофе и быстрое обслуживание'),
+    ('Школа', 'Образование', 'Отличные учителя и уютные классы'),
+    ('Аптека', 'Медицина', 'Вежливые фармацевты'),
+    ('Парк', 'Отдых', 'Красивый парк для прогулок'),
+]
+
+@pytest.fixture
+def local_client():
+    client = QdrantClient(':memory:')
+    qdrant.get_client.set(client)
+    yield client
+    qdrant.get_client.reset()
+    qdrant.get_ingest_client.reset()
+    qdrant.sparse_vector_names.clear()
+    qdrant.sparse_modes.clear()
+
+@pytest.fixture
+def make_documents() -> Callable[[], List[Document]]:
+    """
+    Return a factory of review documents, new ones on each call.
+    """
+    def documents() -> List[Document]:
+        return [
+            Document(text=f'name_ru={name}\trubrics={rubrics}\ttext={text}', metadata={'file_name': 'test.txt'})
+            for name, rubrics, text in REVIEWS
+        ]
+    return documents
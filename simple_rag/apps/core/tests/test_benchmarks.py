@@ -0,0 +1,38 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from simple_rag.apps.core import pipeline
+from simple_rag.apps.core.benchmarks import scale_dataset, run_benchmarks, create_report, compare_reports
+from simple_rag.apps.core.models import BenchmarkReport
+
+@pytest.fixture
+def dataset(tmp_path, make_documents):
+    (tmp_path / 'dataset').mkdir()
+    text = '\n'.join(document.text for document in make_documents())
+    (tmp_path / 'dataset' / 'reviews.txt').write_text(text, encoding='utf-8')
+    return tmp_path / 'dataset'
+
+def test_scale_dataset(dataset, tmp_path):
+    file_paths = scale_dataset(str(dataset), 3, str(tmp_path / 'scaled'))
+    assert len(file_paths) == 3
+    assert all(open(file_path, encoding='utf-8').read().count('name_ru=') == 5 for file_path in file_paths)
+
+def test_run_benchmarks(dataset, tmp_path):
+    file_paths = scale_dataset(str(dataset), 2, str(tmp_path / 'scaled'))
+    lemma_cache = pipeline.get_lemma_cache()
+    results = run_benchmarks(file_paths, scale=2, repeat=2, nlp_limit=3)
+    # the process caches are restored
+    assert pipeline.get_lemma_cache() is lemma_cache
+
+    items = {result.name: result.items for result in results}
+    assert items['split_text'] == items['sparse_doc_vectors'] == 10
+    assert items['process_text'] == items['sparse_query_vectors'] == 3
+    assert items['filter_documents'] == 2
+    assert all(result.repeat == 2 and 0 < result.best_seconds <= result.mean_seconds for result in results)
+
+    report = create_report(str(dataset), results)
+    assert BenchmarkReport.model_validate_json(report.model_dump_json()) == report
+    assert compare_reports(report, report) == {(result.name, 2): 1.0 for result in results}
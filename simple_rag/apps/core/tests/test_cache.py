@@ -0,0 +1,109 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+from unittest import TestCase
+
+from django.core.cache import cache as default_cache
+
+from simple_rag.apps.core.cache import LRUCache, QueryResultCache, get_index_generation, bump_index_generation
+from simple_rag.apps.core.models import QueryRequest
+
+class TestLRUCache(TestCase):
+
+    def test_get_set(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 0), 0)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_eviction(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # 'a' becomes the most recently used entry
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_stats(self):
+        cache = LRUCache(max_size=10)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+
+        stats = cache.stats()
+
+        self.assertEqual(stats.size, 1)
+        self.assertEqual(stats.max_size, 10)
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.hit_rate, 0.5)
+
+    def test_save_load(self):
+        cache = LRUCache(max_size=10)
+        cache.set('a', 'x')
+        cache.set('b', '')
+        self.assertTrue(cache.modified)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'cache.pkl')
+            cache.save(path)
+            self.assertFalse(cache.modified)
+
+            loaded_cache = LRUCache(max_size=1)
+            loaded_cache.load(path)
+
+        # only the most recently used entries fit
+        self.assertEqual(len(loaded_cache), 1)
+        self.assertEqual(loaded_cache.get('b'), '')
+        self.assertFalse(loaded_cache.modified)
+
+class TestQueryResultCache(TestCase):
+
+    def setUp(self):
+        self.results = [QueryRequest(dataset='dataset1.txt', text='text', score=1.0, additional_metadata={})]
+
+    def test_tokens(self):
+        cache = QueryResultCache(enabled=True)
+
+        self.assertIsNone(cache.get_tokens('Новый запрос для кэша токенов'))
+        cache.set_tokens('Новый запрос для кэша токенов', ['новый', 'запрос'])
+        self.assertEqual(cache.get_tokens('Новый запрос для кэша токенов'), ['новый', 'запрос'])
+
+    def test_results(self):
+        cache = QueryResultCache(enabled=True)
+        cache.set_results('запрос результат', self.results, top_k=3, mode='sparse')
+
+        self.assertEqual(cache.get_results('запрос результат', top_k=3, mode='sparse'), self.results)
+        self.assertIsNone(cache.get_results('запрос результат', top_k=5, mode='sparse'))
+        self.assertEqual(cache.stats().hits, 1)
+        self.assertEqual(cache.stats().misses, 1)
+
+    def test_results_invalidated_by_index_generation(self):
+        cache = QueryResultCache(enabled=True)
+        cache.set_results('запрос поколение', self.results, top_k=3)
+
+        generation = get_index_generation()
+        key = cache._results_key('запрос поколение', generation, top_k=3)
+        self.assertEqual(bump_index_generation(), generation + 1)
+        self.assertIsNone(cache.get_results('запрос поколение', top_k=3))
+        # results of the previous generation are removed, not only unreachable
+        self.assertNotIn(key, default_cache)
+
+    def test_disabled(self):
+        cache = QueryResultCache(enabled=False)
+        cache.set_results('запрос выключен', self.results, top_k=3)
+
+        self.assertIsNone(cache.get_results('запрос выключен', top_k=3))
+        self.assertEqual(cache.stats().misses, 0)
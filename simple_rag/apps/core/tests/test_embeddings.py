@@ -0,0 +1,88 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import spacy
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+from simple_rag.apps.core.embeddings import SpacyEmbedding
+from simple_rag.apps.core.ingestion import IngestionPipeline
+from simple_rag.apps.core.qdrant import create_vector_store, reciprocal_rank_fusion
+
+WORD_VECTORS = {
+    'кофе': [1.0, 0.0, 0.0],
+    'вкусный': [0.8, 0.2, 0.0],
+    'парк': [0.0, 1.0, 0.0],
+    'прогулка': [0.0, 0.9, 0.1],
+    'магазин': [0.0, 0.0, 1.0],
+}
+
+@pytest.fixture
+def embed_model(tmp_path):
+    nlp = spacy.blank('ru')
+    for word, vector in WORD_VECTORS.items():
+        nlp.vocab.set_vector(word, np.array(vector, dtype=np.float32))
+    nlp.to_disk(tmp_path / 'vectors')
+    return SpacyEmbedding(model_name=str(tmp_path / 'vectors'), embed_batch_size=2, cache_size=10)
+
+def test_spacy_embedding(embed_model):
+    embeddings = embed_model.get_text_embedding_batch(['вкусный кофе', 'парк прогулка', 'неизвестно'])
+    assert np.linalg.norm(embeddings[0]) == pytest.approx(1)
+    assert np.dot(embeddings[0], embed_model.get_query_embedding('кофе')) > 0.9
+    assert np.dot(embeddings[1], embed_model.get_query_embedding('кофе')) < 0.1
+    # texts without known words embed to zero vectors
+    assert embeddings[2] == [0.0, 0.0, 0.0]
+
+    # cached embeddings are not encoded again
+    with patch.object(SpacyEmbedding, 'encode', side_effect=AssertionError) as encode:
+        assert embed_model.get_text_embedding('вкусный кофе') == embeddings[0]
+        encode.assert_not_called()
+
+def test_spacy_embedding_threads(embed_model):
+    # no limit by default
+    with patch('simple_rag.apps.core.embeddings.threadpool_limits') as threadpool_limits:
+        embed_model.encode(['вкусный кофе'])
+    threadpool_limits.assert_not_called()
+
+    # the limit only holds while texts are encoded, not for the whole process
+    embed_model.threads = 2
+    with patch('simple_rag.apps.core.embeddings.threadpool_limits') as threadpool_limits:
+        embed_model.encode(['вкусный кофе'])
+    threadpool_limits.assert_called_once_with(limits=2)
+    threadpool_limits.return_value.__exit__.assert_called_once()
+
+def test_reciprocal_rank_fusion():
+    nodes = {node_id: TextNode(id_=node_id, text=node_id) for node_id in 'abcd'}
+    dense = VectorStoreQueryResult(nodes=[nodes['a'], nodes['b'], nodes['c']], similarities=[0.9, 0.8, 0.1])
+    sparse = VectorStoreQueryResult(nodes=[nodes['d'], nodes['c']], similarities=[12.0, 7.0])
+
+    result = reciprocal_rank_fusion(dense, sparse, alpha=0.5, top_k=3, k=60)
+    # c is found by both searches, a and d rank first in one of them
+    assert result.ids == ['c', 'a', 'd']
+    assert result.similarities[0] == pytest.approx(0.5 / 63 + 0.5 / 62)
+    assert reciprocal_rank_fusion(dense, VectorStoreQueryResult(), top_k=2).ids == ['a', 'b']
+
+def test_hybrid_retrieval(local_client, embed_model, make_documents):
+    default_embed_model = Settings.embed_model
+    Settings.embed_model = embed_model
+    try:
+        vector_store = create_vector_store(collection_name='test_hybrid')
+        IngestionPipeline(vector_store, show_progress=False).create_index(make_documents())
+        retriever = VectorStoreIndex.from_vector_store(vector_store).as_retriever(
+            vector_store_query_mode='hybrid',
+            similarity_top_k=5,
+            sparse_top_k=5,
+            hybrid_top_k=2,
+        )
+        nodes = retriever.retrieve('вкусный кофе')
+    finally:
+        Settings.embed_model = default_embed_model
+
+    assert len(nodes) == 2
+    assert nodes[0].metadata['name_ru'] == 'Кафе'
@@ -0,0 +1,252 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from django.conf import settings
+from django.test import override_settings
+from qdrant_client.http import models as rest
+from qdrant_client.local.qdrant_local import QdrantLocal
+from llama_index.core.schema import Document
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode
+
+from simple_rag.apps.core import qdrant
+from simple_rag.apps.core.ingestion import IngestionPipeline, batches_by_size, estimate_point_size
+from simple_rag.apps.core.qdrant import (
+    create_vector_store, search_sparse_batch, asearch_sparse, get_file_point_ids, has_current_payload,
+    collection_storage,
+)
+from simple_rag.apps.core.utils import iter_review_documents
+
+def test_create_index(local_client, make_documents):
+    ingestion = IngestionPipeline(
+        create_vector_store(collection_name='test_ingestion'),
+        window_size=2,
+        upload_workers=2,
+        queue_depth=1,
+        show_progress=False,
+    )
+    ingestion.create_index(make_documents())
+
+    assert local_client.count('test_ingestion').count == 5
+    # points are uploaded while the vocabulary is fitted, then their sparse vectors are set
+    assert set(ingestion.stats) == {'normalize', 'vectorize', 'upload', 'sparse', 'update'}
+    assert all(stats.items == 5 for stats in ingestion.stats.values())
+
+    points = search_sparse_batch(['кофе'], collection_name='test_ingestion')
+    assert points[0][0].payload['name_ru'] == 'Кафе'
+    # the local collection is searched with the same client from async code
+    points = asyncio.run(asearch_sparse('кофе', collection_name='test_ingestion'))
+    assert points[0].payload['name_ru'] == 'Кафе'
+
+    # documents inserted against the fitted vocabulary
+    assert ingestion.insert_documents(make_documents()[:2]) == 2
+    assert local_client.count('test_ingestion').count == 7
+
+def test_update_files(local_client, tmp_path, make_documents):
+    file_path = str(tmp_path / 'reviews.txt')
+    lines = [document.text + '\n' for document in make_documents()]
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+
+    ingestion = IngestionPipeline(
+        create_vector_store(collection_name='test_update'),
+        window_size=2,
+        show_progress=False,
+    )
+    ingestion.create_index(iter_review_documents([file_path]))
+    point_ids = get_file_point_ids(file_path, 'test_update')
+    assert len(point_ids) == 5
+
+    # nothing to do for an unchanged file
+    assert ingestion.update_files([file_path]) == (0, 0)
+
+    # one review edited, one removed and one added
+    lines[1] = lines[1].replace('кофе', 'чай')
+    del lines[3]
+    lines.append('name_ru=Музей\trubrics=Культура\ttext=Интересная экспозиция\n')
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    assert ingestion.update_files([file_path]) == (2, 2)
+
+    new_point_ids = get_file_point_ids(file_path, 'test_update')
+    assert local_client.count('test_update').count == 5
+    assert len(point_ids & new_point_ids) == 3
+    points = search_sparse_batch(['обслуживание'], collection_name='test_update')
+    assert points[0][0].payload['name_ru'] == 'Кафе'
+
+def test_upload_batches(local_client, make_documents):
+    ingestion = IngestionPipeline(
+        create_vector_store(collection_name='test_batches'),
+        window_size=10,
+        upload_batch_bytes=1,
+        show_progress=False,
+    )
+    documents = make_documents()
+    ingestion.create_index(documents[:1])
+    with patch.object(local_client, 'upload_points', wraps=local_client.upload_points) as upload_points, \
+        patch.object(local_client, 'upsert', wraps=local_client.upsert) as upsert:
+        assert ingestion.insert_documents(documents[1:]) == 4
+
+    # one point per request, the last one is written again to wait for all of them
+    assert [len(call.kwargs['points']) for call in upload_points.call_args_list] == [1, 1, 1, 1]
+    assert not any(call.kwargs['wait'] for call in upload_points.call_args_list)
+    upsert.assert_called_once()
+    assert upsert.call_args.kwargs['wait']
+    assert local_client.count('test_batches').count == 5
+    # and one of the first document by create_index
+    assert ingestion.stats['upload'].requests == 5
+
+def test_batches_by_size():
+    points = [
+        rest.PointStruct(id=i, vector={'sparse': rest.SparseVector(indices=[1, 2], values=[0.5, 0.5])},
+            payload={'text': 'а' * size})
+        for i, size in enumerate([100, 100, 400, 100])
+    ]
+    sizes = [estimate_point_size(point) for point in points]
+    assert sizes[2] - sizes[0] == 600
+    batches = list(batches_by_size(points, sizes[0] * 2))
+    assert [[point.id for point in batch] for batch, _ in batches] == [[0, 1], [2], [3]]
+    assert [batch_bytes for _, batch_bytes in batches] == [sizes[0] * 2, sizes[2], sizes[3]]
+
+def test_create_index_idf_mode(local_client, make_documents):
+    ingestion = IngestionPipeline(
+        create_vector_store(collection_name='test_idf', sparse_mode='idf'),
+        window_size=2,
+        show_progress=False,
+    )
+    assert not ingestion.fits_vocabulary()
+    ingestion.create_index(make_documents())
+
+    assert local_client.count('test_idf').count == 5
+    assert qdrant.sparse_mode('test_idf') == 'idf'
+    points = search_sparse_batch(['кофе'], collection_name='test_idf')
+    assert points[0][0].payload['name_ru'] == 'Кафе'
+
+    # appended documents are searchable without refitting
+    documents = [Document(text='name_ru=Музей\trubrics=Культура\ttext=Интересная экспозиция')]
+    assert ingestion.insert_documents(documents) == 1
+    points = search_sparse_batch(['экспозиция'], collection_name='test_idf')
+    assert points[0][0].payload['name_ru'] == 'Музей'
+
+def test_create_local_client(tmp_path):
+    gateway = {**settings.QDRANT_GATEWAY, 'PATH': str(tmp_path / 'qdrant')}
+    with override_settings(QDRANT_GATEWAY=gateway):
+        client = qdrant.create_client()
+        assert isinstance(client._client, QdrantLocal)
+        client.close()
+        with pytest.raises(ValueError):
+            qdrant.create_aclient()
+
+def test_create_clients():
+    gateway = {**settings.QDRANT_GATEWAY, 'HOST': 'qdrant', 'PATH': ''}
+    gateway['CLIENTS'] = {
+        'query': {**gateway['CLIENTS']['query'], 'PREFER_GRPC': True, 'TIMEOUT': 2},
+        'ingest': {**gateway['CLIENTS']['ingest'], 'TIMEOUT': 120, 'POOL_SIZE': 4},
+    }
+    with override_settings(QDRANT_GATEWAY=gateway):
+        # no connection is opened before the first call
+        query_client = qdrant.create_client('query')._client
+        ingest_client = qdrant.create_client('ingest')._client
+        aclient = qdrant.create_aclient()._client
+    assert query_client._prefer_grpc and aclient._prefer_grpc
+    assert (query_client._timeout, aclient._timeout) == (2, 2)
+    assert not ingest_client._prefer_grpc
+    assert ingest_client._timeout == 120
+    assert ingest_client._rest_args['limits'].max_connections == 4
+
+def test_locked_local_storage(tmp_path):
+    with override_settings(QDRANT_GATEWAY={**settings.QDRANT_GATEWAY, 'PATH': str(tmp_path)}):
+        client = qdrant.create_client()
+        try:
+            # e.g. a second server worker
+            with pytest.raises(RuntimeError, match='NUMPROCS=1'):
+                qdrant.create_client()
+        finally:
+            client.close()
+
+def test_local_ingest_client(local_client):
+    # a local Qdrant has one client
+    assert qdrant.get_ingest_client() is local_client
+
+def test_compact_payload(local_client, make_documents):
+    ingestion = IngestionPipeline(create_vector_store(collection_name='test_payload'), show_progress=False)
+    ingestion.create_index(make_documents())
+    points, _ = local_client.scroll('test_payload', limit=10)
+    assert all(set(point.payload) == {'file_name', 'name_ru', 'rubrics', 'review_text'} for point in points)
+    assert has_current_payload('test_payload')
+    # points of older collections store the serialized node
+    local_client.set_payload('test_payload', {'_node_content': '{}'}, points=[points[0].id])
+    assert not has_current_payload('test_payload')
+
+    points = search_sparse_batch(['кофе'], limit=1, collection_name='test_payload')[0]
+    assert points[0].payload == {
+        'file_name': 'test.txt', 'review_text': 'Вкусный кофе и быстрое обслуживание',
+        'name_ru': 'Кафе', 'rubrics': ['Общепит'],
+    }
+
+def test_query_payload_fields(local_client, make_documents):
+    ingestion = IngestionPipeline(create_vector_store(collection_name='test_query'), show_progress=False)
+    documents = make_documents()
+    for document in documents:
+        document.metadata['file_path'] = '/data/test.txt'
+    ingestion.create_index(documents)
+
+    vector_store = ingestion.vector_store
+    size = qdrant.dense_vector_size('test_query')
+    for mode in (VectorStoreQueryMode.DEFAULT, VectorStoreQueryMode.SPARSE, VectorStoreQueryMode.HYBRID):
+        query = VectorStoreQuery(
+            query_str='кофе', query_embedding=[1.0] * size, similarity_top_k=2, sparse_top_k=2, mode=mode,
+        )
+        with patch.object(local_client, 'query_batch_points', wraps=local_client.query_batch_points) as query_batch_points, \
+            patch.object(local_client, 'search_batch') as search_batch:
+            result = vector_store.query(query)
+        if mode != VectorStoreQueryMode.DEFAULT:
+            assert 'Кафе' in [node.metadata['name_ru'] for node in result.nodes]
+        # the engine fetches the fields of PAYLOAD_FIELDS, not file_path
+        assert all(set(node.metadata) == set(qdrant.PAYLOAD_FIELDS) for node in result.nodes)
+        requests = query_batch_points.call_args.kwargs['requests']
+        assert len(requests) == (2 if mode == VectorStoreQueryMode.HYBRID else 1)
+        assert all(request.with_payload == qdrant.PAYLOAD_FIELDS for request in requests)
+        search_batch.assert_not_called()
+
+def test_collection_storage(local_client, make_documents):
+    storage = {
+        'DENSE_ON_DISK': True,
+        'SPARSE_INDEX_ON_DISK': True,
+        'HNSW_ON_DISK': False,
+        'PAYLOAD_ON_DISK': False,
+        'MEMMAP_THRESHOLD': 20000,
+        'INDEXING_THRESHOLD': None,
+        'SEGMENT_NUMBER': 2,
+    }
+    vector_store = create_vector_store(collection_name='test_storage', storage=storage)
+    with patch.object(local_client, 'create_collection', wraps=local_client.create_collection) as create_collection:
+        IngestionPipeline(vector_store, show_progress=False).create_index(make_documents())
+    kwargs = create_collection.call_args.kwargs
+    assert kwargs['vectors_config']['text-dense'].on_disk
+    assert kwargs['sparse_vectors_config']['text-sparse-new'].index.on_disk
+    assert kwargs['on_disk_payload'] is False
+    assert kwargs['optimizers_config'] == rest.OptimizersConfigDiff(memmap_threshold=20000, default_segment_number=2)
+
+    effective = collection_storage('test_storage')
+    assert set(effective) == set(storage)
+    assert effective['DENSE_ON_DISK'] and effective['SPARSE_INDEX_ON_DISK']
+
+def test_create_collection_twice(local_client):
+    vector_store = create_vector_store(collection_name='test_twice', storage={'DENSE_ON_DISK': True})
+    vector_store._create_collection('test_twice', 3)
+    # a collection created meanwhile, e.g. by another process, is kept
+    create_vector_store(collection_name='test_twice', storage={'DENSE_ON_DISK': False})._create_collection(
+        'test_twice', 5,
+    )
+    vectors = local_client.get_collection('test_twice').config.params.vectors['text-dense']
+    assert vectors.size == 3 and vectors.on_disk
+
+    # other errors are raised
+    with patch.object(local_client, 'create_collection', side_effect=ValueError('bad config')):
+        with pytest.raises(ValueError, match='bad config'):
+            create_vector_store(collection_name='test_other')._create_collection('test_other', 3)
@@ -0,0 +1,68 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+from llama_index.core.schema import Document
+
+from simple_rag.apps.core import inverted_index
+from simple_rag.apps.core.ingestion import IngestionPipeline
+from simple_rag.apps.core.inverted_index import InvertedIndex, build_inverted_index
+from simple_rag.apps.core.qdrant import create_vector_store, search_sparse_batch
+
+QUERIES = ['кофе', 'красивый парк', 'магазин продукты кофе', 'неизвестное слово']
+
+@pytest.mark.parametrize('sparse_mode', ['tfidf', 'idf'])
+def test_search_batch(local_client, tmp_path, sparse_mode, make_documents):
+    collection_name = f'test_inverted_index_{sparse_mode}'
+    ingestion = IngestionPipeline(
+        create_vector_store(collection_name=collection_name, sparse_mode=sparse_mode),
+        show_progress=False,
+    )
+    ingestion.create_index(make_documents())
+    assert build_inverted_index(collection_name, path=str(tmp_path)) == 5
+
+    index = InvertedIndex(str(tmp_path))
+    expected = search_sparse_batch(QUERIES, limit=3, collection_name=collection_name)
+    results = index.search_batch(QUERIES, limit=3)
+    for points, expected_points in zip(results, expected):
+        assert [point.id for point in points] == [point.id for point in expected_points]
+        assert [point.score for point in points] == pytest.approx([point.score for point in expected_points])
+        assert [point.payload for point in points] == [
+            {field: point.payload[field] for field in inverted_index.PAYLOAD_FIELDS} for point in expected_points
+        ]
+    assert results[-1] == []
+
+@pytest.mark.parametrize('filters', [
+    {'rubrics': 'Продукты'},
+    {'rubrics': 'Общепит', 'name_ru': 'Кафе'},
+    {'rubrics': 'Общепит', 'name_ru': 'Парк'},
+    {'rubrics': 'Неизвестная рубрика'},
+])
+def test_filtered_search(local_client, tmp_path, filters, make_documents):
+    ingestion = IngestionPipeline(create_vector_store(collection_name='test_filters'), show_progress=False)
+    ingestion.create_index(make_documents())
+    build_inverted_index('test_filters', path=str(tmp_path))
+
+    expected = search_sparse_batch(QUERIES, limit=3, collection_name='test_filters', filters=filters)
+    results = InvertedIndex(str(tmp_path)).search_batch(QUERIES, limit=3, filters=filters)
+    assert [[point.id for point in points] for points in results] == [
+        [point.id for point in points] for points in expected
+    ]
+    assert all(
+        filters.get('rubrics') in point.payload['rubrics'] for points in results for point in points
+    )
+
+def test_reload(local_client, tmp_path, make_documents):
+    ingestion = IngestionPipeline(create_vector_store(collection_name='test_reload'), show_progress=False)
+    ingestion.create_index(make_documents())
+    build_inverted_index('test_reload', path=str(tmp_path))
+    inverted_index.get_inverted_index.set(InvertedIndex(str(tmp_path)))
+
+    documents = [Document(text='name_ru=Кофейня\trubrics=Общепит\ttext=Кофе с собой')]
+    ingestion.insert_documents(documents)
+    build_inverted_index('test_reload', path=str(tmp_path))
+    index = inverted_index.current_inverted_index()
+    assert index.n_documents == 6
+    assert len(list(tmp_path.iterdir())) == 13
+    inverted_index.get_inverted_index.reset()
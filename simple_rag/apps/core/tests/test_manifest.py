@@ -0,0 +1,70 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import hashlib
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from simple_rag.apps.core.manifest import FileManifest, hash_file
+
+class TestManifest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_paths = [os.path.join(self.temp_dir.name, name) for name in ['a.txt', 'b.txt']]
+        for file_path in self.file_paths:
+            self.write(file_path, 'name_ru=Магазин\n')
+        self.manifest = FileManifest(os.path.join(self.temp_dir.name, 'manifest.sqlite3'), hash_workers=2)
+
+    def tearDown(self):
+        self.manifest.close()
+        self.temp_dir.cleanup()
+
+    def write(self, file_path, text, mode='w'):
+        with open(file_path, mode, encoding='utf-8') as f:
+            f.write(text)
+
+    def test_hash_file(self):
+        with open(self.file_paths[0], 'rb') as f:
+            expected = hashlib.sha256(f.read()).hexdigest()
+        self.assertEqual(hash_file(self.file_paths[0], buffer_size=4), expected)
+
+    def test_scan(self):
+        infos = self.manifest.scan(self.file_paths)
+        self.assertEqual(list(infos), self.file_paths)
+        # nothing is recorded before save
+        self.assertEqual(self.manifest.scan(self.file_paths).keys(), infos.keys())
+
+        self.manifest.save(infos)
+        self.assertEqual(self.manifest.get(), infos)
+        self.assertEqual(self.manifest.scan(self.file_paths), {})
+
+        self.write(self.file_paths[1], 'rubrics=Продукты\n', mode='a')
+        self.assertEqual(list(self.manifest.scan(self.file_paths)), self.file_paths[1:])
+
+    @patch('simple_rag.apps.core.manifest.hash_file', side_effect=hash_file)
+    def test_scan_unchanged_files_are_not_hashed(self, mock_hash_file):
+        self.manifest.save(self.manifest.scan(self.file_paths))
+        mock_hash_file.reset_mock()
+
+        self.assertEqual(self.manifest.scan(self.file_paths), {})
+        mock_hash_file.assert_not_called()
+
+        # a new modification time with the same content only updates the manifest
+        stat = os.stat(self.file_paths[0])
+        os.utime(self.file_paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(self.manifest.scan(self.file_paths), {})
+        mock_hash_file.assert_called_once_with(self.file_paths[0])
+        self.assertEqual(self.manifest.get()[self.file_paths[0]].mtime_ns, stat.st_mtime_ns + 10**9)
+
+    def test_deleted(self):
+        self.manifest.save(self.manifest.scan(self.file_paths))
+        self.assertEqual(self.manifest.deleted(self.file_paths[:1]), self.file_paths[1:])
+
+        self.manifest.remove(self.file_paths[1:])
+        self.assertEqual(list(self.manifest.get()), self.file_paths[:1])
+
+        self.manifest.clear()
+        self.assertEqual(self.manifest.get(), {})
@@ -2,8 +2,16 @@
 #
 # SPDX-License-Identifier: MIT
 
-from simple_rag.apps.core.pipeline import (process_text, process_review,
-    sparse_doc_vectors, sparse_query_vectors)
+import pytest
+import spacy
+from spacy.language import Language
+
+from simple_rag.apps.core import pipeline
+from simple_rag.apps.core.pipeline import (process_text, process_texts, process_review, ProcessTextTransformer,
+    sparse_doc_vectors, sparse_query_vectors, tf_doc_vectors, tf_query_vectors, fit_vectorizer, load_vectorizer, csr_to_sparse_vectors, load_nlp)
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import TfidfVectorizer
+from llama_index.core.schema import TextNode
 
 def test_process_text():
     text = 'Пример текста для обработки'
@@ -12,6 +20,75 @@ def test_process_text():
     assert all(isinstance(token, str) for token in tokens)
     assert tokens == ['пример', 'текст', 'обработка']
 
+def test_load_nlp_unknown_profile():
+    with pytest.raises(ValueError):
+        load_nlp('unknown-profile')
+
+def test_process_text_lemma_cache():
+    text = 'Пример текста для обработки'
+    lemma_cache = pipeline.get_lemma_cache()
+    lemma_cache.clear()
+    tokens = process_text(text)
+    assert lemma_cache.misses > 0
+
+    # all tokens are cached now, the lemmatizer is skipped
+    hits = lemma_cache.hits
+    assert process_text(text) == tokens
+    assert lemma_cache.hits == hits + len(pipeline.get_nlp().make_doc(text))
+
+# 'мыла' is a verb after 'мама' ('мыть') and a noun otherwise ('мыло')
+@Language.component('ambiguous_tagger')
+def ambiguous_tagger(doc):
+    for token in doc:
+        token.pos_ = 'VERB' if token.i and doc[token.i - 1].lower_ == 'мама' else 'NOUN'
+    return doc
+
+@Language.component('ambiguous_lemmatizer')
+def ambiguous_lemmatizer(doc):
+    lemmas = {('мыла', 'VERB'): 'мыть', ('мыла', 'NOUN'): 'мыло'}
+    for token in doc:
+        token.lemma_ = lemmas.get((token.lower_, token.pos_), token.lower_)
+    return doc
+
+@pytest.fixture
+def ambiguous_nlp():
+    nlp = spacy.blank('ru')
+    nlp.add_pipe('ambiguous_tagger')
+    nlp.add_pipe('ambiguous_lemmatizer', name='lemmatizer')
+    pipeline.get_nlp.set(nlp)
+    pipeline.get_lemma_cache().clear()
+    yield nlp
+    pipeline.get_nlp.reset()
+    pipeline.get_lemma_cache().clear()
+
+def test_lemma_cache_ambiguous_form(ambiguous_nlp):
+    texts = ['мама мыла раму', 'кусок мыла']
+    expected = [pipeline.normalize_doc(ambiguous_nlp(text)) for text in texts]
+    assert 'мыть' in expected[0] and 'мыло' in expected[1]
+
+    assert [process_text(text) for text in texts] == expected
+    # the verb is cached, the noun is lemmatized again
+    assert [process_text(text) for text in reversed(texts)] == expected[::-1]
+    assert list(process_texts(iter(texts), batch_size=1)) == expected
+
+def test_process_texts():
+    texts = ['Пример текста для обработки', '', 'Еще один пример текста']
+    tokens = list(process_texts(iter(texts), batch_size=2))
+    assert tokens == [process_text(text) for text in texts]
+
+def test_process_text_transformer():
+    nodes = [
+        TextNode(text='name_ru=Пример rubrics=Тест text=Это пример текста для обработки'),
+        TextNode(text=' '),
+        TextNode(text='name_ru=Магазин rubrics=Продукты text=Хороший магазин'),
+    ]
+    processed_nodes = ProcessTextTransformer(batch_size=2)(nodes)
+    assert len(processed_nodes) == 2
+    assert processed_nodes[0].get_content() == ' '.join(
+        process_text('Пример Тест Это пример текста для обработки'))
+    assert processed_nodes[1].metadata['name_ru'] == 'Магазин'
+    assert processed_nodes[1].metadata['review_text'] == 'Хороший магазин'
+
 def test_process_review():
     text = 'name_ru=Пример rubrics=Тест text=Это пример текста для обработки'
     review = process_review(text)
@@ -24,8 +101,53 @@ def test_process_review():
     review = process_review(empty_text)
     assert review is None
 
+def test_fit_vectorizer():
+    corpus = ['пример текст обработка', 'еще один пример текст', 'отзыв магазин']
+    version = fit_vectorizer(corpus)
+    vectorizer, vocabulary_version = pipeline.get_vectorizer()
+    assert version == vocabulary_version
+    assert set(vectorizer.vocabulary_) == {'пример', 'текст', 'обработка', 'еще', 'один', 'отзыв', 'магазин'}
+
+    # the persisted vocabulary is the one used by the process
+    cached_vectorizer, cached_version = load_vectorizer()
+    assert cached_version == version
+    assert cached_vectorizer.vocabulary_ == vectorizer.vocabulary_
+
+    # documents and queries share the same term indices
+    doc_indices, doc_values = sparse_doc_vectors(['отзыв магазин'])
+    query_indices, query_values = sparse_query_vectors(['отзыв магазин'])
+    assert list(doc_indices[0]) == list(query_indices[0])
+    assert list(doc_values[0]) == list(query_values[0])
+
+    assert fit_vectorizer(corpus) == version + 1
+
+def test_fit_vectorizer_stream():
+    corpus = ['пример текст обработка', 'еще один пример текст', 'отзыв магазин магазин', '']
+    fit_vectorizer(text for text in corpus)
+    vectorizer, _ = pipeline.get_vectorizer()
+
+    # the streaming fit matches a regular fit over the whole corpus
+    expected = TfidfVectorizer().fit(corpus)
+    assert vectorizer.vocabulary_ == expected.vocabulary_
+    assert vectorizer.idf_ == pytest.approx(expected.idf_)
+    assert (vectorizer.transform(corpus) != expected.transform(corpus)).nnz == 0
+
+    with pytest.raises(ValueError):
+        fit_vectorizer(iter(['']))
+
+def test_csr_to_sparse_vectors():
+    matrix = csr_matrix([
+        [0.0, 0.5, 0.0, 0.25],
+        [0.0, 0.0, 0.0, 0.0],
+        [1.0, 0.0, 0.0, 0.0],
+    ])
+    indices, values = csr_to_sparse_vectors(matrix)
+    assert indices == [[1, 3], [], [0]]
+    assert values == [[0.5, 0.25], [], [1.0]]
+
 def test_sparse_doc_vectors():
     texts = ['Пример текста для обработки', 'Еще один пример текста']
+    fit_vectorizer(texts)
     indices, values = sparse_doc_vectors(texts)
     assert isinstance(indices, list)
     assert isinstance(values, list)
@@ -34,8 +156,18 @@ def test_sparse_doc_vectors():
 
 def test_sparse_query_vectors():
     texts = ['Пример текста для обработки', 'Еще один пример текста']
+    fit_vectorizer(texts)
     indices, values = sparse_query_vectors(texts)
     assert isinstance(indices, list)
     assert isinstance(values, list)
     assert all(isinstance(index_list, list) for index_list in indices)
     assert all(isinstance(value_list, list) for value_list in values)
+
+def test_tf_vectors():
+    # term indices don't depend on a fitted vocabulary
+    doc_indices, doc_values = tf_doc_vectors(['пример текст пример', 'текст'])
+    query_indices, query_values = tf_query_vectors(['текст пример пример'])
+    assert sorted(doc_indices[0]) == sorted(query_indices[0])
+    assert doc_indices[1][0] in doc_indices[0]
+    assert sorted(query_values[0]) == [1.0, 2.0]
+    assert abs(sum(value ** 2 for value in doc_values[0]) - 1) < 1e-9
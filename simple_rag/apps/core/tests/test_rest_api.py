@@ -3,11 +3,16 @@
 # SPDX-License-Identifier: MIT
 
 import json
-from unittest.mock import patch, MagicMock
+import asyncio
+from unittest.mock import patch, MagicMock, AsyncMock
 
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 from rest_framework.test import APITestCase
 from rest_framework import status
 
+from simple_rag.apps.core import views, warmup
 from simple_rag.apps.core.qdrant import BaseQueryEngine
 
 class RAGBaseAPITestCase(APITestCase):
@@ -38,6 +43,121 @@ class RAGProcessAPITestCase(RAGBaseAPITestCase):
         assert response.status_code == status.HTTP_400_BAD_REQUEST
         assert 'error' in response.data
 
+class RAGProcessBatchAPITestCase(RAGBaseAPITestCase):
+    def _run_api_rag_process_batch(self, data, content_type):
+        response = self.client.post(
+            '/api/rag/process_batch',
+            data=data,
+            content_type=content_type
+        )
+        return response
+
+    def _read_lines(self, response):
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        content = async_to_sync(read)().decode()
+        return [json.loads(line) for line in content.splitlines()]
+
+    def _asgi_post(self, path, chunks, headers, on_send=None):
+        """
+        Send a POST request with a body in chunks through the ASGI handler,
+        and return the messages it sends, passed to on_send as they are.
+        """
+        async def run():
+            received = [{'type': 'http.request', 'body': chunk, 'more_body': True} for chunk in chunks]
+            received.append({'type': 'http.request', 'body': b'', 'more_body': False})
+            messages = []
+
+            async def receive():
+                if received:
+                    return received.pop(0)
+                # the client stays connected until the response is sent
+                await asyncio.Event().wait()
+
+            async def send(message):
+                messages.append(message)
+                if on_send is not None:
+                    on_send(message)
+
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'POST', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                'query_string': b'', 'root_path': '', 'headers': headers,
+                'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+            }
+            await ASGIHandler()(scope, receive, send)
+            return messages
+        return async_to_sync(run)()
+
+    def test_process_batch_json(self):
+        data = json.dumps([self.valid_text_request['text'], self.valid_text_request])
+        response = self._run_api_rag_process_batch(data, 'application/json')
+        assert response.status_code == status.HTTP_200_OK
+        lines = self._read_lines(response)
+        assert len(lines) == 2
+        assert lines[0] == lines[1]
+        assert 'tokens' in lines[0]
+
+    def test_process_batch_ndjson(self):
+        data = '\n'.join(json.dumps(item) for item in [
+            self.valid_text_request,
+            self.invalid_text_request,
+            self.valid_text_request['text'],
+        ])
+        response = self._run_api_rag_process_batch(data, 'application/x-ndjson')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = self._read_lines(response)
+        assert len(lines) == 3
+        assert 'tokens' in lines[0]
+        assert 'error' in lines[1]
+        assert lines[2] == lines[0]
+
+    def test_process_batch_ndjson_malformed(self):
+        data = json.dumps(self.valid_text_request) + '\n{malformed'
+        response = self._run_api_rag_process_batch(data, 'application/x-ndjson')
+        lines = self._read_lines(response)
+        assert 'tokens' in lines[0]
+        assert 'error' in lines[-1]
+
+    def test_process_batch_streams(self):
+        data = json.dumps([self.valid_text_request['text']] * 3).encode()
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+        # batches processed when each chunk of the response is sent
+        processed = []
+        with patch.dict(settings.RAG_SETTINGS['NLP'], {'BATCH_SIZE': 1}), \
+            patch.object(views, 'process_batch_lines', wraps=views.process_batch_lines) as process_batch_lines:
+            messages = self._asgi_post(
+                '/api/rag/process_batch', [data], headers,
+                on_send=lambda message: message.get('body') and processed.append(process_batch_lines.call_count),
+            )
+        assert messages[0]['status'] == status.HTTP_200_OK
+        assert (b'X-Accel-Buffering', b'no') in messages[0]['headers']
+        # each batch is sent before the next one is processed
+        assert processed == [1, 2, 3]
+        lines = b''.join(message.get('body', b'') for message in messages[1:]).decode().splitlines()
+        assert len(lines) == 3
+        assert 'tokens' in json.loads(lines[0])
+
+    def test_process_batch_chunked_ndjson(self):
+        data = '\n'.join(json.dumps(item, ensure_ascii=False) for item in [
+            self.valid_text_request,
+            self.valid_text_request['text'],
+        ]).encode()
+        # a chunked body has no Content-Length, chunks split lines and characters
+        chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+        messages = self._asgi_post('/api/rag/process_batch', chunks, [(b'content-type', b'application/x-ndjson')])
+        assert messages[0]['status'] == status.HTTP_200_OK
+        lines = b''.join(message.get('body', b'') for message in messages[1:]).decode().splitlines()
+        assert len(lines) == 2
+        assert lines[0] == lines[1]
+        assert 'tokens' in json.loads(lines[0])
+
+    def test_process_batch_invalid_request(self):
+        response = self._run_api_rag_process_batch(json.dumps(self.valid_text_request), 'application/json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'error' in response.data
+
 class RAGQueryAPITestCase(RAGBaseAPITestCase):
     def _run_api_rag_query(self, data):
         response = self.client.post(
@@ -47,15 +167,219 @@ class RAGQueryAPITestCase(RAGBaseAPITestCase):
         )
         return response
 
-    @patch('simple_rag.apps.core.views.query_engine')
-    def test_query_valid_request(self, mock_query_engine):
+    @patch('simple_rag.apps.core.views.get_query_engine')
+    def test_query_valid_request(self, mock_get_query_engine):
         mock_query_engine = MagicMock(spec=BaseQueryEngine)
-        mock_query_engine.query.return_value = None
+        mock_query_engine.query.return_value = MagicMock(source_nodes=[])
+        mock_get_query_engine.return_value = mock_query_engine
         response = self._run_api_rag_query(self.valid_text_request)
         assert response.status_code == status.HTTP_200_OK
         assert isinstance(response.data, list)
 
+    @patch('simple_rag.apps.core.views.get_query_engine')
+    def test_query_cached(self, mock_get_query_engine):
+        mock_query_engine = mock_get_query_engine.return_value
+        mock_query_engine.query.return_value = MagicMock(source_nodes=[])
+        data = {
+            'text': 'Повторный запрос для проверки кэша'
+        }
+        response = self._run_api_rag_query(data)
+        assert response.status_code == status.HTTP_200_OK
+        # the same query is served from the cache
+        response = self._run_api_rag_query(data)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == []
+        mock_query_engine.query.assert_called_once()
+
+    @patch('simple_rag.apps.core.views.create_query_engine')
+    @patch('simple_rag.apps.core.views.get_query_engine')
+    def test_query_filtered(self, mock_get_query_engine, mock_create_query_engine):
+        mock_create_query_engine.return_value.query.return_value = MagicMock(source_nodes=[])
+        data = {
+            'text': 'Запрос с фильтрами',
+            'rubric': 'Магазин продуктов',
+            'name_ru': 'Пятёрочка',
+        }
+        response = self._run_api_rag_query(data)
+        assert response.status_code == status.HTTP_200_OK
+        # filtered queries get an engine of their own
+        mock_create_query_engine.assert_called_once_with(
+            filters={'rubrics': 'Магазин продуктов', 'name_ru': 'Пятёрочка'},
+        )
+        mock_get_query_engine.assert_not_called()
+
     def test_query_invalid_request(self):
         response = self._run_api_rag_query(self.invalid_text_request)
         assert response.status_code == status.HTTP_400_BAD_REQUEST
         assert 'error' in response.data
+
+class RAGQueryAsyncAPITestCase(RAGBaseAPITestCase):
+    def _run_api_rag_query_async(self, data):
+        response = self.client.post(
+            '/api/rag/query_async',
+            data=json.dumps(data),
+            content_type='application/json'
+        )
+        return response
+
+    @patch('simple_rag.apps.core.views.asearch_sparse', new_callable=AsyncMock)
+    def test_query_async_valid_request(self, mock_asearch_sparse):
+        mock_asearch_sparse.return_value = [MagicMock(score=0.5, payload={
+            'file_name': 'dataset1.txt',
+            'review_text': 'Хороший магазин',
+            'name_ru': 'Магазин',
+            'rubrics': ['Продукты', 'Магазин продуктов'],
+        })]
+        response = self._run_api_rag_query_async({'text': 'Асинхронный запрос'})
+        assert response.status_code == status.HTTP_200_OK
+        data = json.loads(response.content)
+        assert data[0]['text'] == 'Хороший магазин'
+        assert data[0]['additional_metadata']['rubrics'] == 'Продукты;Магазин продуктов'
+        mock_asearch_sparse.assert_awaited_once()
+
+        response = self._run_api_rag_query_async({'text': 'Асинхронный запрос', 'rubric': 'Продукты'})
+        assert response.status_code == status.HTTP_200_OK
+        assert mock_asearch_sparse.await_args.kwargs['filters'] == {'rubrics': 'Продукты'}
+
+    @patch('simple_rag.apps.core.views.asearch_sparse', new_callable=AsyncMock)
+    @patch('simple_rag.apps.core.views.get_query_engine')
+    def test_query_async_hybrid(self, mock_get_query_engine, mock_asearch_sparse):
+        mock_get_query_engine.return_value.query.return_value = MagicMock(source_nodes=[])
+        with patch.dict(settings.RAG_SETTINGS['QUERY'], {'MODE': 'hybrid'}):
+            response = self._run_api_rag_query_async({'text': 'Асинхронный гибридный запрос'})
+        assert response.status_code == status.HTTP_200_OK
+        assert json.loads(response.content) == []
+        # hybrid queries go through the query engine, not the sparse search
+        mock_get_query_engine.return_value.query.assert_called_once()
+        mock_asearch_sparse.assert_not_awaited()
+
+    def test_query_async_invalid_request(self):
+        response = self._run_api_rag_query_async(self.invalid_text_request)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'error' in json.loads(response.content)
+
+    def test_query_async_method_not_allowed(self):
+        response = self.client.get('/api/rag/query_async')
+        assert response.status_code == status.HTTP_405_METHOD_NOT_ALLOWED
+
+class RAGQueryBatchAPITestCase(RAGBaseAPITestCase):
+    def _run_api_rag_query_batch(self, data):
+        response = self.client.post(
+            '/api/rag/query_batch',
+            data=json.dumps(data),
+            content_type='application/json'
+        )
+        return response
+
+    @patch('simple_rag.apps.core.views.search_sparse_batch')
+    def test_query_batch_valid_request(self, mock_search_sparse_batch):
+        point = MagicMock(score=0.5, payload={
+            'file_name': 'dataset1.txt',
+            'review_text': 'Хороший магазин',
+            'name_ru': 'Магазин',
+            'rubrics': ['Продукты', 'Магазин продуктов'],
+        })
+        mock_search_sparse_batch.side_effect = lambda queries, **kwargs: [[point] for _ in queries]
+        data = {
+            'texts': ['Пакетный запрос один', 'Пакетный запрос два', 'Пакетный запрос один'],
+            'name_ru': 'Магазин',
+        }
+        response = self._run_api_rag_query_batch(data)
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 3
+        assert response.data['results'][0][0]['text'] == 'Хороший магазин'
+        assert response.data['results'][0][0]['score'] == 0.5
+        # identical queries are searched once
+        assert len(mock_search_sparse_batch.call_args[0][0]) <= 2
+        assert mock_search_sparse_batch.call_args.kwargs['filters'] == {'name_ru': 'Магазин'}
+
+    @patch('simple_rag.apps.core.views.search_sparse_batch')
+    @patch('simple_rag.apps.core.views.get_query_engine')
+    def test_query_batch_hybrid(self, mock_get_query_engine, mock_search_sparse_batch):
+        node = MagicMock(metadata={
+            'file_name': 'dataset1.txt',
+            'review_text': 'Хороший магазин',
+            'name_ru': 'Магазин',
+            'rubrics': ['Продукты'],
+        })
+        node.get_score.return_value = 0.5
+        mock_get_query_engine.return_value.query.return_value = MagicMock(source_nodes=[node])
+        data = {'texts': ['Гибридный запрос один', 'Гибридный запрос два', 'Гибридный запрос один']}
+        with patch.dict(settings.RAG_SETTINGS['QUERY'], {'MODE': 'hybrid'}):
+            response = self._run_api_rag_query_batch(data)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][2][0]['text'] == 'Хороший магазин'
+        # hybrid queries go through the query engine, not the sparse batch search
+        assert mock_get_query_engine.return_value.query.call_count == 2
+        mock_search_sparse_batch.assert_not_called()
+
+    def test_query_batch_invalid_request(self):
+        response = self._run_api_rag_query_batch({'texts': []})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'error' in response.data
+
+        response = self._run_api_rag_query_batch({'texts': ['Пример', '']})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'error' in response.data
+
+class RAGStatsAPITestCase(RAGBaseAPITestCase):
+    def test_stats(self):
+        response = self.client.get('/api/rag/stats')
+        assert response.status_code == status.HTTP_200_OK
+        assert 'caches' in response.data
+
+class HealthReadyAPITestCase(APITestCase):
+    def setUp(self):
+        warmup.warmup_done.clear()
+
+    def test_ready(self):
+        # the probe doesn't wait for the warm-up, which runs in the background
+        self.client.get('/api/health/ready')
+        warmup.start_warm_up().join(timeout=60)
+        response = self.client.get('/api/health/ready')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['ready']
+        assert 'nlp' in response.data['startup_times']
+        assert 'warmup_normalization' in response.data['startup_times']
+
+    @patch('simple_rag.apps.core.views.start_warm_up')
+    @patch('simple_rag.apps.core.warmup.get_query_engine')
+    def test_not_ready(self, mock_get_query_engine, mock_start_warm_up):
+        mock_get_query_engine.side_effect = ConnectionError('Qdrant is unreachable')
+        assert not warmup.warm_up()
+        mock_get_query_engine.reset_mock()
+
+        # the probe reports the state and leaves retries to the background thread
+        response = self.client.get('/api/health/ready')
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert not response.data['ready']
+        assert 'Qdrant' in response.data['error']
+        mock_get_query_engine.assert_not_called()
+        mock_start_warm_up.assert_called_once()
+
+    @patch('simple_rag.apps.core.warmup.sleep')
+    @patch('simple_rag.apps.core.warmup.warm_up')
+    def test_retry_warm_up(self, mock_warm_up, mock_sleep):
+        mock_warm_up.side_effect = [False, False, False, False, True]
+        warmup.retry_warm_up(interval=1, max_interval=5)
+        assert mock_warm_up.call_count == 5
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [1, 2, 4, 5]
+
+class MetricsAPITestCase(RAGBaseAPITestCase):
+    @patch('simple_rag.apps.core.views.get_query_engine')
+    def test_metrics(self, mock_get_query_engine):
+        mock_get_query_engine.return_value.query.return_value = MagicMock(source_nodes=[])
+        self.client.post('/api/rag/query', data=json.dumps({'text': 'Запрос для метрик'}),
+            content_type='application/json')
+        self.client.post('/api/rag/query', data=json.dumps(self.invalid_text_request),
+            content_type='application/json')
+
+        response = self.client.get('/metrics')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'].startswith('text/plain')
+        content = response.content.decode()
+        assert 'rag_requests_total{method="POST",status="200",view="rag-query"}' in content
+        assert 'rag_request_errors_total{view="rag-query"}' in content
+        for stage in ('normalize', 'engine', 'serialize'):
+            assert f'rag_query_stage_seconds_count{{stage="{stage}"}}' in content
+        assert 'rag_cache_lookups_total{cache="query_tokens",result="miss"}' in content
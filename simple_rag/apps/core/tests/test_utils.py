@@ -8,7 +8,8 @@ import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from simple_rag.apps.core.utils import (list_documents, get_file_info, is_file_changed, build_documents_info_index,
-    build_and_cache_documents_info, filter_documents, DocumentInfo)
+    build_and_cache_documents_info, filter_documents, DocumentInfo, LazyResource, startup_times, list_dataset_files,
+    iter_reviews, iter_review_documents, review_id)
 from llama_index.core.schema import Document
 
 class TestUtils(TestCase):
@@ -148,4 +149,55 @@ class TestUtils(TestCase):
         self.assertEqual(len(new_documents), 1)
         self.assertEqual(new_documents[0].get_doc_id(), '1')
         mock_build_and_cache_documents_info.assert_called_once_with(cache_path, documents)
-        os.remove(cache_path)
\ No newline at end of file
+        os.remove(cache_path)
+
+    def test_lazy_resource(self):
+        loader = MagicMock(return_value='resource')
+        resource = LazyResource('test_resource', loader)
+        loader.assert_not_called()
+
+        self.assertEqual(resource(), 'resource')
+        self.assertEqual(resource(), 'resource')
+        loader.assert_called_once()
+        self.assertIn('test_resource', startup_times)
+
+        resource.set('replaced')
+        self.assertEqual(resource(), 'replaced')
+        resource.reset()
+        self.assertEqual(resource(), 'resource')
+        self.assertEqual(loader.call_count, 2)
+
+    def test_iter_reviews(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            file_path = os.path.join(base_path, 'reviews.tskv')
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write('address=Москва\tname_ru=Магазин\trating=5.\trubrics=Продукты\ttext=Хороший магазин\n')
+                f.write('\n')
+                f.write('rubrics=Кафе\ttext=Вкусно=дешево')
+
+            reviews = list(iter_reviews(file_path))
+            self.assertEqual(reviews, [
+                {'name_ru': 'Магазин', 'rubrics': 'Продукты', 'text': 'Хороший магазин'},
+                {'name_ru': '', 'rubrics': 'Кафе', 'text': 'Вкусно=дешево'},
+            ])
+
+            documents = list(iter_review_documents([file_path]))
+            self.assertEqual(len(documents), 2)
+            self.assertEqual(documents[0].text, 'name_ru=Магазин\trubrics=Продукты\ttext=Хороший магазин')
+            self.assertEqual(documents[1].metadata['file_path'], file_path)
+            self.assertEqual(documents[1].metadata['file_name'], 'reviews.tskv')
+            self.assertIn('file_name', documents[1].excluded_embed_metadata_keys)
+            # ids depend only on the file name and content of a review
+            self.assertEqual(documents[0].id_, review_id('reviews.tskv', documents[0].text))
+            self.assertEqual([document.id_ for document in iter_review_documents([file_path])],
+                [document.id_ for document in documents])
+            self.assertNotEqual(documents[0].id_, review_id('other.tskv', documents[0].text))
+
+    def test_list_dataset_files(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            for name in ['b.txt', 'a.txt', '.hidden.txt', 'c.csv']:
+                open(os.path.join(base_path, name), 'w').close()
+            self.assertEqual(
+                list_dataset_files(base_path, exts=['.txt']),
+                [os.path.join(base_path, 'a.txt'), os.path.join(base_path, 'b.txt')],
+            )
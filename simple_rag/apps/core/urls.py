@@ -13,10 +13,11 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 
-from simple_rag.apps.core.views import RAGView
+from simple_rag.apps.core.views import RAGView, HealthView, query_async, metrics
 
 router = routers.DefaultRouter(trailing_slash=False)
 router.register("rag", RAGView, basename="rag")
+router.register("health", HealthView, basename="health")
 
 urlpatterns = [
     # Entry point for a client
@@ -32,5 +33,8 @@ urlpatterns = [
     ),
     path("api/docs/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"),
     # entry point for API
+    path("api/rag/query_async", query_async, name="rag-query-async"),
     path("api/", include(router.urls)),
-]
\ No newline at end of file
+    # Prometheus metrics, aggregated over all workers
+    path("metrics", metrics, name="metrics"),
+]
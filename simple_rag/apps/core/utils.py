@@ -4,15 +4,63 @@
 
 import os
 from os import path as osp
+import uuid
 import hashlib
-from typing import List, Dict
+import threading
+from time import perf_counter
+from typing import Callable, Generic, Iterable, Iterator, List, Dict, TypeVar
 
 import joblib
 from pydantic import BaseModel
 from django.conf import settings
 from llama_index.core import SimpleDirectoryReader
+from llama_index.core.readers.file.base import default_file_metadata_func
 from llama_index.core.schema import Document
 
+T = TypeVar('T')
+
+# seconds spent loading each lazy resource of this process
+startup_times: Dict[str, float] = {}
+
+class LazyResource(Generic[T]):
+    """
+    A resource loaded on first use, e.g. a model or a client.
+    Loading happens once per process, under a lock, and its duration
+    is recorded in startup_times under the resource name.
+    """
+    def __init__(self, name: str, loader: Callable[[], T]):
+        self.name = name
+        self.loader = loader
+        self.loaded = False
+        self._value = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> T:
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    start = perf_counter()
+                    self._value = self.loader()
+                    startup_times[self.name] = perf_counter() - start
+                    self.loaded = True
+        return self._value
+
+    def set(self, value: T):
+        """
+        Replace the resource, e.g. after it was rebuilt.
+        """
+        with self._lock:
+            self._value = value
+            self.loaded = True
+
+    def reset(self):
+        """
+        Drop the resource, it is loaded again on next use.
+        """
+        with self._lock:
+            self._value = None
+            self.loaded = False
+
 class DocumentInfo(BaseModel):
     mtime: float
     hash: str
@@ -29,6 +77,81 @@ def list_documents(base_path: str) -> List[Document]:
 
     return documents
 
+# fields of a review kept from the TSKV datasets, in order
+REVIEW_FIELDS = ('name_ru', 'rubrics', 'text')
+
+# file metadata not used for embeddings or by the LLM, as in SimpleDirectoryReader
+EXCLUDED_FILE_METADATA_KEYS = [
+    'file_name',
+    'file_type',
+    'file_size',
+    'creation_date',
+    'last_modified_date',
+    'last_accessed_date',
+]
+
+# namespace of the deterministic review ids, see review_id
+REVIEW_ID_NAMESPACE = uuid.UUID('1b4e28ba-2fa1-4d3b-9c6a-5f0e2c8d7a31')
+
+def review_id(file_name: str, text: str) -> str:
+    """
+    Return a deterministic id of a review derived from its file name and content,
+    a review keeps its id, and its point in the vector store, until it changes.
+    """
+    return str(uuid.uuid5(REVIEW_ID_NAMESPACE, f'{file_name}\n{text}'))
+
+def list_dataset_files(
+    base_path: str,
+    exts: List[str] = settings.RAG_SETTINGS['DATASET_EXTS'],
+) -> List[str]:
+    """
+    List dataset files with one of the given extensions, sorted by path.
+    """
+    return sorted(
+        osp.join(base_path, name)
+        for name in os.listdir(base_path)
+        if not name.startswith('.')
+        and osp.splitext(name)[1] in exts
+        and osp.isfile(osp.join(base_path, name))
+    )
+
+def iter_reviews(file_path: str) -> Iterator[Dict[str, str]]:
+    """
+    Read a TSKV dataset file one line at a time and yield one review per line.
+
+    Args:
+        file_path (str): The path to the file, e.g. a split of geo-reviews-dataset-2023.tskv
+            or the full dataset.
+
+    Returns:
+        Iterator[Dict[str, str]]: The REVIEW_FIELDS of each non-empty line, missing fields are ''.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            fields = dict(part.partition('=')[::2] for part in line.split('\t'))
+            yield {field: fields.get(field, '') for field in REVIEW_FIELDS}
+
+def iter_review_documents(file_paths: Iterable[str]) -> Iterator[Document]:
+    """
+    Yield one document per review of the dataset files, without loading any file fully.
+    Documents carry the same file metadata as documents of SimpleDirectoryReader
+    and the review_id of the review as id.
+    """
+    for file_path in file_paths:
+        metadata = default_file_metadata_func(file_path)
+        for review in iter_reviews(file_path):
+            text = '\t'.join(f'{field}={review[field]}' for field in REVIEW_FIELDS)
+            yield Document(
+                id_=review_id(metadata['file_name'], text),
+                text=text,
+                metadata=dict(metadata),
+                excluded_embed_metadata_keys=list(EXCLUDED_FILE_METADATA_KEYS),
+                excluded_llm_metadata_keys=list(EXCLUDED_FILE_METADATA_KEYS),
+            )
+
 def get_file_info(file_path: str) -> DocumentInfo:
     """
     Retrieves the modification time and hash of a file.
@@ -119,6 +242,3 @@ def filter_documents(documents: List[Document], cache_path: str) -> List[Documen
     build_and_cache_documents_info(cache_path, documents)
 
     return new_documents
-
-
-
@@ -2,19 +2,206 @@
 #
 # SPDX-License-Identifier: MIT
 
-from rest_framework import viewsets
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
+from prometheus_client import CONTENT_TYPE_LATEST
 from drf_spectacular.utils import (
     extend_schema_view, extend_schema
 )
+from qdrant_client.http.models import ScoredPoint
+
+from simple_rag.apps.core.models import (TextRequest, QueryTextRequest, QueryTextsRequest,
+    ProcessTextResponse, QueryBatchResponse, StatsResponse)
+from simple_rag.apps.core.serializers import (TextRequestSerializer, TextsRequestSerializer,
+    QueryTextRequestSerializer, QueryTextsRequestSerializer, ProcessTextResponseSerializer, QueryRequestSerializer,
+    QueryRequest, QueryBatchResponseSerializer, StatsResponseSerializer, ReadinessResponseSerializer)
+from simple_rag.apps.core.pipeline import process_text, process_texts, get_lemma_cache
+from simple_rag.apps.core.qdrant import (RUBRICS_SEPARATOR, get_query_engine, create_query_engine,
+    search_sparse_batch, asearch_sparse)
+from simple_rag.apps.core.inverted_index import current_inverted_index
+from simple_rag.apps.core.warmup import warmup_done, start_warm_up, get_readiness
+from simple_rag.apps.core.cache import QueryResultCache
+from simple_rag.apps.core.metrics import query_stage, render_metrics
+from simple_rag.apps.core.parsers import JSONArrayParser, NDJSONParser
+from simple_rag.apps.core.renderers import SimpleRagAPIRenderer, NDJSONRenderer
+
+query_cache = QueryResultCache()
+# spaCy and cache lookups of the async query view run here, off the event loop
+query_executor = ThreadPoolExecutor(
+    max_workers=settings.RAG_SETTINGS['QUERY']['ASYNC_NLP_WORKERS'],
+    thread_name_prefix='rag-query',
+)
+
+def normalize_query(text: str) -> str:
+    """
+    Return the normalized query string of a text, cached by the raw text.
+    """
+    tokens = query_cache.get_tokens(text)
+    if tokens is None:
+        with query_stage('normalize'):
+            tokens = process_text(text)
+        query_cache.set_tokens(text, tokens)
+    return ' '.join(tokens)
+
+def normalize_queries(texts: List[str]) -> List[str]:
+    """
+    Return the normalized query strings of many texts,
+    texts missing from the cache are normalized in one batch.
+    """
+    all_tokens = [query_cache.get_tokens(text) for text in texts]
+    misses = [i for i, tokens in enumerate(all_tokens) if tokens is None]
+    if misses:
+        with query_stage('normalize'):
+            for i, tokens in zip(misses, process_texts(texts[i] for i in misses)):
+                all_tokens[i] = tokens
+        for i in misses:
+            query_cache.set_tokens(texts[i], all_tokens[i])
+    return [' '.join(tokens) for tokens in all_tokens]
+
+def process_batch_lines(batch: List[Any], batch_size: int) -> str:
+    """
+    Normalize a batch of texts or {"text": ...} objects and return their NDJSON lines.
+    """
+    texts = [item.get('text') if isinstance(item, dict) else item for item in batch]
+    valid_texts = [text for text in texts if isinstance(text, str) and text]
+    all_tokens = process_texts(valid_texts, batch_size=batch_size, n_process=1)
+    lines = []
+    for text in texts:
+        if isinstance(text, str) and text:
+            data = ProcessTextResponseSerializer(
+                ProcessTextResponse(
+                    tokens=next(all_tokens)
+            )).data
+        else:
+            data = {'error': 'text should not be empty'}
+        lines.append(json.dumps(data, ensure_ascii=False) + '\n')
+    return ''.join(lines)
+
+def process_next_batch(items: Iterator[Any], batch_size: int) -> Tuple[str, bool]:
+    """
+    Read the next batch of items from the body and return its NDJSON lines,
+    with whether the body is done.
+    """
+    batch = []
+    try:
+        batch.extend(islice(items, batch_size))
+    except ParseError as e:
+        # the response has already started, report the error in the stream
+        error = json.dumps({'error': str(e.detail)}, ensure_ascii=False) + '\n'
+        return process_batch_lines(batch, batch_size) + error, True
+    if not batch:
+        return '', True
+    return process_batch_lines(batch, batch_size), False
 
-from simple_rag.apps.core.models import TextRequest, ProcessTextResponse
-from simple_rag.apps.core.serializers import TextRequestSerializer, ProcessTextResponseSerializer, QueryRequestSerializer, QueryRequest
-from simple_rag.apps.core.pipeline import process_text
-from simple_rag.apps.core.qdrant import create_query_engine
+async def stream_processed_texts(
+    items: Iterator[Any],
+    batch_size: int = settings.RAG_SETTINGS['NLP']['BATCH_SIZE'],
+) -> AsyncIterator[str]:
+    """
+    Normalize texts in batches and yield NDJSON lines, one per item, in order.
+    An invalid item yields an error line, a malformed body ends the stream with one.
+    Each batch is read and normalized in a thread, so the ASGI server sends
+    the lines of a batch while the next one is processed.
+    """
+    done = False
+    while not done:
+        lines, done = await sync_to_async(process_next_batch, thread_sensitive=False)(items, batch_size)
+        if lines:
+            yield lines
 
-query_engine = create_query_engine()
+def request_items(request) -> Iterator[Any]:
+    """
+    Return the items of a process_batch body as they are parsed.
+    DRF reads no body without a Content-Length, e.g. a chunked NDJSON upload,
+    so such a body is parsed from the underlying request.
+    """
+    meta = request.META
+    if 'CONTENT_LENGTH' in meta or 'HTTP_CONTENT_LENGTH' in meta:
+        items = request.data
+    else:
+        parser = request.negotiator.select_parser(request, request.parsers)
+        if parser is None:
+            raise ParseError(f'unsupported media type {request.content_type}')
+        items = parser.parse(request._request, request.content_type, request.parser_context)
+    if not isinstance(items, Iterator):
+        raise ParseError('expected a list of texts')
+    return items
+
+def get_query_filters(request: Union[QueryTextRequest, QueryTextsRequest]) -> Dict[str, str]:
+    """
+    Return the payload keyword each result must have, by field.
+    """
+    filters = {'rubrics': request.rubric, 'name_ru': request.name_ru}
+    return {field: value for field, value in filters.items() if value}
+
+def get_query_params(mode: str = settings.RAG_SETTINGS['QUERY']['MODE'], filters: Optional[Dict] = None) -> Dict:
+    """
+    Return the parameters query results depend on.
+    """
+    params = {
+        'similarity_top_k': settings.RAG_SETTINGS['QUERY']['SIMILARITY_TOP_K'],
+        'sparse_top_k': settings.RAG_SETTINGS['QUERY']['SPARSE_TOP_K'],
+        'mode': mode,
+    }
+    if filters:
+        params['filters'] = filters
+    return params
+
+def use_inverted_index() -> bool:
+    return settings.RAG_SETTINGS['QUERY']['BACKEND'] == 'inverted_index'
+
+def query_mode() -> str:
+    # the inverted index searches sparse vectors only
+    return 'sparse' if use_inverted_index() else settings.RAG_SETTINGS['QUERY']['MODE']
+
+def search_batch(queries: List[str], limit: int, filters: Optional[Dict[str, str]] = None) -> List[List[ScoredPoint]]:
+    """
+    Search the sparse vectors of normalized queries with the configured backend.
+    """
+    if use_inverted_index():
+        return current_inverted_index().search_batch(queries, limit, filters=filters)
+    return search_sparse_batch(queries, limit=limit, filters=filters)
+
+def search_engine(query: str, filters: Optional[Dict[str, str]] = None) -> List[QueryRequest]:
+    """
+    Search a normalized query with the query engine, in the configured QUERY mode.
+    """
+    with query_stage('engine'):
+        # the shared query engine searches all points
+        query_engine = create_query_engine(filters=filters) if filters else get_query_engine()
+        response = query_engine.query(query)
+    return [
+        payload_to_query_request(node.metadata, node.get_score())
+        for node in response.source_nodes
+    ]
+
+def payload_to_query_request(payload: Dict, score: float) -> QueryRequest:
+    """
+    Build a query result from the payload of a point, see PAYLOAD_FIELDS.
+    """
+    return QueryRequest(
+        dataset=payload['file_name'],
+        text=payload['review_text'],
+        additional_metadata={
+            'name_ru': payload['name_ru'],
+            # rubrics are stored as a list, see compact_payload
+            'rubrics': RUBRICS_SEPARATOR.join(payload['rubrics']),
+        },
+        score=score
+    )
 
 @extend_schema(tags=['rag'])
 @extend_schema_view(
@@ -25,13 +212,36 @@ query_engine = create_query_engine()
             200: ProcessTextResponseSerializer,
         }
     ),
+    process_batch=extend_schema(
+        summary='Process many texts and stream normalized tokens as NDJSON',
+        request={
+            'application/json': TextsRequestSerializer,
+            'application/x-ndjson': TextRequestSerializer,
+        },
+        responses={
+            (200, 'application/x-ndjson'): ProcessTextResponseSerializer,
+        }
+    ),
     query=extend_schema(
         summary='Search fo top 3 most relevant texts from vector database',
-        request=TextRequestSerializer,
+        request=QueryTextRequestSerializer,
         responses={
             200: QueryRequestSerializer(many=True),
         }
     ),
+    query_batch=extend_schema(
+        summary='Search for the most relevant texts of many queries at once',
+        request=QueryTextsRequestSerializer,
+        responses={
+            200: QueryBatchResponseSerializer,
+        }
+    ),
+    stats=extend_schema(
+        summary='Return hit and miss counters of the caches',
+        responses={
+            200: StatsResponseSerializer,
+        }
+    ),
 )
 class RAGView(viewsets.ViewSet):
     @action(detail=False, methods=['post'])
@@ -52,32 +262,199 @@ class RAGView(viewsets.ViewSet):
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
+    @action(detail=False, methods=['post'],
+        parser_classes=[JSONArrayParser, NDJSONParser],
+        renderer_classes=[SimpleRagAPIRenderer, NDJSONRenderer])
+    def process_batch(self, request):
+        """
+        Process many texts and stream normalized tokens as NDJSON, one line per text.
+        The body is a JSON array, a {"texts": [...]} object or NDJSON lines
+        of texts or {"text": ...} objects, parsed as the lines are streamed.
+        """
+        try:
+            response = StreamingHttpResponse(
+                stream_processed_texts(request_items(request), settings.RAG_SETTINGS['NLP']['BATCH_SIZE']),
+                content_type=NDJSONRenderer.media_type,
+            )
+            # proxies such as nginx would buffer the whole stream
+            response['X-Accel-Buffering'] = 'no'
+            return response
+        except Exception as e:
+            return Response({'error': str(e)}, status=400)
+
     @action(detail=False, methods=['post'])
     def query(self, request) -> Response:
         """
         Search fo top 3 most relevant texts from vector database.
+        Results can be restricted to a rubric or a place name.
         """
         try:
-            request_serializer = TextRequestSerializer(data=request.data)
+            request_serializer = QueryTextRequestSerializer(data=request.data)
             request_serializer.is_valid(raise_exception=True)
-            request: TextRequest = request_serializer.validated_data
-            response = query_engine.query(
-                ' '.join(process_text(request.text)),
-            )
-            data = []
-            for node in response.source_nodes:
-                data.append(QueryRequest(
-                    dataset=node.metadata['file_name'],
-                    text=node.metadata['review_text'],
-                    additional_metadata={
-                        'name_ru': node.metadata['name_ru'],
-                        'rubrics': node.metadata['rubrics'],
-                    },
-                    score=node.get_score()
+            request: QueryTextRequest = request_serializer.validated_data
+            query = normalize_query(request.text)
+            filters = get_query_filters(request)
+            query_params = get_query_params(mode=query_mode(), filters=filters)
+            data = query_cache.get_results(query, **query_params)
+            if data is None:
+                if use_inverted_index():
+                    data = [
+                        payload_to_query_request(point.payload, point.score)
+                        for point in search_batch([query], query_params['sparse_top_k'], filters)[0]
+                    ]
+                else:
+                    data = search_engine(query, filters)
+                query_cache.set_results(query, data, **query_params)
+            with query_stage('serialize'):
+                serializer = QueryRequestSerializer(
+                    data, many=True
+                )
+                return Response(serializer.data)
+        except Exception as e:
+            return Response({'error': str(e)}, status=400)
+
+    @action(detail=False, methods=['post'])
+    def query_batch(self, request) -> Response:
+        """
+        Search for the most relevant texts of many queries at once.
+        Queries are normalized in one batch and searched with Qdrant batch requests,
+        or with the inverted index. Queries in the 'hybrid' or dense QUERY mode
+        are searched one by one with the query engine.
+        """
+        try:
+            request_serializer = QueryTextsRequestSerializer(data=request.data)
+            request_serializer.is_valid(raise_exception=True)
+            request: QueryTextsRequest = request_serializer.validated_data
+            queries = normalize_queries(request.texts)
+            filters = get_query_filters(request)
+            query_params = get_query_params(mode=query_mode(), filters=filters)
+            results = [query_cache.get_results(query, **query_params) for query in queries]
+            # identical queries are searched once
+            missing_queries = list(dict.fromkeys(
+                query for query, data in zip(queries, results) if data is None
+            ))
+            found = {}
+            if missing_queries and query_params['mode'] != 'sparse':
+                for query in missing_queries:
+                    found[query] = search_engine(query, filters)
+                    query_cache.set_results(query, found[query], **query_params)
+            elif missing_queries:
+                points = search_batch(missing_queries, query_params['sparse_top_k'], filters)
+                for query, query_points in zip(missing_queries, points):
+                    found[query] = [
+                        payload_to_query_request(point.payload, point.score)
+                        for point in query_points
+                    ]
+                    query_cache.set_results(query, found[query], **query_params)
+            with query_stage('serialize'):
+                serializer = QueryBatchResponseSerializer(
+                    QueryBatchResponse(
+                        results=[found[query] if data is None else data for query, data in zip(queries, results)]
                 ))
+                return Response(serializer.data)
+        except Exception as e:
+            return Response({'error': str(e)}, status=400)
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request) -> Response:
+        """
+        Return hit and miss counters of the caches.
+        """
+        caches = {
+            'query': query_cache.stats(),
+        }
+        lemma_cache = get_lemma_cache()
+        if lemma_cache is not None:
+            caches['lemma'] = lemma_cache.stats()
+        serializer = StatsResponseSerializer(
+            StatsResponse(
+                caches=caches
+        ))
+        return Response(serializer.data)
+
+@extend_schema(tags=['health'])
+@extend_schema_view(
+    ready=extend_schema(
+        summary='Return whether the worker is warm and ready to serve queries',
+        responses={
+            200: ReadinessResponseSerializer,
+            503: ReadinessResponseSerializer,
+        }
+    ),
+)
+class HealthView(viewsets.ViewSet):
+    @action(detail=False, methods=['get'])
+    def ready(self, request) -> Response:
+        """
+        Return whether the worker is warm, with the time spent loading each component.
+        A worker that is not ready retries its warm-up in the background with backoff,
+        e.g. until Qdrant is reachable, the probe itself never waits for it.
+        """
+        if not warmup_done.is_set():
+            start_warm_up()
+        readiness = get_readiness()
+        serializer = ReadinessResponseSerializer(readiness)
+        return Response(
+            serializer.data,
+            status=status.HTTP_200_OK if readiness.ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+def lookup_query(text: str, query_params: Dict) -> Tuple[str, Optional[List[QueryRequest]]]:
+    """
+    Normalize a query text and return it with its cached results, if any.
+    """
+    query = normalize_query(text)
+    return query, query_cache.get_results(query, **query_params)
+
+@csrf_exempt
+@require_POST
+async def query_async(request: HttpRequest) -> HttpResponse:
+    """
+    Search fo top 3 most relevant texts from vector database, asynchronously.
+    Normalization runs in a bounded thread pool and the search uses the
+    asynchronous Qdrant client, so a worker keeps many searches in flight.
+    Queries in the 'hybrid' or dense QUERY mode run the query engine in the thread pool.
+    """
+    try:
+        request_serializer = QueryTextRequestSerializer(data=json.loads(request.body))
+        request_serializer.is_valid(raise_exception=True)
+        text_request: QueryTextRequest = request_serializer.validated_data
+        filters = get_query_filters(text_request)
+        query_params = get_query_params(mode=query_mode(), filters=filters)
+
+        loop = asyncio.get_running_loop()
+        query, data = await loop.run_in_executor(query_executor, lookup_query, text_request.text, query_params)
+        if data is None:
+            if query_params['mode'] != 'sparse':
+                data = await loop.run_in_executor(query_executor, search_engine, query, filters)
+            else:
+                if use_inverted_index():
+                    points = (await loop.run_in_executor(
+                        query_executor, search_batch, [query], query_params['sparse_top_k'], filters
+                    ))[0]
+                else:
+                    points = await asearch_sparse(query, limit=query_params['sparse_top_k'], filters=filters)
+                data = [payload_to_query_request(point.payload, point.score) for point in points]
+            await loop.run_in_executor(
+                query_executor, lambda: query_cache.set_results(query, data, **query_params)
+            )
+        with query_stage('serialize'):
             serializer = QueryRequestSerializer(
                 data, many=True
             )
-            return Response(serializer.data)
-        except Exception as e:
-            return Response({'error': str(e)}, status=400)
+            content = SimpleRagAPIRenderer().render(serializer.data)
+        return HttpResponse(content, content_type=SimpleRagAPIRenderer.media_type)
+    except Exception as e:
+        return HttpResponse(
+            SimpleRagAPIRenderer().render({'error': str(e)}),
+            status=400,
+            content_type=SimpleRagAPIRenderer.media_type,
+        )
+
+@require_GET
+def metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Return request, stage latency and cache metrics in the Prometheus text format,
+    aggregated over all workers.
+    """
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE_LATEST)
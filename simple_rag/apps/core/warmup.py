@@ -0,0 +1,93 @@
+# Copyright (C) 2024 Ibrahem Mouhamad
+#
+# SPDX-License-Identifier: MIT
+
+import threading
+from time import perf_counter, sleep
+from typing import Optional
+
+from django.conf import settings
+
+from simple_rag.apps.core.models import ReadinessResponse
+from simple_rag.apps.core.pipeline import process_text, get_nlp, get_lemma_cache, get_vectorizer
+from simple_rag.apps.core.qdrant import get_query_engine
+from simple_rag.apps.core.inverted_index import current_inverted_index
+from simple_rag.apps.core.utils import startup_times
+
+warmup_lock = threading.Lock()
+# set once a warm-up succeeded, the process is then ready to serve queries
+warmup_done = threading.Event()
+warmup_error: Optional[str] = None
+# background retries of a failed warm-up, see start_warm_up
+warmup_thread: Optional[threading.Thread] = None
+warmup_thread_lock = threading.Lock()
+
+def warm_up(text: str = settings.RAG_SETTINGS['WARMUP']['TEXT']) -> bool:
+    """
+    Load all lazy resources and run a dummy normalization and query,
+    so that the first requests don't pay for it. Each step is timed in startup_times.
+    Returns whether the process is ready, a failed warm-up can be retried.
+    """
+    global warmup_error
+    with warmup_lock:
+        if warmup_done.is_set():
+            return True
+        try:
+            get_nlp()
+            get_lemma_cache()
+            get_vectorizer()
+
+            start = perf_counter()
+            query = ' '.join(process_text(text))
+            startup_times['warmup_normalization'] = perf_counter() - start
+
+            if settings.RAG_SETTINGS['QUERY']['BACKEND'] == 'inverted_index':
+                # fails if init_index didn't build the inverted index yet
+                start = perf_counter()
+                current_inverted_index().search_batch([query])
+                startup_times['warmup_query'] = perf_counter() - start
+            elif (query_engine := get_query_engine()) is not None:
+                # fails if Qdrant is unreachable or the index is not built yet
+                start = perf_counter()
+                query_engine.query(query)
+                startup_times['warmup_query'] = perf_counter() - start
+        except Exception as e:
+            warmup_error = str(e)
+            return False
+
+        warmup_error = None
+        warmup_done.set()
+        return True
+
+def retry_warm_up(
+    interval: float = settings.RAG_SETTINGS['WARMUP']['RETRY_INTERVAL'],
+    max_interval: float = settings.RAG_SETTINGS['WARMUP']['RETRY_MAX_INTERVAL'],
+) -> None:
+    """
+    Warm up until it succeeds, waiting interval seconds after the first failure
+    and twice as long after each following one, up to max_interval.
+    """
+    while not warm_up():
+        sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+def start_warm_up() -> threading.Thread:
+    """
+    Run retry_warm_up in a daemon thread unless one is already running, and return that thread.
+    """
+    global warmup_thread
+    with warmup_thread_lock:
+        if warmup_thread is None or not warmup_thread.is_alive():
+            warmup_thread = threading.Thread(target=retry_warm_up, name='warm-up', daemon=True)
+            warmup_thread.start()
+        return warmup_thread
+
+def get_readiness() -> ReadinessResponse:
+    """
+    Return whether the process is warm, with the time spent loading each component.
+    """
+    return ReadinessResponse(
+        ready=warmup_done.is_set(),
+        startup_times=startup_times,
+        error=warmup_error,
+    )
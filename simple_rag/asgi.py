@@ -13,9 +13,18 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "simple_rag.settings.development")
 
 application = get_asgi_application()
+
+# warm up before accepting connections, so a worker only receives traffic
+# once models are loaded, a failed warm-up is retried in the background
+if settings.RAG_SETTINGS["WARMUP"]["ON_STARTUP"]:
+    from simple_rag.apps.core.warmup import warm_up, start_warm_up
+
+    if not warm_up():
+        start_warm_up()
@@ -104,6 +104,7 @@ REST_FRAMEWORK = {
 
 
 MIDDLEWARE = [
+    'simple_rag.apps.core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -306,21 +307,151 @@ ENABLE_ENGINE = True
 QDRANT_GATEWAY = {
     'HOST': os.getenv('QDRANT_HOST', 'qdrant'),
     'PORT': os.getenv('QDRANT_PORT', 6333),
+    # run Qdrant in process instead of connecting to the server:
+    # a storage folder, or ':memory:' for a collection that lives as long as the process
+    'PATH': os.getenv('QDRANT_PATH', ''),
+    'GRPC_PORT': int(os.getenv('QDRANT_GRPC_PORT', 6334)),
+    # the query and ingest paths use separately tuned clients, see create_client.
+    # gRPC sends vectors as protobuf instead of JSON; POOL_SIZE and KEEPALIVE_EXPIRY
+    # apply to REST connections, gRPC multiplexes calls over one HTTP/2 channel
+    # pinged every GRPC_KEEPALIVE seconds. TIMEOUT is the timeout of each call, in seconds.
+    'CLIENTS': {
+        'query': {
+            'PREFER_GRPC': os.getenv('QDRANT_PREFER_GRPC', 'false').lower() == 'true',
+            'TIMEOUT': int(os.getenv('QDRANT_QUERY_TIMEOUT', 10)),
+            'POOL_SIZE': int(os.getenv('QDRANT_QUERY_POOL_SIZE', 32)),
+            'KEEPALIVE_EXPIRY': 60,
+            'GRPC_KEEPALIVE': 60,
+        },
+        'ingest': {
+            'PREFER_GRPC': os.getenv('QDRANT_PREFER_GRPC', 'false').lower() == 'true',
+            'TIMEOUT': int(os.getenv('QDRANT_INGEST_TIMEOUT', 300)),
+            # at least INGEST['UPLOAD_WORKERS']
+            'POOL_SIZE': int(os.getenv('QDRANT_INGEST_POOL_SIZE', 8)),
+            'KEEPALIVE_EXPIRY': 60,
+            'GRPC_KEEPALIVE': 60,
+        },
+    },
 }
 
 # RAG settings
 RAG_SETTINGS = {
+    # llama-index embedding model, e.g. HuggingFaceEmbedding, overrides EMBEDDING
     'EMBED_MODEL': None,
+    # dense embeddings computed offline with a spaCy pipeline, see SpacyEmbedding
+    'EMBEDDING': {
+        # installed spaCy pipeline or local path, e.g. ru_core_news_lg, None disables dense vectors
+        'MODEL': os.getenv('RAG_EMBEDDING_MODEL') or None,
+        # components not needed to compute token vectors or tensors
+        'EXCLUDE': ['parser', 'ner', 'lemmatizer', 'attribute_ruler', 'morphologizer', 'senter'],
+        # texts encoded per batch, processes of nlp.pipe and threads of the numerical
+        # libraries while encoding, None keeps their default
+        'BATCH_SIZE': int(os.getenv('RAG_EMBEDDING_BATCH_SIZE', 64)),
+        'N_PROCESS': 1,
+        'THREADS': int(os.getenv('RAG_EMBEDDING_THREADS', 0)) or None,
+        # embeddings cached by the hash of their text
+        'CACHE': {
+            'MAX_SIZE': 200_000,
+            'PERSIST': True,
+        },
+    },
     'LLM': None,
     'DATASET_EXTS': ['.txt'],
+    'NLP': {
+        'MODEL': 'ru_core_news_sm',
+        # normalization profiles, only lemma_, is_alpha, is_stop and is_punct
+        # are used so components listed in EXCLUDE are not loaded at all
+        'PROFILE': os.getenv('NLP_PROFILE', 'full'),
+        'PROFILES': {
+            'full': {
+                'EXCLUDE': [],
+            },
+            'lemma-only': {
+                'EXCLUDE': ['parser', 'ner'],
+            },
+        },
+        # bounded LRU cache of (surface form, POS, morphology) -> lemma, the lemmatizer
+        # only runs for texts with unseen tokens (MAX_SIZE = 0 disables it)
+        'LEMMA_CACHE': {
+            'MAX_SIZE': 500_000,
+            'PERSIST': True,
+        },
+        # number of texts buffered per spaCy batch and worker processes used
+        # to normalize them during ingestion (-1 to use all cores)
+        'BATCH_SIZE': 256,
+        'N_PROCESS': int(os.getenv('NLP_N_PROCESS', 1)),
+    },
+    # number of documents read, normalized and inserted at a time by
+    # init_index, with QUEUE_DEPTH it bounds memory use regardless of the dataset size
+    'INGEST': {
+        'WINDOW_SIZE': 1024,
+        # normalization processes (1 normalizes in a thread of init_index,
+        # with NLP N_PROCESS spaCy processes), vectorization and upload threads
+        'NORMALIZE_WORKERS': int(os.getenv('INGEST_NORMALIZE_WORKERS', 1)),
+        'VECTORIZE_WORKERS': int(os.getenv('INGEST_VECTORIZE_WORKERS', 1)),
+        'UPLOAD_WORKERS': int(os.getenv('INGEST_UPLOAD_WORKERS', 4)),
+        # target size of an upload request, points are batched by their estimated size
+        'UPLOAD_BATCH_BYTES': int(os.getenv('INGEST_UPLOAD_BATCH_BYTES', 4 * 1024 * 1024)),
+        # windows queued per stage beyond those being processed
+        'QUEUE_DEPTH': 2,
+        # threads hashing new or modified dataset files
+        'HASH_WORKERS': 4,
+    },
+    # dummy normalization and query run before a worker serves traffic,
+    # see simple_rag.apps.core.warmup
+    'WARMUP': {
+        'ON_STARTUP': os.getenv('RAG_WARMUP', 'true').lower() == 'true',
+        'TEXT': 'Отличный магазин, вежливый персонал',
+        # seconds between retries of a failed warm-up, doubled after each failure up to the max
+        'RETRY_INTERVAL': float(os.getenv('RAG_WARMUP_RETRY_INTERVAL', 1)),
+        'RETRY_MAX_INTERVAL': float(os.getenv('RAG_WARMUP_RETRY_MAX_INTERVAL', 30)),
+    },
     'VECTOR_STORE': {
         'COLLECTION_NAME': 'user_reviews',
         'BATCH_SIZE': 100,
         'ENABLE_HYBRID': True,
+        # 'tfidf' stores TF-IDF weights of a vocabulary fitted by init_index,
+        # 'idf' stores term frequencies and lets Qdrant compute IDF, appends need no refit
+        'SPARSE_MODE': os.getenv('VECTOR_STORE_SPARSE_MODE', 'tfidf'),
+        # number of point ids per scroll or delete request of a reindex
+        'SCROLL_BATCH_SIZE': 1000,
+        # storage of the collection, applied when it is created, see show_collection.
+        # Vectors and indexes in RAM answer fastest, e.g. on query nodes; on disk they are
+        # memory-mapped and leave RAM to the page cache, e.g. on archival nodes.
+        # Thresholds are in KB, None keeps the default of the Qdrant server.
+        'STORAGE': {
+            'DENSE_ON_DISK': os.getenv('VECTOR_STORE_DENSE_ON_DISK', 'false').lower() == 'true',
+            'SPARSE_INDEX_ON_DISK': os.getenv('VECTOR_STORE_SPARSE_INDEX_ON_DISK', 'false').lower() == 'true',
+            'HNSW_ON_DISK': os.getenv('VECTOR_STORE_HNSW_ON_DISK', 'false').lower() == 'true',
+            'PAYLOAD_ON_DISK': os.getenv('VECTOR_STORE_PAYLOAD_ON_DISK', 'true').lower() == 'true',
+            # segments larger than this are memory-mapped
+            'MEMMAP_THRESHOLD': int(os.getenv('VECTOR_STORE_MEMMAP_THRESHOLD', 0)) or None,
+            # segments larger than this get a vector index, smaller ones are searched in full
+            'INDEXING_THRESHOLD': int(os.getenv('VECTOR_STORE_INDEXING_THRESHOLD', 0)) or None,
+            # segments searched in parallel, about the number of CPUs of a query node
+            'SEGMENT_NUMBER': int(os.getenv('VECTOR_STORE_SEGMENT_NUMBER', 0)) or None,
+        },
     },
     'QUERY': {
-        'MODE': 'sparse',
+        # 'sparse', or 'hybrid' to fuse dense and sparse results, see EMBEDDING
+        'MODE': os.getenv('RAG_QUERY_MODE', 'sparse'),
+        # 'rrf' for reciprocal rank fusion of hybrid results, 'relative_score' for llama-index's default
+        'FUSION': 'rrf',
+        'RRF_K': 60,
+        # dense and sparse candidates fetched per hybrid query, fused into SIMILARITY_TOP_K results
+        'HYBRID_CANDIDATES': 20,
+        # 'qdrant' searches the collection, 'inverted_index' searches sparse vectors
+        # in process with an inverted index of the collection built by init_index
+        'BACKEND': os.getenv('RAG_QUERY_BACKEND', 'qdrant'),
         'SIMILARITY_TOP_K': 3,
         'SPARSE_TOP_K': 3,
+        # number of queries sent per Qdrant batch search request
+        'BATCH_SIZE': 256,
+        # threads normalizing queries of the async query view, bounding
+        # the spaCy work done concurrently by one worker
+        'ASYNC_NLP_WORKERS': 2,
+        # seconds cached query tokens and results are kept, a change of the index
+        # drops results earlier (USE_CACHE = False disables the cache)
+        'CACHE_TIMEOUT': int(os.getenv('RAG_QUERY_CACHE_TIMEOUT', 24 * 60 * 60)),
     }
 }
@@ -17,6 +17,8 @@ os.makedirs(DATASETS_ROOT, exist_ok=True)
 CACHE_ROOT = os.path.join(DATA_ROOT, "cache")
 os.makedirs(CACHE_ROOT, exist_ok=True)
 
+CACHES["default"]["LOCATION"] = CACHE_ROOT
+
 # Suppress all logs by default
 for logger in LOGGING["loggers"].values():
     if isinstance(logger, dict) and "level" in logger:
@@ -8,6 +8,9 @@
 # the backend depends on to start before executing the backend itself.
 
 ~/wait-for-it.sh "${SIMPLE_RAG_POSTGRES_HOST}:${DASHBOARD_POSTGRES_PORT:-5432}" -t 0
-~/wait-for-it.sh "${SIMPLE_RAG_QDRANT_HOST}:${SIMPLE_RAG_QDRANT_PORT}" -t 0
+# a local Qdrant runs in the backend process itself
+if [ -z "${QDRANT_PATH:-}" ]; then
+    ~/wait-for-it.sh "${SIMPLE_RAG_QDRANT_HOST}:${SIMPLE_RAG_QDRANT_PORT}" -t 0
+fi
 
 exec "$@"
\ No newline at end of file